@@ -0,0 +1,123 @@
+import argparse
+import os
+import sys
+import time
+import zipfile
+from typing import List, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+import manual_converter
+
+RAG_DATA_PATH = os.path.join(os.path.dirname(__file__), "..", "rag_data")
+# 実際の文書に含まれない可能性がある見出しの書き方
+EDGE_CASES = [
+    ("_sources/edge/double_rule.rst.txt", "Intro\n\nTitle\n=====\n-----\nbody\n"),
+    ("_sources/edge/overline.rst.txt", "=====\nTitle\n=====\nbody\n\nSub\n---\n"),
+    ("_sources/edge/first_line.rst.txt", "=====\nbody\n"),
+    ("_sources/edge/empty.rst.txt", ""),
+]
+
+
+def legacy_replace_decorative_lines(path: str, text: str) -> str:
+    """変更前のmanual_converterの処理。行毎に装飾記号の集合を作り、strip()を繰り返す"""
+    lines = text.splitlines()
+    result = []
+    for i, line in enumerate(lines):
+        if (
+            line.strip()
+            in {
+                "=" * len(line.strip()),
+                "*" * len(line.strip()),
+                "-" * len(line.strip()),
+                "^" * len(line.strip()),
+            }
+            and len(line.strip()) > 0
+        ):
+            if i > 0 and lines[i - 1].strip():
+                result.append(
+                    f"{manual_converter.AKARI_DOC_URL}"
+                    f"{manual_converter.convert_path_to_public_url(path)}"
+                    f"#{manual_converter.convert_parmlink(lines[i - 1])}"
+                )
+            else:
+                result.append(line)
+        else:
+            result.append(line)
+    return "\n".join(result)
+
+
+def load_documents(path: str) -> List[Tuple[str, str]]:
+    """docsのツリーからrst.txtを読み込む。見つからない場合はrag_data内のtxtを使う"""
+    documents = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for file in sorted(files):
+            if file.endswith(".txt"):
+                file_path = os.path.join(root, file)
+                with open(file_path, "r", encoding="utf-8") as f:
+                    documents.append((file_path, f.read()))
+    if len(documents) > 0:
+        return documents
+    print(f"No documents in {path}. Use texts in {RAG_DATA_PATH}")
+    for root, dirs, files in os.walk(RAG_DATA_PATH):
+        for file in sorted(files):
+            if file.endswith(".zip"):
+                with zipfile.ZipFile(os.path.join(root, file)) as z:
+                    for name in sorted(z.namelist()):
+                        if name.endswith(".txt"):
+                            documents.append(
+                                ("_sources/" + name, z.read(name).decode("utf-8"))
+                            )
+    return documents
+
+
+def measure(func, documents: List[Tuple[str, str]], repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for path, text in documents:
+            func(path, text)
+    return (time.perf_counter() - start) / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-p",
+        "--path",
+        type=str,
+        default="docs/_build/html/_sources/source",
+        help="Docs source path",
+    )
+    parser.add_argument("-n", "--repeat", type=int, default=10, help="Repeat count")
+    args = parser.parse_args()
+    documents = load_documents(args.path)
+    num_lines = sum(text.count("\n") + 1 for _, text in documents)
+    print(f"{len(documents)} files, {num_lines} lines")
+
+    mismatches = sum(
+        legacy_replace_decorative_lines(path, text)
+        != manual_converter.replace_decorative_lines_for_public_url(path, text)
+        for path, text in documents + EDGE_CASES
+    )
+    print(f"output mismatches: {mismatches}")
+    for path, text in EDGE_CASES:
+        # 変更前に変換できた入力は、節にも分割できること
+        list(manual_converter.iter_sections(path, text))
+    legacy = measure(legacy_replace_decorative_lines, documents, args.repeat)
+    single_pass = measure(
+        manual_converter.replace_decorative_lines_for_public_url,
+        documents,
+        args.repeat,
+    )
+    sections = measure(
+        lambda path, text: list(manual_converter.iter_sections(path, text)),
+        documents,
+        args.repeat,
+    )
+    print(f"legacy:         {legacy * 1000:.2f} [ms]")
+    print(f"single pass:    {single_pass * 1000:.2f} [ms] ({legacy / single_pass:.2f}x)")
+    print(f"iter_sections:  {sections * 1000:.2f} [ms]")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+from typing import List, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+# streamlit_serverはimage/talk.jpgを相対パスで読み込むため、リポジトリ直下で実行する
+os.chdir(os.path.join(os.path.dirname(__file__), ".."))
+from lib.link_sender import extract_link_candidates
+from lib.local_retriever import LocalRetriever
+from streamlit_server import IframePool, guess_content_type
+
+import streamlit_server_pb2
+
+RAG_DATA_PATH = "rag_data"
+DEFAULT_URL = "https://www.youtube.com/watch?v=hufXSDTFMVo&t=1s"
+# LLMが検索順位1位、2位、3位の候補のリンクを選ぶ割合
+CHOICE_WEIGHTS = [0.6, 0.25, 0.15]
+
+
+def create_sessions(
+    retriever: LocalRetriever,
+    num_questions: int,
+    off_candidate: float,
+    idle_interval: int,
+    seed: int,
+) -> List[Tuple[List[Tuple[str, float]], str]]:
+    """節の見出しを質問として検索し、(先読みする候補, LLMが選んだリンク)の列を作る
+
+    Returns:
+        List[Tuple[List[Tuple[str, float]], str]]: 質問毎の(候補, 表示するリンク)のリスト
+    """
+    rand = random.Random(seed)
+    all_urls = sorted(
+        {url for chunk in retriever.chunks for url, _ in extract_link_candidates([(chunk["content"], 0.0)], 100)}
+    )
+    sessions = []
+    while len(sessions) < num_questions:
+        chunk = rand.choice(retriever.chunks)
+        lines = [
+            line
+            for line in chunk["content"].splitlines()
+            if line.strip() != "" and "://" not in line and set(line.strip()) != {"*"}
+        ]
+        if len(lines) == 0:
+            continue
+        response = retriever.hybrid_search(text=lines[0], limit=3)
+        contexts = [
+            (o.properties["content"], getattr(o.metadata, "score", None) or 0.0)
+            for o in response.objects
+        ]
+        candidates = extract_link_candidates(contexts, limit=3)
+        if len(candidates) == 0 or rand.random() < off_candidate:
+            # 検索結果に含まれないリンクを選んだ場合
+            link = rand.choice(all_urls)
+        else:
+            weights = CHOICE_WEIGHTS[: len(candidates)]
+            link = rand.choices([url for url, _ in candidates], weights=weights)[0]
+        sessions.append((candidates, link))
+        if idle_interval > 0 and len(sessions) % idle_interval == 0:
+            # 話しかけられない時間が続き、紹介動画に戻る
+            sessions.append(([], DEFAULT_URL))
+    return sessions
+
+
+def load_time(content_type: int, preloaded: bool, args: argparse.Namespace) -> float:
+    """表示を切り替えてからコンテンツが見えるまでの時間の目安[s]"""
+    if content_type == streamlit_server_pb2.CONTENT_TYPE_YOUTUBE:
+        return args.youtube_warm if preloaded else args.youtube_load
+    if preloaded:
+        return 0.0
+    if content_type == streamlit_server_pb2.CONTENT_TYPE_IMAGE:
+        return args.image_load
+    return args.page_load
+
+
+def run(
+    sessions: List[Tuple[List[Tuple[str, float]], str]],
+    size: int,
+    memory_limit: float,
+    args: argparse.Namespace,
+) -> None:
+    pool = IframePool(size=size, memory_limit_mb=memory_limit)
+    pool.show(streamlit_server_pb2.DisplayCommand(url=DEFAULT_URL, content_type=guess_content_type(DEFAULT_URL)))
+    latencies = []
+    memories = []
+    loads = 0
+    for candidates, link in sessions:
+        if size > 1:
+            loads += len(
+                pool.preload(
+                    streamlit_server_pb2.PreloadCandidate(
+                        url=url, content_type=guess_content_type(url), score=score
+                    )
+                    for url, score in candidates
+                )
+            )
+        command = streamlit_server_pb2.DisplayCommand(
+            url=link, content_type=guess_content_type(link)
+        )
+        _, changed, preloaded = pool.show(command)
+        loads += len(changed)
+        latencies.append(load_time(command.content_type, preloaded, args))
+        memories.append(pool.memory_mb)
+    print(
+        f"{size:>5} {memory_limit:>8.0f} {pool.hits / (pool.hits + pool.misses) * 100:>7.1f} "
+        f"{statistics.mean(latencies) * 1000:>11.0f} "
+        f"{statistics.mean(memories):>9.0f} {max(memories):>8.0f} "
+        f"{loads / len(sessions):>11.2f} {pool.evictions:>9}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--num_questions", type=int, default=300, help="Questions")
+    parser.add_argument(
+        "-s", "--sizes", type=int, nargs="+", default=[1, 2, 3, 4, 6], help="Pool sizes"
+    )
+    parser.add_argument(
+        "-m",
+        "--memory_limits",
+        type=float,
+        nargs="+",
+        default=[256.0, 512.0],
+        help="Pool memory limits [MB]",
+    )
+    parser.add_argument(
+        "--off_candidate",
+        type=float,
+        default=0.1,
+        help="Ratio of links the LLM picks outside the search results",
+    )
+    parser.add_argument(
+        "--idle_interval",
+        type=int,
+        default=10,
+        help="Return to the default video every this many questions. 0 disables",
+    )
+    parser.add_argument(
+        "--page_load", type=float, default=1.5, help="Cold page load time [s]"
+    )
+    parser.add_argument(
+        "--youtube_load", type=float, default=2.0, help="Cold YouTube embed load time [s]"
+    )
+    parser.add_argument(
+        "--youtube_warm",
+        type=float,
+        default=0.8,
+        help="YouTube embed load time with a preloaded player [s]",
+    )
+    parser.add_argument(
+        "--image_load", type=float, default=0.3, help="Cold image load time [s]"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+    retriever = LocalRetriever.from_path(RAG_DATA_PATH)
+    sessions = create_sessions(
+        retriever, args.num_questions, args.off_candidate, args.idle_interval, args.seed
+    )
+    print(f"{len(sessions)} links")
+    print(
+        f"{'size':>5} {'limit MB':>8} {'hit [%]':>7} {'display [ms]':>11} "
+        f"{'mean MB':>9} {'peak MB':>8} {'loads/link':>11} {'evictions':>9}"
+    )
+    for memory_limit in args.memory_limits:
+        for size in args.sizes:
+            run(sessions, size, memory_limit, args)
+
+
+if __name__ == "__main__":
+    main()
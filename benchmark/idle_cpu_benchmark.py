@@ -0,0 +1,76 @@
+import argparse
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import time
+
+BUSY_WAIT_COMMAND = f'{sys.executable} -c "while True: pass"'
+BLOCKING_COMMAND = f'{sys.executable} -c "import threading; threading.Event().wait()"'
+
+
+def cpu_time(pid: int) -> float:
+    """/proc/<pid>/statからプロセスのCPU時間(user+system)を取得する
+
+    Args:
+        pid (int): プロセスID
+
+    Returns:
+        float: CPU時間[s]
+    """
+    with open(f"/proc/{pid}/stat", "r") as file:
+        fields = file.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def measure(command: str, warmup: float, duration: float) -> float:
+    """コマンドを起動し、待機中のCPU使用率を計測する
+
+    Args:
+        command (str): 計測するコマンド
+        warmup (float): 起動後、計測を開始するまでの時間[s]
+        duration (float): 計測時間[s]
+
+    Returns:
+        float: CPU使用率[%]
+    """
+    process = subprocess.Popen(shlex.split(command))
+    try:
+        time.sleep(warmup)
+        start_cpu = cpu_time(process.pid)
+        start = time.time()
+        time.sleep(duration)
+        usage = (cpu_time(process.pid) - start_cpu) / (time.time() - start) * 100
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return usage
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-c",
+        "--command",
+        nargs="+",
+        default=[BUSY_WAIT_COMMAND, BLOCKING_COMMAND],
+        help="Commands to measure. e.g. 'python3 introduce_gpt_publisher.py'",
+    )
+    parser.add_argument(
+        "-w", "--warmup", type=float, default=5.0, help="Warmup time [s]"
+    )
+    parser.add_argument(
+        "-d", "--duration", type=float, default=10.0, help="Measurement time [s]"
+    )
+    args = parser.parse_args()
+    for command in args.command:
+        usage = measure(command, args.warmup, args.duration)
+        print(f"{usage:6.1f} [%]  {command}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from typing import List, Sequence, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from lib.link_talk_backend import LINK_FIRST, TALK_FIRST
+from lib.link_talk_parser import LinkTalkStreamParser
+from parse_benchmark import LAST_CHAR, SAMPLE_ANSWERS
+
+RAG_DATA_PATH = os.path.join(os.path.dirname(__file__), "..", "rag_data")
+ORDERS = [("link first", LINK_FIRST), ("talk first", TALK_FIRST)]
+QUESTIONS = ["AKARIって何?", "カメラの性能は?", "何ができるの?", "YOLOで物体認識できる?"]
+
+
+def simulate(
+    field_order: Sequence[str],
+    first_token_delay: float,
+    chunk_interval: float,
+    num_streams: int,
+    seed: int,
+) -> Tuple[List[float], List[float]]:
+    """指定した順序のjsonをチャンクに分けて解析し、最初の文とリンクが確定する時刻を求める
+
+    Returns:
+        Tuple[List[float], List[float]]: 最初の文までの時間と、リンクまでの時間[s]のリスト
+    """
+    rand = random.Random(seed)
+    first_sentences = []
+    links = []
+    for i in range(num_streams):
+        link, talk = SAMPLE_ANSWERS[i % len(SAMPLE_ANSWERS)]
+        values = {"link": link, "talk": talk}
+        arguments = json.dumps({k: values[k] for k in field_order}, ensure_ascii=False)
+        parser = LinkTalkStreamParser(stream_keys=("talk",))
+        first_sentence = None
+        link_time = None
+        pos = 0
+        index = 0
+        while pos < len(arguments):
+            size = rand.randint(1, 4)
+            elapsed = first_token_delay + index * chunk_interval
+            for key, value, closed in parser.feed(arguments[pos : pos + size]):
+                if key == "link" and closed and link_time is None:
+                    link_time = elapsed
+                elif key == "talk" and first_sentence is None:
+                    if closed or any(c in LAST_CHAR for c in value):
+                        first_sentence = elapsed
+            pos += size
+            index += 1
+        first_sentences.append(first_sentence)
+        links.append(link_time)
+    return first_sentences, links
+
+
+def run_live(model: str, field_order: Sequence[str]) -> Tuple[List[float], List[float]]:
+    """実際のモデルで、最初の文とリンクが届くまでの時間を計測する"""
+    from lib.chat_akari_introducer import ChatStreamAkariIntroducer
+    from lib.local_retriever import LocalRetriever
+    from lib.prompt_creator import system_prompt_creator
+
+    retriever = LocalRetriever.from_path(RAG_DATA_PATH)
+    chat_stream = ChatStreamAkariIntroducer(field_order=field_order)
+    link_times = []
+    first_sentences = []
+    for question in QUESTIONS:
+        response = retriever.hybrid_search(text=question, limit=3)
+        context = "\n---\n".join(o.properties["content"] for o in response.objects)
+        messages = [
+            chat_stream.create_message(system_prompt_creator(context), role="system"),
+            chat_stream.create_message(question),
+        ]
+        start = time.time()
+        link_time = []
+        chat_stream.send_link = lambda url: link_time.append(time.time() - start)
+        first_sentence = None
+        for sentence in chat_stream.chat_and_link(messages, model=model):
+            if first_sentence is None:
+                first_sentence = time.time() - start
+        first_sentences.append(first_sentence)
+        link_times.append(link_time[0] if link_time else None)
+    return first_sentences, link_times
+
+
+def print_result(name: str, first_sentences: List[float], links: List[float]) -> None:
+    first_sentences = [t for t in first_sentences if t is not None]
+    links = [t for t in links if t is not None]
+    print(
+        f"{name:<12} first sentence: mean {statistics.mean(first_sentences) * 1000:.1f} [ms] "
+        f"max {max(first_sentences) * 1000:.1f} [ms]  "
+        f"link: mean {statistics.mean(links) * 1000:.1f} [ms]"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-m",
+        "--model",
+        type=str,
+        help="Measure with this model instead of simulated streams",
+    )
+    parser.add_argument(
+        "--first_token_delay", type=float, default=0.3, help="LLM first token delay [s]"
+    )
+    parser.add_argument(
+        "--chunk_interval", type=float, default=0.01, help="LLM chunk interval [s]"
+    )
+    parser.add_argument("-n", "--num_streams", type=int, default=30, help="Streams")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+    for name, field_order in ORDERS:
+        if args.model is not None:
+            first_sentences, links = run_live(args.model, field_order)
+        else:
+            first_sentences, links = simulate(
+                field_order,
+                args.first_token_delay,
+                args.chunk_interval,
+                args.num_streams,
+                args.seed,
+            )
+        print_result(name, first_sentences, links)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent import futures
+from typing import List
+
+import grpc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+import introduce_gpt_publisher
+import lib.link_talk_backend as link_talk_backend
+from lib.latency_tracer import LatencyTracer
+from lib.local_retriever import LocalRetriever
+from offline_benchmark import (
+    RAG_DATA_PATH,
+    FakeOpenAI,
+    FakeWeaviateRagController,
+    create_streams,
+    start_fake_servers,
+)
+from trace_summary import percentile
+
+import gpt_server_pb2
+import gpt_server_pb2_grpc
+
+GPT_SERVER_ADDRESS = "localhost:10101"
+QUESTIONS = ["AKARIって何?", "値段は?", "何ができるの?", "カメラの性能は?"]
+
+
+def run(booths: int, requests: int, interval: float, max_workers: int) -> List[float]:
+    """1つのGptServerに複数のブースからgRPCで同時に質問し、最初の文までの時間を集計する
+    セッションの作成や、voice_serverとstreamlit_serverの対応RPCの確認はブース毎に1回だけ行われるため、
+    各ブースの最初の質問は集計しない。
+
+    Returns:
+        List[float]: 最初の文までの時間[ms]のリスト
+    """
+    with tempfile.NamedTemporaryFile(suffix=".jsonl", delete=False) as file:
+        trace_path = file.name
+    tracer = LatencyTracer(path=trace_path, service="multi_session_benchmark")
+    servicer = introduce_gpt_publisher.GptServer(collection_name="Akari")
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+    gpt_server_pb2_grpc.add_GptServerServiceServicer_to_server(servicer, server)
+    server.add_insecure_port(GPT_SERVER_ADDRESS)
+    server.start()
+    channel = grpc.insecure_channel(GPT_SERVER_ADDRESS)
+    stub = gpt_server_pb2_grpc.GptServerServiceStub(channel)
+
+    def booth(index: int, start: int, count: int) -> None:
+        metadata = (("session-id", f"booth{index}"),)
+        for i in range(start, start + count):
+            stub.SetGpt(
+                gpt_server_pb2.SetGptRequest(
+                    text=QUESTIONS[(index + i) % len(QUESTIONS)], is_finish=True
+                ),
+                metadata=metadata,
+            )
+            time.sleep(interval)
+
+    def run_booths(start: int, count: int) -> None:
+        threads = [
+            threading.Thread(target=booth, args=(i, start, count)) for i in range(booths)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    run_booths(0, 1)
+    servicer.tracer = tracer
+    start = time.time()
+    run_booths(1, requests)
+    elapsed = time.time() - start
+    channel.close()
+    server.stop(None)
+    tracer.close()
+
+    first_sentences = []
+    with open(trace_path, "r", encoding="utf-8") as file:
+        for line in file:
+            span = json.loads(line)
+            if span["name"] == "first_sentence":
+                first_sentences.append(span["offset_ms"])
+    os.remove(trace_path)
+    first_sentences.sort()
+    print(
+        f"{booths:>6} {len(servicer.sessions):>8} "
+        f"{booths * requests / elapsed:>12.2f} "
+        f"{statistics.mean(first_sentences):>9.1f} "
+        f"{percentile(first_sentences, 95):>9.1f} {first_sentences[-1]:>9.1f}"
+    )
+    return first_sentences
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-b",
+        "--booths",
+        type=int,
+        nargs="+",
+        default=[1, 4, 16, 32, 64],
+        help="Numbers of simultaneous booths",
+    )
+    parser.add_argument(
+        "-n", "--requests", type=int, default=10, help="Measured requests per booth"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=0.5, help="Interval between questions [s]"
+    )
+    parser.add_argument(
+        "--max_workers", type=int, default=100, help="GptServer gRPC worker threads"
+    )
+    parser.add_argument(
+        "--first_token_delay", type=float, default=0.3, help="LLM first token delay [s]"
+    )
+    parser.add_argument(
+        "--chunk_interval", type=float, default=0.01, help="LLM chunk interval [s]"
+    )
+    parser.add_argument(
+        "--search_delay", type=float, default=0.1, help="Weaviate search delay [s]"
+    )
+    parser.add_argument(
+        "--ttfs_limit",
+        type=float,
+        default=None,
+        help="Acceptable p95 time to first sentence [ms]. "
+        "Defaults to the p95 of the first booth count plus --ttfs_margin",
+    )
+    parser.add_argument(
+        "--ttfs_margin",
+        type=float,
+        default=200.0,
+        help="Acceptable increase of p95 time to first sentence from the first booth count [ms]",
+    )
+    args = parser.parse_args()
+
+    FakeWeaviateRagController.retriever = LocalRetriever.from_path(RAG_DATA_PATH)
+    FakeWeaviateRagController.search_delay = args.search_delay
+    introduce_gpt_publisher.WeaviateRagController = FakeWeaviateRagController
+    link_talk_backend.openai = FakeOpenAI(
+        create_streams(100, 10, 0), args.first_token_delay, args.chunk_interval
+    )
+    _, voice_server, _, streamlit_server = start_fake_servers()
+    print(
+        f"{'booths':>6} {'sessions':>8} {'throughput':>12} "
+        f"{'ttfs mean':>9} {'ttfs p95':>9} {'ttfs max':>9}  [req/s, ms]"
+    )
+    # 偽のLLMはlink、talkの順のJSONを1~4文字ずつ返すため、1ブースでもリンクのURLの生成を待つ分だけ
+    # 最初の文が遅い。同時に応答できるブースの数は、最初のブース数からの増加で判定する
+    ttfs_limit = args.ttfs_limit
+    capacity = 0
+    try:
+        for booths in args.booths:
+            first_sentences = run(
+                booths, args.requests, args.interval, args.max_workers
+            )
+            if ttfs_limit is None:
+                ttfs_limit = percentile(first_sentences, 95) + args.ttfs_margin
+            if percentile(first_sentences, 95) <= ttfs_limit:
+                capacity = booths
+    finally:
+        voice_server.stop(None)
+        streamlit_server.stop(None)
+    print(
+        f"Max booths within p95 time to first sentence {ttfs_limit:.0f} [ms]: {capacity}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent import futures
+from types import SimpleNamespace
+from typing import Iterator, List, Optional
+
+import grpc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+import introduce_gpt_publisher
+import lib.link_talk_backend as link_talk_backend
+import lib.link_talk_parser as link_talk_parser
+from lib.latency_tracer import LatencyTracer
+from lib.local_retriever import LocalRetriever
+from parse_benchmark import SAMPLE_ANSWERS, load_chunk_streams
+
+import streamlit_server_pb2
+import streamlit_server_pb2_grpc
+import voice_server_pb2
+import voice_server_pb2_grpc
+
+RAG_DATA_PATH = os.path.join(os.path.dirname(__file__), "..", "rag_data")
+
+
+class FakeWeaviateRagController(object):
+    """rag_dataの内容をLocalRetrieverで検索するWeaviateRagControllerの代替"""
+
+    retriever: Optional[LocalRetriever] = None
+    search_delay = 0.0
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 10080) -> None:
+        pass
+
+    def hybrid_search(
+        self,
+        collection_name: str,
+        text: str,
+        limit: int = 3,
+        alpha: float = 0.75,
+        rerank: bool = False,
+    ) -> SimpleNamespace:
+        time.sleep(self.search_delay)
+        return self.retriever.hybrid_search(text=text, limit=limit, alpha=alpha)
+
+
+class FakeStream(object):
+    """openaiのStreamの代替。記録済みのチャンク列を一定間隔で返す"""
+
+    def __init__(
+        self, chunks: List[str], first_token_delay: float, chunk_interval: float
+    ) -> None:
+        self.chunks = chunks
+        self.first_token_delay = first_token_delay
+        self.chunk_interval = chunk_interval
+        self.closed = False
+
+    def __iter__(self) -> Iterator[SimpleNamespace]:
+        time.sleep(self.first_token_delay)
+        for arguments in self.chunks:
+            if self.closed:
+                return
+            function_call = SimpleNamespace(arguments=arguments)
+            # function callingとtools APIのどちらのバックエンドでも読めるようにする
+            delta = SimpleNamespace(
+                function_call=function_call,
+                tool_calls=[SimpleNamespace(function=function_call)],
+            )
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+            time.sleep(self.chunk_interval)
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class FakeOpenAI(object):
+    """openai.chat.completions.createの代替"""
+
+    def __init__(
+        self, streams: List[List[str]], first_token_delay: float, chunk_interval: float
+    ) -> None:
+        self.streams = streams
+        self.first_token_delay = first_token_delay
+        self.chunk_interval = chunk_interval
+        self.lock = threading.Lock()
+        self.index = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs) -> FakeStream:
+        with self.lock:
+            chunks = self.streams[self.index % len(self.streams)]
+            self.index += 1
+        return FakeStream(chunks, self.first_token_delay, self.chunk_interval)
+
+
+class FakeVoiceServer(voice_server_pb2_grpc.VoiceServerServiceServicer):
+    """受け取った文を数えるだけのvoice_server"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.sentences = 0
+
+    def SetText(self, request, context):
+        with self.lock:
+            self.sentences += 1
+        return voice_server_pb2.SetTextReply(success=True)
+
+    def StartHeadControl(self, request, context):
+        return voice_server_pb2.StartHeadControlReply(success=True)
+
+    def SentenceEnd(self, request, context):
+        return voice_server_pb2.SentenceEndReply(success=True)
+
+    def InterruptVoice(self, request, context):
+        return voice_server_pb2.InterruptVoiceReply(success=True)
+
+
+class FakeStreamlitServer(streamlit_server_pb2_grpc.StreamlitServerServiceServicer):
+    """受け取ったURLを数えるだけのstreamlit_server"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.urls = 0
+
+    def SendUrl(self, request, context):
+        with self.lock:
+            self.urls += 1
+        return streamlit_server_pb2.SendUrlReply(success=True)
+
+
+def start_fake_servers() -> tuple:
+    voice = FakeVoiceServer()
+    voice_server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    voice_server_pb2_grpc.add_VoiceServerServiceServicer_to_server(voice, voice_server)
+    voice_server.add_insecure_port("localhost:10002")
+    voice_server.start()
+    streamlit = FakeStreamlitServer()
+    streamlit_server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    streamlit_server_pb2_grpc.add_StreamlitServerServiceServicer_to_server(
+        streamlit, streamlit_server
+    )
+    streamlit_server.add_insecure_port("localhost:10010")
+    streamlit_server.start()
+    return voice, voice_server, streamlit, streamlit_server
+
+
+def create_streams(answer_length: int, num_streams: int, seed: int) -> List[List[str]]:
+    """指定した文字数の回答のチャンク列を生成する"""
+    rand = random.Random(seed)
+    streams = []
+    for i in range(num_streams):
+        link, talk = SAMPLE_ANSWERS[i % len(SAMPLE_ANSWERS)]
+        talk = (talk * (answer_length // len(talk) + 1))[:answer_length]
+        arguments = json.dumps({"link": link, "talk": talk}, ensure_ascii=False)
+        chunks = []
+        pos = 0
+        while pos < len(arguments):
+            size = rand.randint(1, 4)
+            chunks.append(arguments[pos : pos + size])
+            pos += size
+        streams.append(chunks)
+    return streams
+
+
+def run(
+    streams: List[List[str]],
+    visitors: int,
+    requests: int,
+    first_token_delay: float,
+    chunk_interval: float,
+) -> None:
+    fake_openai = FakeOpenAI(streams, first_token_delay, chunk_interval)
+    link_talk_backend.openai = fake_openai
+    # パーサの処理時間を集計する
+    parse_time = [0.0, 0]
+    parse_lock = threading.Lock()
+    original_feed = link_talk_parser.LinkTalkStreamParser.feed
+
+    def timed_feed(self, text):
+        start = time.perf_counter()
+        events = original_feed(self, text)
+        with parse_lock:
+            parse_time[0] += time.perf_counter() - start
+            parse_time[1] += 1
+        return events
+
+    link_talk_parser.LinkTalkStreamParser.feed = timed_feed
+    with tempfile.NamedTemporaryFile(suffix=".jsonl", delete=False) as file:
+        trace_path = file.name
+    tracer = LatencyTracer(path=trace_path, service="offline_benchmark")
+    # 来場者毎に別のGptServerを使い、互いの応答をキャンセルしないようにする
+    servers = [
+        introduce_gpt_publisher.GptServer(collection_name="Akari", tracer=tracer)
+        for _ in range(visitors)
+    ]
+    questions = ["AKARIって何?", "値段は?", "何ができるの?", "カメラの性能は?"]
+
+    def visitor(index: int) -> None:
+        for i in range(requests):
+            request = SimpleNamespace(
+                text=questions[(index + i) % len(questions)],
+                is_finish=True,
+                HasField=lambda name: True,
+            )
+            servers[index].SetGpt(request, None)
+
+    tracemalloc.start()
+    start = time.time()
+    threads = [threading.Thread(target=visitor, args=(i,)) for i in range(visitors)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    link_talk_parser.LinkTalkStreamParser.feed = original_feed
+    tracer.close()
+
+    first_sentences = []
+    totals = []
+    with open(trace_path, "r", encoding="utf-8") as file:
+        for line in file:
+            span = json.loads(line)
+            if span["name"] == "first_sentence":
+                first_sentences.append(span["offset_ms"])
+            elif span["name"] == "set_gpt":
+                totals.append(span["duration_ms"])
+    os.remove(trace_path)
+    num_requests = visitors * requests
+    print(f"  requests: {num_requests}  elapsed: {elapsed:.2f} [s]")
+    print(f"  throughput: {num_requests / elapsed:.2f} [req/s]")
+    print(
+        f"  parse cost: {parse_time[0] / max(parse_time[1], 1) * 1e6:.2f} [us/chunk] "
+        f"({parse_time[1]} chunks)"
+    )
+    print(
+        f"  time to first sentence: mean {statistics.mean(first_sentences):.1f} [ms] "
+        f"max {max(first_sentences):.1f} [ms]"
+    )
+    print(f"  total time per request: mean {statistics.mean(totals):.1f} [ms]")
+    print(f"  peak memory: {peak_memory / 1024:.1f} [KiB]")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-i", "--input", type=str, help="Recorded chunk stream file (JSONL)"
+    )
+    parser.add_argument(
+        "-l",
+        "--answer_length",
+        type=int,
+        nargs="+",
+        default=[50, 100, 200],
+        help="Answer lengths in characters",
+    )
+    parser.add_argument(
+        "-v",
+        "--visitors",
+        type=int,
+        nargs="+",
+        default=[1, 4],
+        help="Numbers of concurrent visitors",
+    )
+    parser.add_argument(
+        "-n", "--requests", type=int, default=5, help="Requests per visitor"
+    )
+    parser.add_argument(
+        "--first_token_delay", type=float, default=0.3, help="LLM first token delay [s]"
+    )
+    parser.add_argument(
+        "--chunk_interval", type=float, default=0.01, help="LLM chunk interval [s]"
+    )
+    parser.add_argument(
+        "--search_delay", type=float, default=0.1, help="Weaviate search delay [s]"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    FakeWeaviateRagController.retriever = LocalRetriever.from_path(RAG_DATA_PATH)
+    FakeWeaviateRagController.search_delay = args.search_delay
+    introduce_gpt_publisher.WeaviateRagController = FakeWeaviateRagController
+    _, voice_server, _, streamlit_server = start_fake_servers()
+    if args.input is not None:
+        stream_sets = [("recorded", load_chunk_streams(args.input))]
+    else:
+        stream_sets = [
+            (f"{length} chars", create_streams(length, 10, args.seed))
+            for length in args.answer_length
+        ]
+    try:
+        for name, streams in stream_sets:
+            for visitors in args.visitors:
+                print(f"[{name}, {visitors} visitors]")
+                run(
+                    streams,
+                    visitors,
+                    args.requests,
+                    args.first_token_delay,
+                    args.chunk_interval,
+                )
+    finally:
+        voice_server.stop(None)
+        streamlit_server.stop(None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Callable, List
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from lib.link_talk_parser import LinkTalkStreamParser
+
+LAST_CHAR = ["、", "。", "！", "!", "?", "？", "\n", "}"]
+
+SAMPLE_ANSWERS = [
+    (
+        "https://www.youtube.com/watch?v=WVvwt3wUYek",
+        "私はAKARIです！RAGを使って、独自のデータを元に質問に回答できます。詳しくは動画をご覧ください。",
+    ),
+    (
+        "https://akarigroup.github.io/docs/source/overview/main.html#ai%E3%82%AB%E3%83%A1%E3%83%A9",
+        "ステレオAIカメラのOAK-D Liteを搭載しています。顔認識や物体認識、骨格推定など、様々な画像認識が使えます。",
+    ),
+    (
+        "",
+        "申し訳ありません、その質問にはお答えできません。AKARIについて、他に知りたいことはありますか？",
+    ),
+]
+
+
+def create_chunk_streams(num_streams: int, repeat: int, seed: int) -> List[List[str]]:
+    """GPTのfunction_callの差分を模したチャンク列を生成する
+
+    Args:
+        num_streams (int): 生成するチャンク列の数
+        repeat (int): 回答文を繰り返す回数。回答長を変えるために使う。
+        seed (int): 乱数シード
+
+    Returns:
+        List[List[str]]: チャンク列のリスト
+    """
+    rand = random.Random(seed)
+    streams = []
+    for i in range(num_streams):
+        link, talk = SAMPLE_ANSWERS[i % len(SAMPLE_ANSWERS)]
+        arguments = json.dumps({"link": link, "talk": talk * repeat}, ensure_ascii=False)
+        chunks = []
+        pos = 0
+        while pos < len(arguments):
+            size = rand.randint(1, 4)
+            chunks.append(arguments[pos : pos + size])
+            pos += size
+        streams.append(chunks)
+    return streams
+
+
+def load_chunk_streams(path: str) -> List[List[str]]:
+    """記録済みのチャンク列を読み込む。1行に1回答分の{"chunks": [...]}を記載したJSONL形式。
+
+    Args:
+        path (str): JSONLファイルのパス
+
+    Returns:
+        List[List[str]]: チャンク列のリスト
+    """
+    streams = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                streams.append(json.loads(line)["chunks"])
+    return streams
+
+
+def reparse_path(chunks: List[str]) -> List[str]:
+    """従来の、チャンク毎にバッファ全体をjson.loads/force_parse_jsonし直す方式"""
+    from gpt_stream_parser import force_parse_json
+
+    sentences = []
+    full_response = ""
+    real_time_response = ""
+    sentence_index = 0
+    get_link = False
+    for chunk in chunks:
+        full_response += chunk
+        try:
+            data_json = json.loads(full_response)
+            found_last_char = False
+            for char in LAST_CHAR:
+                if real_time_response[-1].find(char) >= 0:
+                    found_last_char = True
+            if not found_last_char:
+                data_json["talk"] = data_json["talk"] + "。"
+        except BaseException:
+            data_json = force_parse_json(full_response)
+        if data_json is not None:
+            if "talk" in data_json:
+                if not get_link and "link" in data_json:
+                    get_link = True
+                real_time_response = str(data_json["talk"])
+                for char in LAST_CHAR:
+                    pos = real_time_response[sentence_index:].find(char)
+                    if pos >= 0:
+                        sentence = real_time_response[
+                            sentence_index : sentence_index + pos + 1
+                        ]
+                        sentence_index += pos + 1
+                        if sentence != "":
+                            sentences.append(sentence)
+                        break
+    return sentences
+
+
+def incremental_path(chunks: List[str]) -> List[str]:
+    """LinkTalkStreamParserで差分のみを解析する方式"""
+    last_chars = set(LAST_CHAR)
+    parser = LinkTalkStreamParser(stream_keys=("talk",))
+    sentences = []
+    sentence = ""
+    for chunk in chunks:
+        for key, value, closed in parser.feed(chunk):
+            if key == "talk" and not closed:
+                start = 0
+                for pos, char in enumerate(value):
+                    if char in last_chars:
+                        sentence += value[start : pos + 1]
+                        start = pos + 1
+                        sentences.append(sentence)
+                        sentence = ""
+                sentence += value[start:]
+    if sentence != "":
+        sentences.append(sentence + "。")
+    return sentences
+
+
+def measure(func: Callable[[List[str]], List[str]], streams: List[List[str]]) -> float:
+    start = time.perf_counter()
+    for chunks in streams:
+        func(chunks)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-i", "--input", type=str, help="Recorded chunk stream file (JSONL)"
+    )
+    parser.add_argument(
+        "-n", "--num_streams", type=int, default=30, help="Number of streams"
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        nargs="+",
+        default=[1, 4, 16],
+        help="Answer length multipliers",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+    if args.input is not None:
+        stream_sets = [("recorded", load_chunk_streams(args.input))]
+    else:
+        stream_sets = [
+            (f"x{repeat}", create_chunk_streams(args.num_streams, repeat, args.seed))
+            for repeat in args.repeat
+        ]
+    for name, streams in stream_sets:
+        num_chunks = sum(len(chunks) for chunks in streams)
+        reparse_time = measure(reparse_path, streams)
+        incremental_time = measure(incremental_path, streams)
+        print(f"[{name}] streams: {len(streams)} chunks: {num_chunks}")
+        print(
+            f"  reparse:     {reparse_time * 1000:.2f} [ms] "
+            f"({reparse_time / num_chunks * 1e6:.1f} [us/chunk])"
+        )
+        print(
+            f"  incremental: {incremental_time * 1000:.2f} [ms] "
+            f"({incremental_time / num_chunks * 1e6:.1f} [us/chunk])"
+        )
+
+
+if __name__ == "__main__":
+    main()
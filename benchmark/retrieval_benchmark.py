@@ -0,0 +1,132 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import List
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from lib.local_retriever import (
+    LocalRetriever,
+    openai_embedder,
+    sentence_transformer_embedder,
+)
+
+DEFAULT_QUERIES = [
+    "AKARIって何?",
+    "値段はいくら?",
+    "何ができるの?",
+    "カメラの性能は?",
+    "どんなセンサがついているの?",
+    "ROS2は使える?",
+    "Scratchで動かせる?",
+    "顔認識のアプリはある?",
+    "組み立て方を教えて",
+    "YOLOで物体認識できる?",
+]
+
+
+def sources(response) -> List[str]:
+    return [o.properties["source"] for o in response.objects]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-q", "--queries", type=str, help="Query file. One query per line"
+    )
+    parser.add_argument(
+        "-p", "--path", type=str, default="rag_data/", help="RAG data path"
+    )
+    parser.add_argument(
+        "-c", "--collection", type=str, default="Akari", help="Weaviate collection name"
+    )
+    parser.add_argument(
+        "-w", "--weaviate_host", type=str, default="127.0.0.1", help="Weaviate host name"
+    )
+    parser.add_argument(
+        "--weaviate_port", type=int, default=10080, help="Weaviate port number"
+    )
+    parser.add_argument("-k", "--limit", type=int, default=3, help="Number of results")
+    parser.add_argument(
+        "--local_embedding",
+        choices=["local", "openai"],
+        help="Dense vectors in local retrieval. BM25 only if not set",
+    )
+    parser.add_argument(
+        "--embedding_cache",
+        type=str,
+        help="Chunk embedding cache file (.npz). Not cached if not set",
+    )
+    parser.add_argument(
+        "--local_only", action="store_true", help="Measure local retrieval only"
+    )
+    args = parser.parse_args()
+    queries = DEFAULT_QUERIES
+    if args.queries is not None:
+        with open(args.queries, "r", encoding="utf-8") as file:
+            queries = [line.strip() for line in file if line.strip()]
+
+    start = time.time()
+    embed_func = None
+    if args.local_embedding == "local":
+        embed_func = sentence_transformer_embedder()
+    elif args.local_embedding == "openai":
+        embed_func = openai_embedder()
+    local = LocalRetriever.from_path(
+        args.path, embed_func=embed_func, vector_cache=args.embedding_cache
+    )
+    print(f"local index: {len(local.chunks)} chunks {time.time() - start:.2f} [s]")
+    remote = None
+    if not args.local_only:
+        from lib.akari_rag_chatbot.lib.weaviate_rag_controller import (
+            WeaviateRagController,
+        )
+
+        remote = WeaviateRagController(host=args.weaviate_host, port=args.weaviate_port)
+
+    local_times = []
+    remote_times = []
+    recalls = []
+    for query in queries:
+        start = time.time()
+        local_response = local.hybrid_search(text=query, limit=args.limit, alpha=0.75)
+        local_result = sources(local_response)
+        local_times.append(time.time() - start)
+        print(f"{query} (match {local_response.match_ratio:.2f})")
+        print(f"  local:  {local_result}")
+        if remote is None:
+            continue
+        start = time.time()
+        remote_result = sources(
+            remote.hybrid_search(
+                collection_name=args.collection,
+                text=query,
+                limit=args.limit,
+                alpha=0.75,
+                rerank=False,
+            )
+        )
+        remote_times.append(time.time() - start)
+        print(f"  remote: {remote_result}")
+        # Weaviateの検索結果を正解とし、同じ文書を返せた割合をrecallとする
+        if len(remote_result) > 0:
+            hits = len(set(local_result) & set(remote_result))
+            recalls.append(hits / len(set(remote_result)))
+
+    print("-------------------------")
+    print(
+        f"local  latency: mean {statistics.mean(local_times) * 1000:.2f} [ms] "
+        f"max {max(local_times) * 1000:.2f} [ms]"
+    )
+    if len(remote_times) > 0:
+        print(
+            f"remote latency: mean {statistics.mean(remote_times) * 1000:.2f} [ms] "
+            f"max {max(remote_times) * 1000:.2f} [ms]"
+        )
+    if len(recalls) > 0:
+        print(f"source recall@{args.limit} vs remote: {statistics.mean(recalls):.2f}")
+
+
+if __name__ == "__main__":
+    main()
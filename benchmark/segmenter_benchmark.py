@@ -0,0 +1,136 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import Callable, List
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from lib.link_talk_parser import LinkTalkStreamParser
+from lib.sentence_segmenter import SentenceSegmenter
+from parse_benchmark import LAST_CHAR, create_chunk_streams, load_chunk_streams
+
+
+class LastCharSplitter(object):
+    """変更前の、LAST_CHARのいずれかが来たら常に区切る方式"""
+
+    def __init__(self) -> None:
+        self.last_chars = set(LAST_CHAR)
+        self.sentence = ""
+
+    def feed(self, text: str) -> List[str]:
+        sentences = []
+        start = 0
+        for pos, char in enumerate(text):
+            if char in self.last_chars:
+                sentences.append(self.sentence + text[start : pos + 1])
+                self.sentence = ""
+                start = pos + 1
+        self.sentence += text[start:]
+        return sentences
+
+    def flush(self):
+        sentence = self.sentence
+        self.sentence = ""
+        return sentence + "。" if sentence != "" else None
+
+
+def split_stream(chunks: List[str], splitter) -> List[tuple]:
+    """チャンク列を解析し、(文が確定したチャンク番号, 文)のリストを返す"""
+    parser = LinkTalkStreamParser(stream_keys=("talk",))
+    sentences = []
+    for index, chunk in enumerate(chunks):
+        for key, value, closed in parser.feed(chunk):
+            if key != "talk":
+                continue
+            if not closed:
+                sentences.extend((index, s) for s in splitter.feed(value))
+            else:
+                sentence = splitter.flush()
+                if sentence is not None:
+                    sentences.append((index, sentence))
+    sentence = splitter.flush()
+    if sentence is not None:
+        sentences.append((len(chunks) - 1, sentence))
+    return sentences
+
+
+def check(chunks: List[str], sentences: List[tuple]) -> bool:
+    """文を連結すると、末尾に付けた句点を除いて元のtalkに戻るかを確認する"""
+    parser = LinkTalkStreamParser(stream_keys=())
+    for chunk in chunks:
+        parser.feed(chunk)
+    talk = parser.values.get("talk", "")
+    joined = "".join(s for _, s in sentences)
+    return joined == talk or joined == talk + "。"
+
+
+def evaluate(
+    name: str,
+    create_splitter: Callable[[], object],
+    streams: List[List[str]],
+    chunk_interval: float,
+) -> None:
+    start = time.perf_counter()
+    results = [split_stream(chunks, create_splitter()) for chunks in streams]
+    elapsed = time.perf_counter() - start
+    num_chunks = sum(len(chunks) for chunks in streams)
+    first = [r[0] for r in results if len(r) > 0]
+    errors = sum(not check(chunks, r) for chunks, r in zip(streams, results))
+    print(
+        f"{name:<23} {elapsed / num_chunks * 1e6:>8.2f} "
+        f"{statistics.mean(i for i, _ in first) * chunk_interval * 1000:>10.1f} "
+        f"{statistics.mean(len(s) for _, s in first):>10.1f} "
+        f"{statistics.mean(len(r) for r in results):>9.1f} {errors:>7}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-i", "--input", type=str, help="Recorded chunk stream file (JSONL)"
+    )
+    parser.add_argument("-n", "--num_streams", type=int, default=300, help="Streams")
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=3, help="Answer repeat count"
+    )
+    parser.add_argument(
+        "--chunk_interval", type=float, default=0.01, help="LLM chunk interval [s]"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+    if args.input is not None:
+        streams = load_chunk_streams(args.input)
+    else:
+        streams = create_chunk_streams(args.num_streams, args.repeat, args.seed)
+    print(f"{len(streams)} streams")
+    print(
+        f"{'splitter':<23} {'us/chunk':>8} {'first [ms]':>10} "
+        f"{'first len':>10} {'sentences':>9} {'errors':>7}"
+    )
+    evaluate("last_char", LastCharSplitter, streams, args.chunk_interval)
+    evaluate(
+        "segmenter (no comma)",
+        lambda: SentenceSegmenter(
+            first_min_chars=None, first_max_chars=None, min_chars=None
+        ),
+        streams,
+        args.chunk_interval,
+    )
+    evaluate(
+        "segmenter (no particle)",
+        lambda: SentenceSegmenter(first_max_chars=None),
+        streams,
+        args.chunk_interval,
+    )
+    evaluate("segmenter", SentenceSegmenter, streams, args.chunk_interval)
+    evaluate(
+        "segmenter (eager 1)",
+        lambda: SentenceSegmenter(first_min_chars=1),
+        streams,
+        args.chunk_interval,
+    )
+
+
+if __name__ == "__main__":
+    main()
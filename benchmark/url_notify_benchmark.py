@@ -0,0 +1,92 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from typing import List, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+# streamlit_serverはimage/talk.jpgを相対パスで読み込むため、リポジトリ直下で実行する
+os.chdir(os.path.join(os.path.dirname(__file__), ".."))
+from streamlit_server import UrlChannel
+
+
+def polling_loop(num_urls: int, interval: float) -> Tuple[List[float], float]:
+    """従来の、共有リストを0.1秒毎にポーリングする方式のURL受信から描画開始までの遅延を計測する"""
+    cur_url = [""]
+    sent_time = [0.0]
+    latencies = []
+    finished = threading.Event()
+
+    def render_loop() -> None:
+        prev_url = ""
+        while not finished.is_set():
+            if cur_url[0] != prev_url:
+                prev_url = cur_url[0]
+                latencies.append(time.time() - sent_time[0])
+            time.sleep(0.1)
+
+    thread = threading.Thread(target=render_loop)
+    cpu_start = time.process_time()
+    thread.start()
+    for i in range(num_urls):
+        time.sleep(interval * random.uniform(0.5, 1.5))
+        sent_time[0] = time.time()
+        cur_url[0] = f"https://example.com/{i}"
+    time.sleep(0.2)
+    finished.set()
+    thread.join()
+    return latencies, time.process_time() - cpu_start
+
+
+def channel_loop(num_urls: int, interval: float) -> Tuple[List[float], float]:
+    """UrlChannelで描画ループを起こす方式のURL受信から描画開始までの遅延を計測する"""
+    channel = UrlChannel()
+    latencies = []
+
+    def render_loop() -> None:
+        version = 0
+        while True:
+            new_version, url, received_time = channel.wait(version, timeout=100)
+            version = new_version
+            if url == "":
+                break
+            latencies.append(time.time() - received_time)
+
+    thread = threading.Thread(target=render_loop)
+    cpu_start = time.process_time()
+    thread.start()
+    for i in range(num_urls):
+        time.sleep(interval * random.uniform(0.5, 1.5))
+        channel.put(f"https://example.com/{i}")
+    time.sleep(0.2)
+    channel.put("")
+    thread.join()
+    return latencies, time.process_time() - cpu_start
+
+
+def print_result(name: str, latencies: List[float], cpu_time: float) -> None:
+    latencies = sorted(latencies)
+    print(
+        f"{name}: mean {statistics.mean(latencies) * 1000:.2f} [ms] "
+        f"max {latencies[-1] * 1000:.2f} [ms] cpu {cpu_time * 1000:.1f} [ms]"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--num_urls", type=int, default=20, help="Number of URLs")
+    parser.add_argument(
+        "-i", "--interval", type=float, default=0.3, help="Mean URL interval [s]"
+    )
+    args = parser.parse_args()
+    random.seed(0)
+    print_result("polling", *polling_loop(args.num_urls, args.interval))
+    random.seed(0)
+    print_result("channel", *channel_loop(args.num_urls, args.interval))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent import futures
+from typing import Callable, List
+
+import grpc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from lib.voice_sender import StreamVoiceSender, VoiceSender
+from lib.voice_stream_bridge import add_voice_stream_bridge
+from trace_summary import percentile
+
+import voice_server_pb2
+import voice_server_pb2_grpc
+
+UNARY_ADDRESS = "localhost:10202"
+STREAM_ADDRESS = "localhost:10203"
+SENTENCES = ["こんにちは。", "AKARIです！", "カメラとサーボを搭載しています。", "よろしくね。"]
+
+
+class RecordingVoiceServer(voice_server_pb2_grpc.VoiceServerServiceServicer):
+    """受け取った文を記録し、各RPCの処理に一定時間かかるvoice_server"""
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.texts: List[str] = []
+        self.answer_end = threading.Event()
+
+    def SetText(self, request, context):
+        time.sleep(self.delay)
+        self.texts.append(request.text)
+        return voice_server_pb2.SetTextReply(success=True)
+
+    def StartHeadControl(self, request, context):
+        time.sleep(self.delay)
+        return voice_server_pb2.StartHeadControlReply(success=True)
+
+    def SentenceEnd(self, request, context):
+        time.sleep(self.delay)
+        self.answer_end.set()
+        return voice_server_pb2.SentenceEndReply(success=True)
+
+    def InterruptVoice(self, request, context):
+        return voice_server_pb2.InterruptVoiceReply(success=True)
+
+
+def start_server(address: str, voice: RecordingVoiceServer, stream: bool) -> grpc.Server:
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    voice_server_pb2_grpc.add_VoiceServerServiceServicer_to_server(voice, server)
+    if stream:
+        add_voice_stream_bridge(server, voice)
+    server.add_insecure_port(address)
+    server.start()
+    return server
+
+
+def run(
+    name: str,
+    address: str,
+    create_sender: Callable[[grpc.Channel], VoiceSender],
+    voice: RecordingVoiceServer,
+    answers: int,
+    sentences: int,
+) -> None:
+    """1回の応答と同じ順序でイベントを送信し、呼び出し側が待たされた時間を計測する"""
+    channel = grpc.insecure_channel(address)
+    sender = create_sender(channel)
+    # 接続とストリームの開始は計測に含めない
+    sender.interrupt()
+    dispatch = []
+    delivery = []
+    errors = 0
+    for i in range(answers):
+        voice.texts.clear()
+        voice.answer_end.clear()
+        texts = [SENTENCES[(i + j) % len(SENTENCES)] for j in range(sentences)]
+        start = time.perf_counter()
+        sender.start_head_control()
+        for text in texts:
+            sent = time.perf_counter()
+            sender.set_text(text)
+            dispatch.append((time.perf_counter() - sent) * 1000)
+        sender.sentence_end()
+        voice.answer_end.wait()
+        delivery.append((time.perf_counter() - start) * 1000)
+        errors += voice.texts != texts
+    sender.close()
+    channel.close()
+    print(
+        f"{name:<22} {statistics.mean(dispatch):>10.3f} "
+        f"{percentile(sorted(dispatch), 95):>10.3f} "
+        f"{statistics.mean(delivery):>12.2f} {errors:>7}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--answers", type=int, default=200, help="Answers")
+    parser.add_argument(
+        "-s", "--sentences", type=int, default=8, help="Sentences per answer"
+    )
+    parser.add_argument(
+        "--server_delay",
+        type=float,
+        nargs="+",
+        default=[0.0, 0.002],
+        help="Processing time of each voice server RPC [s]",
+    )
+    parser.add_argument(
+        "--window", type=int, default=16, help="Voice stream window size"
+    )
+    args = parser.parse_args()
+    for delay in args.server_delay:
+        unary_voice = RecordingVoiceServer(delay)
+        stream_voice = RecordingVoiceServer(delay)
+        unary_server = start_server(UNARY_ADDRESS, unary_voice, stream=False)
+        stream_server = start_server(STREAM_ADDRESS, stream_voice, stream=True)
+        print(f"server delay {delay * 1000:.1f} [ms]")
+        print(
+            f"{'api':<22} {'mean [ms]':>10} {'p95 [ms]':>10} "
+            f"{'answer [ms]':>12} {'errors':>7}"
+        )
+        try:
+            run(
+                "unary",
+                UNARY_ADDRESS,
+                VoiceSender,
+                unary_voice,
+                args.answers,
+                args.sentences,
+            )
+            run(
+                "stream",
+                STREAM_ADDRESS,
+                lambda channel: StreamVoiceSender(channel, window=args.window),
+                stream_voice,
+                args.answers,
+                args.sentences,
+            )
+            run(
+                "stream (unary server)",
+                UNARY_ADDRESS,
+                lambda channel: StreamVoiceSender(channel, window=args.window),
+                unary_voice,
+                args.answers,
+                args.sentences,
+            )
+        finally:
+            unary_server.stop(None)
+            stream_server.stop(None)
+
+
+if __name__ == "__main__":
+    main()
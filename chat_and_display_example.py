@@ -2,6 +2,7 @@ import argparse
 import time
 
 from lib.chat_akari_introducer import ChatStreamAkariIntroducer
+from lib.link_talk_backend import OpenAICompatibleBackend
 from lib.prompt_creator import system_prompt_creator
 from lib.akari_rag_chatbot.lib.weaviate_rag_controller import WeaviateRagController
 
@@ -29,8 +30,26 @@ def main() -> None:
         action="store_true",
         help="Show search result",
     )
+    parser.add_argument(
+        "--local_llm_url",
+        type=str,
+        help="OpenAI compatible endpoint URL (e.g. llama.cpp server http://host:8080/v1)",
+    )
+    parser.add_argument(
+        "--local_llm_model",
+        nargs="+",
+        type=str,
+        default=[],
+        help="Model names served by the OpenAI compatible endpoint",
+    )
     args = parser.parse_args()
     chat_stream = ChatStreamAkariIntroducer()
+    if args.local_llm_url is not None:
+        chat_stream.add_link_backend(
+            OpenAICompatibleBackend(
+                base_url=args.local_llm_url, models=args.local_llm_model
+            )
+        )
     weaviate_controller = WeaviateRagController()
     messages_list = []
     if args.collection is None:
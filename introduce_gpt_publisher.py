@@ -1,12 +1,36 @@
 import argparse
-import copy
+import functools
+import json
 import os
+import signal
 import sys
+import threading
+import time
 from concurrent import futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 
 import grpc
+from lib.answer_cache import AnswerCache, data_fingerprint
 from lib.chat_akari_introducer import ChatStreamAkariIntroducer
-from lib.prompt_creator import system_prompt_creator
+from lib.conversation_history import ConversationHistory, openai_summarizer
+from lib.latency_tracer import LatencyTracer, current_trace
+from lib.link_sender import LinkSender, extract_link_candidates
+from lib.link_talk_backend import (
+    LINK_FIRST,
+    TALK_FIRST,
+    LinkTalkBackend,
+    OpenAICompatibleBackend,
+)
+from lib.local_retriever import (
+    LocalRetriever,
+    openai_embedder,
+    sentence_transformer_embedder,
+)
+from lib.prompt_creator import PromptBuilder
+from lib.rag_prefetcher import RagPrefetcher, normalize_text
+from lib.speculation import Speculation, edit_distance_ratio
+from lib.voice_sender import VOICE_APIS, StreamVoiceSender, VoiceSender
 from lib.akari_rag_chatbot.lib.weaviate_rag_controller import WeaviateRagController
 
 sys.path.append(
@@ -14,8 +38,66 @@ sys.path.append(
 )
 import gpt_server_pb2
 import gpt_server_pb2_grpc
-import voice_server_pb2
-import voice_server_pb2_grpc
+
+
+class GptSession(object):
+    """
+    ロボット1台分の会話履歴、送信先、生成中の応答を保持するクラス
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        chat_stream_akari_introducer: ChatStreamAkariIntroducer,
+        history: ConversationHistory,
+        voice: VoiceSender,
+    ) -> None:
+        """
+        コンストラクタ
+        Args:
+            session_id (str): セッションID
+            chat_stream_akari_introducer (ChatStreamAkariIntroducer): このセッションのリンクを送信するチャットクラス
+            history (ConversationHistory): このセッションの会話履歴
+            voice (VoiceSender): このセッションのvoice_serverへの送信クラス
+        """
+        self.session_id = session_id
+        self.chat_stream_akari_introducer = chat_stream_akari_introducer
+        self.history = history
+        self.voice = voice
+        self.speculation_lock = threading.Lock()
+        self.speculation: Optional[Speculation] = None
+        # 生成中の応答。生成ID -> (キャンセル用イベント, 最終応答か)
+        self.generation_lock = threading.Lock()
+        self.generation_id = 0
+        self.generations: Dict[int, Tuple[threading.Event, bool]] = {}
+        # 最後にリクエストを受けた時刻。sessions_lockを取得して更新する
+        self.last_active = time.time()
+
+    def is_idle(self, now: float, timeout: float) -> bool:
+        """
+        timeout[s]以上リクエストがなく、生成中の応答もないか
+        Args:
+            now (float): 現在時刻
+            timeout (float): 無操作とみなす時間[s]
+
+        Returns:
+            bool: 破棄してよければTrue
+        """
+        if now - self.last_active < timeout:
+            return False
+        with self.generation_lock:
+            return len(self.generations) == 0
+
+    def close(self) -> None:
+        """
+        先行生成を中断し、streamlit_serverとvoice_serverへの送信を終了する
+        """
+        with self.speculation_lock:
+            if self.speculation is not None:
+                self.speculation.cancel()
+                self.speculation = None
+        self.chat_stream_akari_introducer.link_sender.stop()
+        self.voice.close()
 
 
 class GptServer(gpt_server_pb2_grpc.GptServerServiceServicer):
@@ -28,91 +110,714 @@ class GptServer(gpt_server_pb2_grpc.GptServerServiceServicer):
         collection_name: str,
         weaviate_host: str = "127.0.0.1",
         weaviate_port: int = 10080,
+        prefetch_rag: bool = False,
+        answer_cache: Optional[AnswerCache] = None,
+        history_tokens: int = 2000,
+        session_timeout: Optional[float] = 100.0,
+        summarize_history: bool = False,
+        tracer: Optional[LatencyTracer] = None,
+        retriever_mode: str = "remote",
+        local_retriever: Optional[LocalRetriever] = None,
+        rag_limit: int = 3,
+        local_min_match: float = 0.12,
+        context_tokens: int = 1500,
+        link_model: str = "gpt-4o",
+        link_backend: Optional[LinkTalkBackend] = None,
+        link_api: str = "tools",
+        talk_first: bool = False,
+        speculative: bool = False,
+        speculation_threshold: float = 0.2,
+        voice_address: str = "localhost:10002",
+        display_address: str = "localhost:10010",
+        session_endpoints: Optional[Dict[str, Dict[str, str]]] = None,
+        allowed_addresses: Optional[Sequence[str]] = None,
+        session_idle_timeout: Optional[float] = 600.0,
+        first_phrase_chars: Optional[int] = 4,
+        first_phrase_max_chars: Optional[int] = 8,
+        phrase_chars: Optional[int] = 40,
+        voice_api: str = "stream",
+        voice_window: int = 16,
+        preload_limit: int = 3,
     ) -> None:
         """
         コンストラクタ
         Args:
             collection_name (str): 検索に使うWeaviateのコレクション名
+            prefetch_rag (bool): 音声認識の途中結果でRAG検索を先行して開始するか
+            answer_cache (AnswerCache, optional): 回答を再利用するためのキャッシュ。Noneの場合は使わない。
+            history_tokens (int): 会話履歴に保持する最大トークン数
+            session_timeout (float, optional): この時間[s]発話がなければ会話履歴をリセットする。Noneの場合はリセットしない。
+            summarize_history (bool): 上限を超えた古い会話を要約して残すか
+            tracer (LatencyTracer, optional): リクエスト毎の処理時間を記録するトレーサ
+            retriever_mode (str): 検索方法。"remote"はWeaviate、"local"はlocal_retriever、
+                "local_fallback"はlocal_retrieverで失敗した場合や、結果がないか一致度が低い場合はWeaviateを使う。
+            local_retriever (LocalRetriever, optional): プロセス内の検索エンジン。retriever_modeが"remote"以外の場合に必要。
+            rag_limit (int): プロンプトに入れる検索結果の数。節単位のチャンクを使う場合は少なくてよい。
+            local_min_match (float): "local_fallback"の場合に、local_retrieverの結果を使う検索テキストとの一致度(match_ratio)の下限
+            context_tokens (int): プロンプトに入れる検索結果の最大トークン数
+            link_model (str): 最終応答の生成に使うモデル名
+            link_backend (LinkTalkBackend, optional): link_modelを使うための追加のバックエンド。
+                OpenAI互換のローカルのエンドポイントなどを使う場合に指定する。
+            link_api (str): OpenAIのモデルで使うAPI。"tools"または"functions"。
+            talk_first (bool): linkより先にtalkを生成し、リンクの生成を待たずに読み上げを始めるか
+            speculative (bool): 音声認識の途中結果で最終応答を先行して生成するか
+            speculation_threshold (float): 途中結果と最終結果の正規化した編集距離がこの値以下なら、先行生成した応答を使う
+            voice_address (str): 既定のvoice_serverのアドレス
+            display_address (str): 既定のstreamlit_serverのアドレス
+            session_endpoints (Dict[str, Dict[str, str]], optional): セッションID毎の
+                {"voice": voice_serverのアドレス, "display": streamlit_serverのアドレス}
+            allowed_addresses (Sequence[str], optional): メタデータのvoice-address、display-addressで指定を許可するアドレス。
+                既定のアドレスとsession_endpointsのアドレスは常に許可する。
+            session_idle_timeout (float, optional): この時間[s]リクエストがないセッションを破棄する。Noneの場合は破棄しない。
+            first_phrase_chars (int, optional): 最初の文を読点で区切る最小文字数。Noneの場合は区切らない。
+            first_phrase_max_chars (int, optional): 最初の文に読点などがない場合に、助詞の後で区切る最小文字数。Noneの場合は区切らない。
+            phrase_chars (int, optional): 2文目以降を読点で区切る最小文字数。Noneの場合は区切らない。
+            voice_api (str): voice_serverへの送信方法。"stream"は1本のストリームで送信し、
+                voice_serverが対応していなければunary RPCを使う。"unary"は常にunary RPCを使う。
+            voice_window (int): "stream"の場合に、voice_serverの処理を待たずに送信できるイベントの最大数
+            preload_limit (int): 検索結果に含まれるリンクのうち、streamlit_serverに先読みを依頼する最大数。0の場合は依頼しない。
+        """
+        self.link_api = link_api
+        self.field_order = TALK_FIRST if talk_first else LINK_FIRST
+        self.link_backend = link_backend
+        self.link_model = link_model
+        self.first_phrase_chars = first_phrase_chars
+        self.first_phrase_max_chars = first_phrase_max_chars
+        self.phrase_chars = phrase_chars
+        if voice_api not in VOICE_APIS:
+            raise ValueError(f"Unknown voice_api: {voice_api}")
+        self.voice_api = voice_api
+        self.voice_window = voice_window
+        self.preload_limit = preload_limit
+        self.history_tokens = history_tokens
+        self.session_timeout = session_timeout
+        self.summarize_history = summarize_history
+        self.voice_address = voice_address
+        self.display_address = display_address
+        self.session_endpoints = session_endpoints if session_endpoints is not None else {}
+        # 任意のクライアントが任意のホストに接続させられないよう、接続先は設定したアドレスに限る
+        self.allowed_addresses = {voice_address, display_address}
+        if allowed_addresses is not None:
+            self.allowed_addresses.update(allowed_addresses)
+        for endpoints in self.session_endpoints.values():
+            self.allowed_addresses.update(endpoints.values())
+        self.session_idle_timeout = session_idle_timeout
+        # セッションID -> セッション。gRPCのチャンネルはアドレス毎に全セッションで共有する
+        self.sessions_lock = threading.Lock()
+        self.sessions: Dict[str, GptSession] = {}
+        self.channels: Dict[str, grpc.Channel] = {}
+        # chat_and_linkのバックエンドは最初のセッションで作成し、以降のセッションで共有する
+        self.link_backends_lock = threading.Lock()
+        self.link_backends: Optional[List[LinkTalkBackend]] = None
+        if retriever_mode != "remote" and local_retriever is None:
+            raise ValueError(f"local_retriever is required for {retriever_mode} mode")
+        self.local_retriever = local_retriever if retriever_mode != "remote" else None
+        self.weaviate_controller = None
+        if retriever_mode != "local":
+            self.weaviate_controller = WeaviateRagController(
+                host=weaviate_host, port=weaviate_port
+            )
+        self.collections = collection_name
+        self.rag_limit = rag_limit
+        self.local_min_match = local_min_match
+        self.prompt_builder = PromptBuilder(max_context_tokens=context_tokens)
+        self.rag_prefetcher = None
+        if prefetch_rag:
+            self.rag_prefetcher = RagPrefetcher(search_func=self.search_context)
+        self.answer_cache = answer_cache
+        self.tracer = tracer if tracer is not None else LatencyTracer()
+        self.speculative = speculative
+        self.speculation_threshold = speculation_threshold
+        # 先行生成の統計。gRPCの複数のスレッドから更新するため、speculation_stats_lockを取得して更新する
+        self.speculation_stats_lock = threading.Lock()
+        self.speculation_hits = 0
+        self.speculation_misses = 0
+        self.speculation_saved_time = 0.0
+
+    def get_channel(self, address: str) -> grpc.Channel:
+        """
+        アドレスに接続するgRPCのチャンネルを返す。同じアドレスのチャンネルは使い回す。
+        Args:
+            address (str): 接続先のアドレス("host:port")
+
+        Returns:
+            grpc.Channel: チャンネル
+        """
+        with self.sessions_lock:
+            channel = self.channels.get(address)
+            if channel is None:
+                channel = grpc.insecure_channel(address)
+                self.channels[address] = channel
+            return channel
+
+    def get_session(self, context: Optional[grpc.ServicerContext]) -> GptSession:
         """
-        self.chat_stream_akari_introducer = ChatStreamAkariIntroducer()
-        self.messages = []
-        self.messages = [
-            self.chat_stream_akari_introducer.create_message("", role="system")
+        リクエストのメタデータのsession-idに対応するセッションを返す。初めてのセッションIDであれば作成する。
+        voice_serverとstreamlit_serverのアドレスは、session_endpointsの設定、メタデータのvoice-addressとdisplay-address、
+        既定のアドレスの順に使う。メタデータのアドレスがallowed_addressesにない場合はPERMISSION_DENIEDで中断する。
+        Args:
+            context (grpc.ServicerContext, optional): リクエストのコンテキスト
+
+        Returns:
+            GptSession: セッション
+        """
+        metadata = {}
+        if context is not None:
+            metadata = dict(context.invocation_metadata())
+        session_id = metadata.get("session-id", "")
+        self.evict_idle_sessions()
+        with self.sessions_lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                session.last_active = time.time()
+        if session is not None:
+            return session
+        endpoints = self.session_endpoints.get(session_id, {})
+        voice_address = endpoints.get(
+            "voice", metadata.get("voice-address", self.voice_address)
+        )
+        display_address = endpoints.get(
+            "display", metadata.get("display-address", self.display_address)
+        )
+        for address in (voice_address, display_address):
+            if address not in self.allowed_addresses:
+                print(f"Reject session '{session_id}': {address} is not allowed.")
+                if context is not None:
+                    context.abort(
+                        grpc.StatusCode.PERMISSION_DENIED,
+                        f"{address} is not an allowed address",
+                    )
+                raise ValueError(f"{address} is not an allowed address")
+        with self.link_backends_lock:
+            chat_stream_akari_introducer = ChatStreamAkariIntroducer(
+                link_api=self.link_api,
+                field_order=self.field_order,
+                link_sender=LinkSender(
+                    channel=self.get_channel(display_address),
+                    on_rendered=functools.partial(self.record_render, session_id),
+                ),
+                first_phrase_chars=self.first_phrase_chars,
+                first_phrase_max_chars=self.first_phrase_max_chars,
+                phrase_chars=self.phrase_chars,
+                link_backends=self.link_backends,
+            )
+            if self.link_backends is None:
+                if self.link_backend is not None:
+                    chat_stream_akari_introducer.add_link_backend(self.link_backend)
+                self.link_backends = chat_stream_akari_introducer.link_backends
+        history = ConversationHistory(
+            create_message=chat_stream_akari_introducer.create_message,
+            max_tokens=self.history_tokens,
+            session_timeout=self.session_timeout,
+            summarizer=openai_summarizer if self.summarize_history else None,
+        )
+        voice_channel = self.get_channel(voice_address)
+        if self.voice_api == "stream":
+            voice: VoiceSender = StreamVoiceSender(
+                voice_channel, window=self.voice_window
+            )
+        else:
+            voice = VoiceSender(voice_channel)
+        with self.sessions_lock:
+            # 同じセッションIDの同時リクエストで作成された場合は先に登録された方を使う
+            session = self.sessions.setdefault(
+                session_id,
+                GptSession(session_id, chat_stream_akari_introducer, history, voice),
+            )
+            session.last_active = time.time()
+        if session.chat_stream_akari_introducer is chat_stream_akari_introducer:
+            print(
+                f"New session '{session_id}' (voice: {voice_address}, display: {display_address})"
+            )
+        else:
+            chat_stream_akari_introducer.link_sender.stop()
+            voice.close()
+        return session
+
+    def evict_idle_sessions(self) -> None:
+        """
+        session_idle_timeout[s]以上リクエストがなく、生成中の応答もないセッションを破棄する。
+        """
+        if self.session_idle_timeout is None:
+            return
+        now = time.time()
+        with self.sessions_lock:
+            idle_sessions = [
+                session
+                for session in self.sessions.values()
+                if session.is_idle(now, self.session_idle_timeout)
+            ]
+            for session in idle_sessions:
+                del self.sessions[session.session_id]
+        for session in idle_sessions:
+            print(f"Close idle session '{session.session_id}'")
+            session.close()
+
+    def record_render(
+        self, session_id: str, url: str, latency: float, preloaded: bool
+    ) -> None:
+        """
+        リンクの送信から表示側の描画完了までの時間を記録する
+        Args:
+            session_id (str): セッションID
+            url (str): 描画したリンク
+            latency (float): 送信から描画完了までの時間[s]
+            preloaded (bool): 先読み済みだったか
+        """
+        self.tracer.start_trace(
+            "link_render",
+            start_time=time.time() - latency,
+            url=url,
+            session=session_id,
+            preloaded=preloaded,
+        ).end()
+
+    def preload_links(self, session: GptSession, contexts: List[Tuple[str, float]]) -> None:
+        """
+        検索結果に含まれるリンクの先読みをstreamlit_serverに依頼する
+        Args:
+            session (GptSession): 応答するセッション
+            contexts (List[Tuple[str, float]]): (本文, スコア)の検索結果のリスト
+        """
+        if self.preload_limit <= 0:
+            return
+        candidates = extract_link_candidates(contexts, limit=self.preload_limit)
+        if len(candidates) == 0:
+            return
+        urls, scores = zip(*candidates)
+        session.chat_stream_akari_introducer.link_sender.preload(urls, scores)
+        current_trace().event("links_preloaded", count=len(urls))
+
+    def start_generation(
+        self, session: GptSession, is_finish: bool
+    ) -> Tuple[int, threading.Event]:
+        """
+        新しい応答の生成を開始する。生成中の古い応答は全てキャンセルする。
+        Args:
+            session (GptSession): 応答するセッション
+            is_finish (bool): 最終応答かどうか
+
+        Returns:
+            Tuple[int, threading.Event]: (生成ID, キャンセル時にセットされるイベント)
+        """
+        cancel_event = threading.Event()
+        with session.generation_lock:
+            session.generation_id += 1
+            generation_id = session.generation_id
+            session.generations[generation_id] = (cancel_event, is_finish)
+        self.cancel(session, exclude_id=generation_id)
+        return generation_id, cancel_event
+
+    def end_generation(self, session: GptSession, generation_id: int) -> None:
+        """
+        応答の生成を終了する
+        Args:
+            session (GptSession): 応答するセッション
+            generation_id (int): 生成ID
+        """
+        with session.generation_lock:
+            session.generations.pop(generation_id, None)
+
+    def cancel(self, session: GptSession, exclude_id: Optional[int] = None) -> bool:
+        """
+        生成中の応答をキャンセルする。最終応答をキャンセルした場合は音声合成の再生待ちも破棄する。
+        Args:
+            session (GptSession): 応答するセッション
+            exclude_id (int, optional): キャンセルしない生成ID
+
+        Returns:
+            bool: キャンセルした応答があればTrue
+        """
+        cancelled = False
+        interrupt_voice = False
+        with session.generation_lock:
+            for generation_id, (cancel_event, is_finish) in session.generations.items():
+                if generation_id == exclude_id or cancel_event.is_set():
+                    continue
+                cancel_event.set()
+                cancelled = True
+                interrupt_voice |= is_finish
+        if interrupt_voice:
+            print("Interrupt previous answer.")
+            try:
+                session.voice.interrupt()
+            except grpc.RpcError as e:
+                print(f"InterruptVoice error: {e}")
+        return cancelled
+
+    def search_context(self, text: str) -> List[Tuple[str, float]]:
+        """
+        テキストをWeaviateまたはプロセス内の検索エンジンで検索する
+        Args:
+            text (str): 検索テキスト
+
+        Returns:
+            List[Tuple[str, float]]: (本文, スコア)の検索結果のリスト
+        """
+        weaviate_response = None
+        if self.local_retriever is not None:
+            try:
+                weaviate_response = self.local_retriever.hybrid_search(
+                    text=text, limit=self.rag_limit, alpha=0.75
+                )
+            except Exception as e:
+                if self.weaviate_controller is None:
+                    raise
+                print(f"Local search error: {e}. Fallback to Weaviate.")
+            if weaviate_response is not None and self.weaviate_controller is not None:
+                if len(weaviate_response.objects) == 0:
+                    print("Local search has no result. Fallback to Weaviate.")
+                    weaviate_response = None
+                elif weaviate_response.match_ratio < self.local_min_match:
+                    print(
+                        f"Local search match {weaviate_response.match_ratio:.2f} is low. "
+                        "Fallback to Weaviate."
+                    )
+                    weaviate_response = None
+        if weaviate_response is None:
+            weaviate_response = self.weaviate_controller.hybrid_search(
+                collection_name=self.collections,
+                text=text,
+                limit=self.rag_limit,
+                alpha=0.75,
+                rerank=False,
+            )
+        return [
+            (p.properties["content"], getattr(p.metadata, "score", None) or 0.0)
+            for p in weaviate_response.objects
         ]
-        voice_channel = grpc.insecure_channel("localhost:10002")
-        self.stub = voice_server_pb2_grpc.VoiceServerServiceStub(voice_channel)
-        self.weaviate_controller = WeaviateRagController(
-            host=weaviate_host, port=weaviate_port
+
+    def speculate(
+        self,
+        session: GptSession,
+        text: str,
+        cancel_event: threading.Event,
+        on_link: Callable[[str], None],
+    ) -> Iterator[str]:
+        """
+        音声認識の途中結果から最終応答を生成する。リンクは送信せずにon_linkに渡す。
+        Args:
+            session (GptSession): 応答するセッション
+            text (str): 音声認識の途中結果
+            cancel_event (threading.Event): セットされると生成を中断するイベント
+            on_link (Callable[[str], None]): リンクを受け取る関数
+
+        Yields:
+            str: 応答の文
+        """
+        if self.rag_prefetcher is not None:
+            contexts = self.rag_prefetcher.get(text, session.session_id)
+        else:
+            contexts = self.search_context(text)
+        if cancel_event.is_set():
+            return
+        self.preload_links(session, contexts)
+        system_prompt, _ = self.prompt_builder.build(contexts)
+        messages = session.history.build(
+            session.chat_stream_akari_introducer.create_message(
+                system_prompt, role="system"
+            ),
+            session.chat_stream_akari_introducer.create_message(text),
         )
-        self.collections = collection_name
+        yield from session.chat_stream_akari_introducer.chat_and_link(
+            messages,
+            model=self.link_model,
+            cancel_event=cancel_event,
+            on_link=on_link,
+        )
+
+    def start_speculation(self, session: GptSession, text: str) -> None:
+        """
+        途中結果で最終応答の先行生成を開始する。前回の途中結果と同じ内容であれば、生成中のものを使い続ける。
+        Args:
+            session (GptSession): 応答するセッション
+            text (str): 音声認識の途中結果
+        """
+        with session.speculation_lock:
+            previous = session.speculation
+            if previous is not None and normalize_text(previous.text) == normalize_text(
+                text
+            ):
+                return
+            session.speculation = Speculation(
+                text, functools.partial(self.speculate, session)
+            )
+        if previous is not None:
+            previous.cancel()
+
+    def take_speculation(
+        self, session: GptSession, text: str
+    ) -> Optional[Speculation]:
+        """
+        先行生成中の応答を取り出し、最終結果と十分近ければ返す。近くなければキャンセルする。
+        Args:
+            session (GptSession): 応答するセッション
+            text (str): 音声認識の最終結果
+
+        Returns:
+            Speculation: 採用する先行生成。ない場合はNone。
+        """
+        with session.speculation_lock:
+            speculation = session.speculation
+            session.speculation = None
+        if speculation is None:
+            return None
+        distance = edit_distance_ratio(
+            normalize_text(speculation.text), normalize_text(text)
+        )
+        if distance <= self.speculation_threshold:
+            return speculation
+        speculation.cancel()
+        with self.speculation_stats_lock:
+            self.speculation_misses += 1
+        print(
+            f"Speculation miss: {speculation.text} -> {text} (distance {distance:.2f})"
+        )
+        current_trace().event("speculation_miss", distance=distance)
+        return None
 
     def SetGpt(
         self, request: gpt_server_pb2.SetGptRequest(), context: grpc.ServicerContext
     ) -> gpt_server_pb2.SetGptReply:
-        response = ""
         is_finish = True
         if request.HasField("is_finish"):
             is_finish = request.is_finish
         if len(request.text) < 2:
             return gpt_server_pb2.SetGptReply(success=True)
-        print(f"Receive: {request.text}")
+        session = self.get_session(context)
+        print(f"Receive[{session.session_id}]: {request.text}")
+        trace = self.tracer.start_trace(
+            "set_gpt", text=request.text, is_finish=is_finish, session=session.session_id
+        )
         content = f"{request.text}。"
-        tmp_messages = copy.deepcopy(self.messages)
-        tmp_messages.append(self.chat_stream_akari_introducer.create_message(content))
+        if not is_finish and self.rag_prefetcher is not None:
+            # 途中結果の時点で検索を開始しておき、最終応答で再利用する
+            self.rag_prefetcher.prefetch(content, session.session_id)
+        if not is_finish and self.speculative:
+            self.start_speculation(session, content)
+        generation_id, cancel_event = self.start_generation(session, is_finish)
+        try:
+            self.generate_answer(session, content, is_finish, cancel_event)
+        finally:
+            self.end_generation(session, generation_id)
+            trace.end(cancelled=cancel_event.is_set())
+        print("")
+        return gpt_server_pb2.SetGptReply(success=True)
+
+    def generate_answer(
+        self,
+        session: GptSession,
+        content: str,
+        is_finish: bool,
+        cancel_event: threading.Event,
+    ) -> None:
+        """
+        応答を生成し、voice_serverに送信する
+        Args:
+            session (GptSession): 応答するセッション
+            content (str): ユーザの発話
+            is_finish (bool): 最終応答かどうか
+            cancel_event (threading.Event): セットされると生成を中断するイベント
+        """
+        response = ""
+        trace = current_trace()
+        user_message = session.chat_stream_akari_introducer.create_message(content)
+        system_message = session.chat_stream_akari_introducer.create_message(
+            "", role="system"
+        )
         if is_finish:
-            self.messages = copy.deepcopy(tmp_messages)
+            session.history.append(user_message)
+            tmp_messages = session.history.build(system_message)
+        else:
+            # 途中結果は履歴に追加しない
+            tmp_messages = session.history.build(system_message, user_message)
         if is_finish:
-            # 最終応答。高速生成するために、モデルはgpt-4o
-            # テキストをWeaviateで検索
-            weaviate_response = self.weaviate_controller.hybrid_search(
-                collection_name=self.collections,
-                text=content,
-                limit=3,
-                alpha=0.75,
-                rerank=False,
-            )
-            contexts = ""
-            for p in weaviate_response.objects:
-                contexts += p.properties["content"]
-            # system_promptをWeaviateの検索結果を含んだ文に変更
-            system_prompt = system_prompt_creator(context=contexts)
-            tmp_messages[0] = self.chat_stream_akari_introducer.create_message(
-                system_prompt, role="system"
-            )
-            response = ""
-            self.stub.StartHeadControl(voice_server_pb2.StartHeadControlRequest())
-            for sentence in self.chat_stream_akari_introducer.chat_and_link(
-                tmp_messages, model="gpt-4o"
-            ):
+            cached_answer = None
+            speculation = None
+            # 会話の途中の質問は前の話題に依存するため、回答キャッシュは会話の最初の質問にのみ使う
+            first_turn = len(tmp_messages) == 2
+            session.chat_stream_akari_introducer.last_link = None
+
+            def send_link(url: str) -> None:
+                print(f"============Link: {url}")
+                session.chat_stream_akari_introducer.last_link = url
+                session.chat_stream_akari_introducer.send_link(url)
+                # 表示を読み上げと合わせられるよう、voice_serverにも文と同じ順序で送る
+                session.voice.send_link(url)
+                trace.event("link_emitted", url=url)
+
+            if self.answer_cache is not None and first_turn:
+                cached_answer = self.answer_cache.get(content)
+            if self.speculative:
+                speculation = self.take_speculation(session, content)
+                if speculation is not None and cached_answer is not None:
+                    speculation.cancel()
+                    speculation = None
+                if speculation is not None and not speculation.wait_first_sentence(
+                    cancel_event
+                ):
+                    # 文を生成せずに失敗した先行生成は使わず、通常の検索と生成を行う
+                    speculation.cancel()
+                    if not cancel_event.is_set():
+                        with self.speculation_stats_lock:
+                            self.speculation_misses += 1
+                        print(f"Speculation {speculation.state} without sentences.")
+                        trace.event("speculation_failed", state=speculation.state)
+                    speculation = None
+            if cached_answer is not None:
+                # キャッシュ済みの回答とリンクをそのまま再生する
+                cached_sentences, link = cached_answer
+                trace.event("answer_cache_hit")
+                if link != "":
+                    send_link(link)
+                sentences = iter(cached_sentences)
+            elif speculation is not None:
+                # 途中結果で先行生成した応答をそのまま使う
+                trace.event("speculation_hit")
+                with self.speculation_stats_lock:
+                    self.speculation_hits += 1
+                sentences = speculation.promote(send_link, cancel_event)
+            else:
+                # 最終応答。高速生成するために、モデルは既定でgpt-4o
+                # テキストをWeaviateで検索
+                with trace.span("weaviate_search"):
+                    if self.rag_prefetcher is not None:
+                        contexts = self.rag_prefetcher.get(content, session.session_id)
+                    else:
+                        contexts = self.search_context(content)
+                # LLMがリンクを選ぶ前に、候補のリンクを表示側で読み込んでおく
+                self.preload_links(session, contexts)
+                # system_promptをWeaviateの検索結果を含んだ文に変更
+                with trace.span("prompt_build"):
+                    system_prompt, prompt_stats = self.prompt_builder.build(contexts)
+                    tmp_messages[0] = session.chat_stream_akari_introducer.create_message(
+                        system_prompt, role="system"
+                    )
+                print(
+                    f"Prompt tokens: {prompt_stats['prompt_tokens']} "
+                    f"(context: {prompt_stats['context_tokens']}, chunks: {prompt_stats['chunks']})"
+                )
+                trace.event("prompt_tokens", **prompt_stats)
+                sentences = session.chat_stream_akari_introducer.chat_and_link(
+                    tmp_messages,
+                    model=self.link_model,
+                    cancel_event=cancel_event,
+                    on_link=send_link,
+                )
+            sent_sentences = []
+            if cancel_event.is_set():
+                if speculation is not None:
+                    speculation.cancel()
+                return
+            session.voice.start_head_control()
+            for sentence in sentences:
+                if cancel_event.is_set():
+                    break
+                if len(sent_sentences) == 0:
+                    trace.event("first_sentence")
                 print(f"Send to voice server: {sentence}")
-                self.stub.SetText(voice_server_pb2.SetTextRequest(text=sentence))
+                with trace.span("set_text", index=len(sent_sentences)):
+                    session.voice.set_text(sentence)
                 response += sentence
-            # Sentenceの終了を通知
-            self.stub.SentenceEnd(voice_server_pb2.SentenceEndRequest())
-            self.messages.append(
-                self.chat_stream_akari_introducer.create_message(
-                    response, role="assistant"
+                sent_sentences.append(sentence)
+            if speculation is not None:
+                if cancel_event.is_set():
+                    speculation.cancel()
+                saved_time = speculation.saved_time()
+                if saved_time is not None:
+                    trace.event("speculation_saved", saved_ms=saved_time * 1000)
+                with self.speculation_stats_lock:
+                    if saved_time is not None:
+                        self.speculation_saved_time += saved_time
+                    hits = self.speculation_hits
+                    total = hits + self.speculation_misses
+                    mean_saved_time = self.speculation_saved_time / hits
+                print(
+                    f"Speculation hit: {hits}/{total}, "
+                    f"saved {(saved_time or 0.0) * 1000:.0f} [ms] "
+                    f"(mean {mean_saved_time * 1000:.0f} [ms])"
+                )
+            if not cancel_event.is_set():
+                # Sentenceの終了を通知
+                with trace.span("sentence_end"):
+                    session.voice.sentence_end()
+            if response != "":
+                session.history.append(
+                    session.chat_stream_akari_introducer.create_message(
+                        response, role="assistant"
+                    )
+                )
+            if (
+                not cancel_event.is_set()
+                and cached_answer is None
+                and self.answer_cache is not None
+                and first_turn
+            ):
+                # リンクのない雑談の回答も、再生時にリンクの送信を省いて再利用する
+                self.answer_cache.put(
+                    content,
+                    sent_sentences,
+                    session.chat_stream_akari_introducer.last_link or "",
                 )
-            )
         else:
             # 途中での第一声とモーション準備。function_callingの確実性のため、モデルはgpt-4-turbo
-            for sentence in self.chat_stream_akari_introducer.chat_and_motion(
+            for sentence in session.chat_stream_akari_introducer.chat_and_motion(
                 tmp_messages, model="gpt-4-turbo", short_response=True
             ):
+                if cancel_event.is_set():
+                    break
+                if response == "":
+                    trace.event("first_sentence")
                 print(f"Send to voice server: {sentence}")
-                self.stub.SetText(voice_server_pb2.SetTextRequest(text=sentence))
+                with trace.span("set_text"):
+                    session.voice.set_text(sentence)
                 response += sentence
-                self.chat_stream_akari_introducer.send_reserved_motion()
-        print("")
-        return gpt_server_pb2.SetGptReply(success=True)
+                session.chat_stream_akari_introducer.send_reserved_motion()
 
     def SendMotion(
         self, request: gpt_server_pb2.SendMotionRequest(), context: grpc.ServicerContext
     ) -> gpt_server_pb2.SendMotionReply:
-        success = self.chat_stream_akari_introducer.send_reserved_motion()
+        session = self.get_session(context)
+        success = session.chat_stream_akari_introducer.send_reserved_motion()
         return gpt_server_pb2.SendMotionReply(success=success)
 
 
+def start_readiness_server(
+    host: str, port: int, ready: threading.Event
+) -> ThreadingHTTPServer:
+    """
+    gRPCサーバが応答可能かどうかを返すHTTPサーバを起動する
+    Args:
+        host (str): ホスト名
+        port (int): ポート番号
+        ready (threading.Event): 応答可能な間セットされるイベント
+
+    Returns:
+        ThreadingHTTPServer: 起動したHTTPサーバ
+    """
+
+    class ReadinessHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path != "/ready":
+                self.send_error(404)
+                return
+            status = 200 if ready.is_set() else 503
+            body = b"ready\n" if status == 200 else b"not ready\n"
+            self.send_response(status)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args) -> None:
+            return
+
+    http_server = ThreadingHTTPServer((host, port), ReadinessHandler)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    print(f"readiness endpoint start. http://{host}:{port}/ready")
+    return http_server
+
+
 def main() -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -141,24 +846,320 @@ def main() -> None:
         type=int,
         help="Weaviate port number",
     )
+    parser.add_argument(
+        "--prefetch_rag",
+        action="store_true",
+        help="Start RAG search on partial speech recognition results",
+    )
+    parser.add_argument(
+        "--answer_cache",
+        type=str,
+        help="Answer cache file path. If set, answers to similar questions are reused",
+    )
+    parser.add_argument(
+        "--answer_cache_threshold",
+        default=0.9,
+        type=float,
+        help="Similarity threshold for answer cache hits",
+    )
+    parser.add_argument(
+        "--answer_cache_ttl",
+        default=24 * 60 * 60,
+        type=float,
+        help="Answer cache entry lifetime [s]",
+    )
+    parser.add_argument(
+        "--rag_data",
+        default="rag_data/",
+        type=str,
+        help="RAG data path uploaded to Weaviate. Used for local retrieval and answer cache invalidation",
+    )
+    parser.add_argument(
+        "--rag_limit",
+        default=3,
+        type=int,
+        help="Number of search results included in the prompt",
+    )
+    parser.add_argument(
+        "--context_tokens",
+        default=1500,
+        type=int,
+        help="Max tokens of search results included in the prompt",
+    )
+    parser.add_argument(
+        "--history_tokens",
+        default=2000,
+        type=int,
+        help="Max tokens of conversation history sent to the model",
+    )
+    parser.add_argument(
+        "--session_timeout",
+        default=100.0,
+        type=float,
+        help="Reset conversation history after this idle time [s]. 0 disables the reset",
+    )
+    parser.add_argument(
+        "--summarize_history",
+        action="store_true",
+        help="Summarize old conversation turns instead of dropping them",
+    )
+    parser.add_argument(
+        "--retriever",
+        default="remote",
+        choices=["remote", "local", "local_fallback"],
+        help="Retrieval backend. local_fallback uses Weaviate when local search fails or its match is low",
+    )
+    parser.add_argument(
+        "--local_min_match",
+        default=0.12,
+        type=float,
+        help="Min ratio of the query matched by the top local result to skip Weaviate in local_fallback mode",
+    )
+    parser.add_argument(
+        "--local_embedding",
+        choices=["local", "openai"],
+        help="Dense vectors in local retrieval. 'local' embeds on this machine with sentence-transformers. "
+        "'openai' calls the OpenAI API for every query. BM25 only if not set",
+    )
+    parser.add_argument(
+        "--embedding_model",
+        type=str,
+        help="Embedding model name for --local_embedding. Defaults to each embedder's model",
+    )
+    parser.add_argument(
+        "--embedding_cache",
+        default=".cache/",
+        type=str,
+        help="Directory to save chunk embeddings so only changed chunks are embedded at startup",
+    )
+    parser.add_argument(
+        "--link_model",
+        default="gpt-4o",
+        type=str,
+        help="Model name for final answers with links",
+    )
+    parser.add_argument(
+        "--link_api",
+        default="tools",
+        choices=["tools", "functions"],
+        help="OpenAI API for link and talk generation",
+    )
+    parser.add_argument(
+        "--talk_first",
+        action="store_true",
+        help="Generate talk before link so speech starts without waiting for the link",
+    )
+    parser.add_argument(
+        "--speculative",
+        action="store_true",
+        help="Start final answer generation on partial speech recognition results",
+    )
+    parser.add_argument(
+        "--speculation_threshold",
+        default=0.2,
+        type=float,
+        help="Max normalized edit distance between partial and final text to use the speculative answer",
+    )
+    parser.add_argument(
+        "--first_phrase_chars",
+        default=4,
+        type=int,
+        help="Split the first sentence at a comma after this many characters for earlier speech. 0 disables",
+    )
+    parser.add_argument(
+        "--first_phrase_max_chars",
+        default=8,
+        type=int,
+        help="Split the first sentence after a particle following a noun once it has this many characters without a comma. 0 disables",
+    )
+    parser.add_argument(
+        "--phrase_chars",
+        default=40,
+        type=int,
+        help="Split later sentences at a comma after this many characters. 0 disables",
+    )
+    parser.add_argument(
+        "--local_llm_url",
+        type=str,
+        help="OpenAI compatible endpoint URL serving --link_model (e.g. llama.cpp server http://host:8080/v1)",
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        help="JSONL file path to write latency spans. Disabled if not set",
+    )
+    parser.add_argument(
+        "--ready_port",
+        type=int,
+        help="HTTP port number for readiness endpoint (/ready). Disabled if not set",
+    )
+    parser.add_argument(
+        "--grace",
+        default=10.0,
+        type=float,
+        help="Grace period [s] to finish in-flight requests on shutdown",
+    )
+    parser.add_argument(
+        "--voice_address",
+        default="localhost:10002",
+        type=str,
+        help="Default voice server address",
+    )
+    parser.add_argument(
+        "--display_address",
+        default="localhost:10010",
+        type=str,
+        help="Default streamlit server address",
+    )
+    parser.add_argument(
+        "--sessions",
+        type=str,
+        help='Session endpoint file (json). {"session-id": {"voice": "host:port", "display": "host:port"}}',
+    )
+    parser.add_argument(
+        "--allow_address",
+        nargs="*",
+        default=[],
+        type=str,
+        help="Addresses allowed in voice-address/display-address metadata in addition to the default and --sessions addresses",
+    )
+    parser.add_argument(
+        "--session_idle_timeout",
+        default=600.0,
+        type=float,
+        help="Close sessions without requests for this time [s]. 0 keeps them",
+    )
+    parser.add_argument(
+        "--max_workers",
+        default=10,
+        type=int,
+        help="Max gRPC worker threads. Increase when serving many robots",
+    )
+    parser.add_argument(
+        "--voice_api",
+        default="stream",
+        choices=VOICE_APIS,
+        help="How to send sentences to the voice server. 'stream' falls back to unary RPCs if the server does not support it",
+    )
+    parser.add_argument(
+        "--preload_links",
+        default=3,
+        type=int,
+        help="Max links in the search results to preload in the display before the LLM picks one. 0 disables",
+    )
+    parser.add_argument(
+        "--voice_window",
+        default=16,
+        type=int,
+        help="Max voice stream events sent before the voice server processes them",
+    )
     args = parser.parse_args()
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    answer_cache = None
+    if args.answer_cache is not None:
+        version = ""
+        if os.path.isdir(args.rag_data):
+            version = data_fingerprint(args.rag_data)
+        answer_cache = AnswerCache(
+            path=args.answer_cache,
+            version=version,
+            threshold=args.answer_cache_threshold,
+            ttl=args.answer_cache_ttl,
+        )
+    session_endpoints = None
+    if args.sessions is not None:
+        with open(args.sessions, "r", encoding="utf-8") as file:
+            session_endpoints = json.load(file)
+    local_retriever = None
+    if args.retriever != "remote":
+        embed_func = None
+        vector_cache = None
+        if args.local_embedding is not None:
+            create_embedder = (
+                sentence_transformer_embedder
+                if args.local_embedding == "local"
+                else openai_embedder
+            )
+            if args.embedding_model is not None:
+                embed_func = create_embedder(args.embedding_model)
+            else:
+                embed_func = create_embedder()
+            model_name = args.embedding_model or args.local_embedding
+            vector_cache = os.path.join(
+                args.embedding_cache, f"{model_name.replace('/', '_')}.npz"
+            )
+        local_retriever = LocalRetriever.from_path(
+            args.rag_data, embed_func=embed_func, vector_cache=vector_cache
+        )
+        print(f"Local retriever loaded: {len(local_retriever.chunks)} chunks")
+    link_backend = None
+    if args.local_llm_url is not None:
+        link_backend = OpenAICompatibleBackend(
+            base_url=args.local_llm_url,
+            models=[args.link_model],
+            field_order=TALK_FIRST if args.talk_first else LINK_FIRST,
+        )
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=args.max_workers))
     gpt_server_pb2_grpc.add_GptServerServiceServicer_to_server(
         GptServer(
             collection_name=args.collections,
             weaviate_host=args.weaviate_host,
             weaviate_port=args.weaviate_port,
+            prefetch_rag=args.prefetch_rag,
+            answer_cache=answer_cache,
+            history_tokens=args.history_tokens,
+            session_timeout=args.session_timeout if args.session_timeout > 0 else None,
+            summarize_history=args.summarize_history,
+            rag_limit=args.rag_limit,
+            local_min_match=args.local_min_match,
+            context_tokens=args.context_tokens,
+            link_model=args.link_model,
+            link_backend=link_backend,
+            link_api=args.link_api,
+            talk_first=args.talk_first,
+            speculative=args.speculative,
+            speculation_threshold=args.speculation_threshold,
+            voice_address=args.voice_address,
+            display_address=args.display_address,
+            session_endpoints=session_endpoints,
+            allowed_addresses=args.allow_address,
+            session_idle_timeout=(
+                args.session_idle_timeout if args.session_idle_timeout > 0 else None
+            ),
+            first_phrase_chars=args.first_phrase_chars or None,
+            first_phrase_max_chars=args.first_phrase_max_chars or None,
+            phrase_chars=args.phrase_chars or None,
+            voice_api=args.voice_api,
+            voice_window=args.voice_window,
+            preload_limit=args.preload_links,
+            tracer=LatencyTracer(path=args.trace, service="introduce_gpt_publisher"),
+            retriever_mode=args.retriever,
+            local_retriever=local_retriever,
         ),
         server,
     )
     server.add_insecure_port(args.ip + ":" + args.port)
     server.start()
     print(f"gpt_publisher start. port: {args.port}")
-    try:
-        while True:
-            pass
-    except KeyboardInterrupt:
-        exit()
+    ready = threading.Event()
+    ready.set()
+    readiness_server = None
+    if args.ready_port is not None:
+        readiness_server = start_readiness_server(args.ip, args.ready_port, ready)
+
+    def shutdown(signum: int, frame) -> None:
+        # 新規リクエストの受付を止め、処理中のSetGptはgrace秒まで完了を待つ
+        if not ready.is_set():
+            return
+        print(f"gpt_publisher stopping. signal: {signal.Signals(signum).name}")
+        ready.clear()
+        server.stop(grace=args.grace)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    server.wait_for_termination()
+    if readiness_server is not None:
+        readiness_server.shutdown()
+    print("gpt_publisher stopped.")
 
 
 if __name__ == "__main__":
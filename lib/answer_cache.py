@@ -0,0 +1,202 @@
+import difflib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from lib.rag_prefetcher import normalize_text
+
+
+def data_fingerprint(path: str) -> str:
+    """RAG用データのディレクトリからフィンガープリントを計算する。
+    Weaviateへ再アップロードするデータが変わったことを検出するために使う。
+
+    Args:
+        path (str): RAG用データのディレクトリ
+
+    Returns:
+        str: ファイルのパス、サイズ、更新日時から計算したハッシュ値
+    """
+    sha = hashlib.sha1()
+    for root, dirs, files in sorted(os.walk(path)):
+        dirs.sort()
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            stat = os.stat(file_path)
+            sha.update(
+                f"{os.path.relpath(file_path, path)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode()
+            )
+    return sha.hexdigest()
+
+
+class AnswerCache(object):
+    """展示会で繰り返される質問に対し、過去の回答文とリンクを再利用するためのキャッシュ。
+
+    正規化した質問文をキーとし、完全一致しない場合も類似度がしきい値以上であればヒットとする。
+    TTLとLRUで古いエントリを削除し、pathを指定した場合はJSONファイルに保存して再起動後も使う。
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        version: str = "",
+        threshold: float = 0.9,
+        ttl: float = 24 * 60 * 60,
+        max_entries: int = 256,
+    ) -> None:
+        """コンストラクタ
+
+        Args:
+            path (str, optional): 保存先のJSONファイルのパス。Noneの場合は保存しない。
+            version (str, optional): RAG用データのバージョン。保存済みのものと異なればキャッシュを破棄する。
+            threshold (float, optional): ヒットとみなす類似度のしきい値(0.0~1.0)。デフォルトは0.9。
+            ttl (float, optional): エントリの有効期間[s]。デフォルトは24時間。
+            max_entries (int, optional): 保持する最大エントリ数。デフォルトは256。
+
+        """
+        self.path = path
+        self.version = version
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # 保存はgRPCの複数のスレッドから呼ばれるため、書き込みの順序を揃える
+        self.save_lock = threading.Lock()
+        # 正規化した質問 -> {"sentences": [...], "link": str, "time": float}
+        self.entries: "OrderedDict[str, dict]" = OrderedDict()
+        self.hit_count = 0
+        self.miss_count = 0
+        self.load()
+
+    def load(self) -> None:
+        """保存済みのキャッシュを読み込む。バージョンが異なる場合は破棄する。"""
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"Answer cache load error: {e}")
+            return
+        if data.get("version") != self.version:
+            print("Answer cache is invalidated because RAG data was updated.")
+            self.save()
+            return
+        with self.lock:
+            for key, entry in data.get("entries", []):
+                self.entries[key] = entry
+            self._evict()
+        print(f"Answer cache loaded: {len(self.entries)} entries")
+
+    def save(self) -> None:
+        """キャッシュをファイルに保存する。保存に失敗しても例外は送出しない。"""
+        if self.path is None:
+            return
+        with self.save_lock:
+            with self.lock:
+                data = {"version": self.version, "entries": list(self.entries.items())}
+            directory = os.path.dirname(os.path.abspath(self.path))
+            tmp_path = None
+            try:
+                os.makedirs(directory, exist_ok=True)
+                # 同じディレクトリの一時ファイルに書き込んでから置き換える
+                with tempfile.NamedTemporaryFile(
+                    "w",
+                    encoding="utf-8",
+                    dir=directory,
+                    prefix=os.path.basename(self.path) + ".",
+                    suffix=".tmp",
+                    delete=False,
+                ) as file:
+                    tmp_path = file.name
+                    json.dump(data, file, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"Answer cache save error: {e}")
+                if tmp_path is not None and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def _evict(self) -> None:
+        now = time.time()
+        expired = [
+            key for key, entry in self.entries.items() if now - entry["time"] > self.ttl
+        ]
+        for key in expired:
+            del self.entries[key]
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _find(self, key: str) -> Optional[str]:
+        if key in self.entries:
+            return key
+        best_key = None
+        best_ratio = self.threshold
+        matcher = difflib.SequenceMatcher(b=key, autojunk=False)
+        for cached_key in self.entries:
+            matcher.set_seq1(cached_key)
+            # 上限値で足切りしてから正確な類似度を計算する
+            if matcher.real_quick_ratio() < best_ratio:
+                continue
+            if matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= best_ratio:
+                best_ratio = ratio
+                best_key = cached_key
+        return best_key
+
+    def get(self, text: str) -> Optional[Tuple[List[str], str]]:
+        """質問文に対応するキャッシュ済みの回答を取得する。
+
+        Args:
+            text (str): 質問文
+
+        Returns:
+            Optional[Tuple[List[str], str]]: (回答文のリスト, リンク)。見つからない場合はNone。
+        """
+        key = normalize_text(text)
+        with self.lock:
+            self._evict()
+            found_key = self._find(key) if key else None
+            if found_key is None:
+                self.miss_count += 1
+                result = None
+            else:
+                self.hit_count += 1
+                self.entries.move_to_end(found_key)
+                entry = self.entries[found_key]
+                result = (list(entry["sentences"]), entry["link"])
+        print(f"Answer cache hit: {self.hit_count} miss: {self.miss_count}")
+        return result
+
+    def put(self, text: str, sentences: List[str], link: str) -> None:
+        """回答をキャッシュに追加する。
+
+        Args:
+            text (str): 質問文
+            sentences (List[str]): 回答文のリスト
+            link (str): 回答と共に表示したリンク。リンクを表示しなかった場合は空文字列。
+
+        """
+        key = normalize_text(text)
+        if key == "" or len(sentences) == 0:
+            return
+        with self.lock:
+            self.entries[key] = {
+                "sentences": list(sentences),
+                "link": link,
+                "time": time.time(),
+            }
+            self.entries.move_to_end(key)
+            self._evict()
+        self.save()
+
+    def clear(self) -> None:
+        """全てのエントリを削除する。"""
+        with self.lock:
+            self.entries.clear()
+        self.save()
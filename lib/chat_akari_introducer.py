@@ -1,47 +1,199 @@
-import asyncio
-import grpc
-import json
-import os
-import sys
-from typing import Generator
-import openai
+import threading
+from typing import Callable, Generator, List, Optional, Sequence
 
 from lib.akari_rag_chatbot.lib.akari_chatgpt_bot.lib.chat_akari_grpc import (
     ChatStreamAkariGrpc,
 )
-from gpt_stream_parser import force_parse_json
-
-sys.path.append(
-    os.path.join(os.path.dirname(__file__), "grpc")
+from lib.link_sender import LinkSender
+from lib.latency_tracer import current_trace
+from lib.link_talk_backend import (
+    LINK_FIRST,
+    AnthropicToolBackend,
+    LinkTalkBackend,
+    OpenAIFunctionBackend,
+    OpenAIToolBackend,
 )
-import streamlit_server_pb2
-import streamlit_server_pb2_grpc
+from lib.link_talk_parser import LinkTalkStreamParser
+from lib.sentence_segmenter import SentenceSegmenter
 
 
 class ChatStreamAkariIntroducer(ChatStreamAkariGrpc):
     """ChatGPTやClaude3を使用して会話を行うためのクラス。"""
 
-    def __init__(self):
+    def __init__(
+        self,
+        streamlit_host: str = "localhost",
+        streamlit_port: str = "10010",
+        link_api: str = "tools",
+        field_order: Sequence[str] = LINK_FIRST,
+        link_sender: Optional[LinkSender] = None,
+        first_phrase_chars: Optional[int] = 4,
+        first_phrase_max_chars: Optional[int] = 8,
+        phrase_chars: Optional[int] = 40,
+        link_backends: Optional[List[LinkTalkBackend]] = None,
+    ):
+        """コンストラクタ
+
+        Args:
+            streamlit_host (str, optional): streamlit_serverのホスト名。デフォルトは"localhost"。
+            streamlit_port (str, optional): streamlit_serverのポート番号。デフォルトは"10010"。
+            link_api (str, optional): OpenAIのモデルで使うAPI。"tools"はtools APIとStructured Outputs、
+                "functions"は旧来のfunction calling。デフォルトは"tools"。
+            field_order (Sequence[str], optional): linkとtalkを生成する順序。TALK_FIRSTにすると回答の読み上げを先に始める。
+                "functions"では無視する。デフォルトはLINK_FIRST。
+            link_sender (LinkSender, optional): リンクの送信に使うLinkSender。Noneの場合はstreamlit_hostとstreamlit_portに送信するものを作成する。
+            first_phrase_chars (int, optional): 最初の文を読点で区切る最小文字数。Noneの場合は句点などでのみ区切る。デフォルトは4。
+            first_phrase_max_chars (int, optional): 最初の文に読点などがない場合に、助詞の後で区切る最小文字数。Noneの場合は区切らない。デフォルトは8。
+            phrase_chars (int, optional): 2文目以降を読点で区切る最小文字数。Noneの場合は句点などでのみ区切る。デフォルトは40。
+            link_backends (List[LinkTalkBackend], optional): 他のインスタンスと共有するchat_and_linkのバックエンド。
+                OpenAIのバックエンドを含むこと。Noneの場合はlink_apiとfield_orderに従って作成する。
+
+        """
         super().__init__()
-        streamlit_channel = grpc.insecure_channel("localhost:10010")
-        self.streamlit_stub = streamlit_server_pb2_grpc.StreamlitServerServiceStub(
-            streamlit_channel
+        self.link_sender = (
+            link_sender
+            if link_sender is not None
+            else LinkSender(host=streamlit_host, port=streamlit_port)
+        )
+        self.first_phrase_chars = first_phrase_chars
+        self.first_phrase_max_chars = first_phrase_max_chars
+        self.phrase_chars = phrase_chars
+        # 直近のchat_and_linkで送信したリンク。未送信の場合はNone。
+        self.last_link = None
+        self.link_backends: List[LinkTalkBackend] = (
+            list(link_backends)
+            if link_backends is not None
+            else self.create_link_backends(link_api, field_order)
+        )
+        self.openai_link_backend: LinkTalkBackend = next(
+            backend
+            for backend in self.link_backends
+            if type(backend) in (OpenAIFunctionBackend, OpenAIToolBackend)
         )
 
-    async def send_link(self, url: str) -> None:
-        """gRPCを使用してリンクを送信するメソッド。
+    def create_link_backends(
+        self, link_api: str, field_order: Sequence[str]
+    ) -> List[LinkTalkBackend]:
+        """chat_and_linkで使うOpenAIとClaudeのバックエンドを作成する。
+
+        Args:
+            link_api (str): OpenAIのモデルで使うAPI。"tools"または"functions"。
+            field_order (Sequence[str]): linkとtalkを生成する順序
+
+        Returns:
+            List[LinkTalkBackend]: バックエンドのリスト。Claudeが使えない場合はOpenAIのみ。
+        """
+        if link_api == "functions":
+            openai_backend: LinkTalkBackend = OpenAIFunctionBackend(
+                models=self.openai_model_name
+            )
+        else:
+            openai_backend = OpenAIToolBackend(
+                models=self.openai_model_name, field_order=field_order
+            )
+        link_backends = [openai_backend]
+        try:
+            link_backends.append(AnthropicToolBackend(field_order=field_order))
+        except Exception as e:
+            print(f"Claude backend is not available: {e}")
+        return link_backends
+
+    def send_link(self, url: str) -> None:
+        """リンクを送信するメソッド。送信はバックグラウンドで行い、すぐに戻る。
 
         Args:
             url (str): 送信するリンク。
 
         """
+        self.link_sender.send(url)
+
+    def add_link_backend(self, backend: LinkTalkBackend) -> None:
+        """chat_and_linkで使うバックエンドを追加する。後から追加したものが優先される。
+
+        Args:
+            backend (LinkTalkBackend): 追加するバックエンド
+
+        """
+        self.link_backends.insert(0, backend)
+
+    def find_link_backend(self, model: str) -> Optional[LinkTalkBackend]:
+        """モデルを使えるバックエンドを返す。
+
+        Args:
+            model (str): モデル名
+
+        Returns:
+            LinkTalkBackend: モデルを使えるバックエンド。見つからない場合はNone。
+        """
+        for backend in self.link_backends:
+            if backend.supports(model):
+                return backend
+        return None
+
+    def chat_and_link_stream(
+        self,
+        backend: LinkTalkBackend,
+        messages: list,
+        model: str,
+        temperature: float = 0.7,
+        cancel_event: Optional[threading.Event] = None,
+        on_link: Optional[Callable[[str], None]] = None,
+    ) -> Generator[str, None, None]:
+        """バックエンドが生成するjsonからリンクを送信し、回答を文ごとに返すメソッド。
+
+        Args:
+            backend (LinkTalkBackend): 使用するバックエンド。
+            messages (list): チャットメッセージのリスト。
+            model (str): 使用するモデル名。
+            temperature (float, optional): サンプリング温度。デフォルトは0.7。
+            cancel_event (threading.Event, optional): セットされるとストリームを閉じて生成を中断するイベント。
+            on_link (Callable[[str], None], optional): リンクが確定した時に呼ぶ関数。
+                指定した場合はリンクを送信せず、last_linkも更新しない。
+
+        Yields:
+            str: チャット応答のジェネレータ。
+
+        """
+        trace = current_trace()
+        if on_link is None:
+            self.last_link = None
+        is_first_token = True
+        parser = LinkTalkStreamParser(stream_keys=("talk",))
+        segmenter = SentenceSegmenter(
+            first_min_chars=self.first_phrase_chars,
+            first_max_chars=self.first_phrase_max_chars,
+            min_chars=self.phrase_chars,
+        )
+        fragments = backend.stream(messages, model=model, temperature=temperature)
         try:
-            self.streamlit_stub.SendUrl(
-                streamlit_server_pb2.SendUrlRequest(url=url),
-            )
-        except grpc.RpcError as e:
-            print(f"Error: {e}")
-            return
+            for fragment in fragments:
+                if cancel_event is not None and cancel_event.is_set():
+                    # 新しい発話などでキャンセルされた場合は、ストリームを閉じて生成を中断する
+                    print("Generation cancelled.")
+                    return
+                if is_first_token:
+                    trace.event("first_token")
+                    is_first_token = False
+                for key, value, closed in parser.feed(fragment):
+                    if key == "link" and closed and on_link is not None:
+                        on_link(value)
+                    elif key == "link" and closed:
+                        print(f"============Link: {value}")
+                        self.last_link = value
+                        self.send_link(value)
+                        trace.event("link_emitted", url=value)
+                    elif key == "talk" and not closed:
+                        yield from segmenter.feed(value)
+                    elif key == "talk":
+                        # talkが閉じたら、linkの生成を待たずに末尾の文を返す
+                        sentence = segmenter.flush()
+                        if sentence is not None:
+                            yield sentence
+        finally:
+            fragments.close()
+        sentence = segmenter.flush()
+        if sentence is not None:
+            yield sentence
 
     def chat_and_link_gpt(
         self,
@@ -49,6 +201,7 @@ class ChatStreamAkariIntroducer(ChatStreamAkariGrpc):
         model: str = "gpt-4o",
         temperature: float = 0.7,
         short_response: bool = False,
+        cancel_event: Optional[threading.Event] = None,
     ) -> Generator[str, None, None]:
         """ChatGPTを使用してチャットとモーションを処理するメソッド。
 
@@ -57,84 +210,27 @@ class ChatStreamAkariIntroducer(ChatStreamAkariGrpc):
             model (str, optional): 使用するOpenAI GPTモデル。デフォルトは"gpt-4"。
             temperature (float, optional): サンプリング温度。デフォルトは0.7。
             short_response (bool, optional): 相槌などの短応答のみを返すか、通常の応答を返すか。
+            cancel_event (threading.Event, optional): セットされるとストリームを閉じて生成を中断するイベント。
 
         Yields:
             str: チャット応答のジェネレータ。
 
         """
-        functions = [
-            {
-                "name": "reply_with_link_",
-                "description": "ユーザのメッセージに対する回答と、回答に関連するリンクがある場合は一つ選択します。",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "link": {
-                            "type": "string",
-                            "description": "関連するリンク",
-                        },
-                        "talk": {
-                            "type": "string",
-                            "description": "回答",
-                        },
-                    },
-                    "required": ["link", "talk"],
-                },
-            }
-        ]
-        result = openai.chat.completions.create(
-            model=model,
+        yield from self.chat_and_link_stream(
+            self.openai_link_backend,
             messages=messages,
-            n=1,
+            model=model,
             temperature=temperature,
-            functions=functions,
-            function_call={"name": "reply_with_link_"},
-            stream=True,
-            stop=None,
+            cancel_event=cancel_event,
         )
-        full_response = ""
-        real_time_response = ""
-        sentence_index = 0
-        get_link = False
-        for chunk in result:
-            delta = chunk.choices[0].delta
-            if delta.function_call is not None:
-                if delta.function_call.arguments is not None:
-                    full_response += chunk.choices[0].delta.function_call.arguments
-                    try:
-                        data_json = json.loads(full_response)
-                        found_last_char = False
-                        for char in self.last_char:
-                            if real_time_response[-1].find(char) >= 0:
-                                found_last_char = True
-                        if not found_last_char:
-                            data_json["talk"] = data_json["talk"] + "。"
-                    except BaseException:
-                        data_json = force_parse_json(full_response)
-                    if data_json is not None:
-                        if "talk" in data_json:
-                            if not get_link and "link" in data_json:
-                                get_link = True
-                                link = data_json["link"]
-                                print(f"============Link: {link}")
-                                asyncio.run(self.send_link(link))
-                            real_time_response = str(data_json["talk"])
-                            for char in self.last_char:
-                                pos = real_time_response[sentence_index:].find(char)
-                                if pos >= 0:
-                                    sentence = real_time_response[
-                                        sentence_index : sentence_index + pos + 1
-                                    ]
-                                    sentence_index += pos + 1
-                                    if sentence != "":
-                                        yield sentence
-                                    break
 
     def chat_and_link(
         self,
         messages: list,
         model: str = "gpt-4o",
         temperature: float = 0.7,
+        cancel_event: Optional[threading.Event] = None,
+        on_link: Optional[Callable[[str], None]] = None,
     ) -> Generator[str, None, None]:
         """指定したモデルを使用して会話を行い、会話の内容に応じた動作も生成する
 
@@ -142,16 +238,21 @@ class ChatStreamAkariIntroducer(ChatStreamAkariGrpc):
             messages (list): 会話のメッセージ
             model (str): 使用するモデル名 (デフォルト: "gpt-4o")
             temperature (float): temperatureパラメータ (デフォルト: 0.7)
+            cancel_event (threading.Event, optional): セットされると生成を中断するイベント
+            on_link (Callable[[str], None], optional): リンクが確定した時に、送信する代わりに呼ぶ関数
         Returns:
             Generator[str, None, None]): 返答を順次生成する
 
         """
-        if model in self.openai_model_name:
-            yield from self.chat_and_link_gpt(
-                messages=messages,
-                model=model,
-                temperature=temperature,
-            )
-        else:
+        backend = self.find_link_backend(model)
+        if backend is None:
             print(f"Model name {model} can't use for this function")
             return
+        yield from self.chat_and_link_stream(
+            backend,
+            messages=messages,
+            model=model,
+            temperature=temperature,
+            cancel_event=cancel_event,
+            on_link=on_link,
+        )
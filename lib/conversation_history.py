@@ -0,0 +1,187 @@
+import threading
+import time
+from typing import Callable, List, Optional
+
+import openai
+import tiktoken
+
+# メッセージ1件あたりのrole等のトークン数の目安
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def create_token_counter(model: str = "gpt-4o") -> Callable[[str], int]:
+    """モデルに対応したトークン数を数える関数を作成する。
+
+    Args:
+        model (str, optional): モデル名。デフォルトは"gpt-4o"。
+
+    Returns:
+        Callable[[str], int]: テキストのトークン数を返す関数
+    """
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = tiktoken.get_encoding("o200k_base")
+    return lambda text: len(encoding.encode(text))
+
+
+def openai_summarizer(
+    summary: str, messages: List[dict], model: str = "gpt-4o-mini"
+) -> str:
+    """古い会話をOpenAIのモデルで要約する。
+
+    Args:
+        summary (str): これまでの要約
+        messages (List[dict]): 新たに要約に含める会話のメッセージ
+        model (str, optional): 要約に使うモデル名。デフォルトは"gpt-4o-mini"。
+
+    Returns:
+        str: 更新した要約
+    """
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    result = openai.chat.completions.create(
+        model=model,
+        messages=[
+            {
+                "role": "system",
+                "content": "これまでの要約と新しい会話をまとめ、ユーザが何を質問し、何を回答したかを200文字以内で要約してください。",
+            },
+            {
+                "role": "user",
+                "content": f"これまでの要約:\n{summary}\n\n新しい会話:\n{transcript}",
+            },
+        ],
+        n=1,
+        temperature=0.0,
+    )
+    return result.choices[0].message.content
+
+
+class ConversationHistory(object):
+    """トークン数の上限とセッションのタイムアウトを持つ会話履歴を管理するクラス。
+
+    メッセージのdictは追加後に変更しないため、build()で作るリストはdictを共有し、
+    deepcopyせずにそのままAPIに渡せる。上限を超えた古いターンは削除し、
+    summarizerを指定した場合はバックグラウンドで要約して履歴の先頭に残す。
+    """
+
+    def __init__(
+        self,
+        create_message: Callable[..., dict],
+        max_tokens: int = 2000,
+        session_timeout: Optional[float] = 100.0,
+        count_tokens: Optional[Callable[[str], int]] = None,
+        summarizer: Optional[Callable[[str, List[dict]], str]] = None,
+    ) -> None:
+        """コンストラクタ
+
+        Args:
+            create_message (Callable[..., dict]): メッセージを作成する関数。ChatStreamAkari.create_messageを渡す。
+            max_tokens (int, optional): 履歴に保持する最大トークン数。デフォルトは2000。
+            session_timeout (float, optional): この時間[s]発話がなければ別の来場者とみなして履歴をリセットする。
+                Noneの場合はリセットしない。デフォルトは100。
+            count_tokens (Callable[[str], int], optional): トークン数を数える関数。Noneの場合はgpt-4oのトークナイザを使う。
+            summarizer (Callable[[str, List[dict]], str], optional): 古い会話を要約する関数。Noneの場合は要約しない。
+
+        """
+        self.create_message = create_message
+        self.max_tokens = max_tokens
+        self.session_timeout = session_timeout
+        self.count_tokens = count_tokens if count_tokens is not None else create_token_counter()
+        self.summarizer = summarizer
+        self.lock = threading.Lock()
+        self.messages: List[dict] = []
+        self.message_tokens: List[int] = []
+        self.total_tokens = 0
+        self.summary = ""
+        self.session_id = 0
+        self.last_active_time = time.time()
+
+    def _reset(self) -> None:
+        self.messages = []
+        self.message_tokens = []
+        self.total_tokens = 0
+        self.summary = ""
+        self.session_id += 1
+
+    def _check_session(self) -> None:
+        now = time.time()
+        if (
+            self.session_timeout is not None
+            and len(self.messages) > 0
+            and now - self.last_active_time > self.session_timeout
+        ):
+            print("Conversation history is reset for a new visitor.")
+            self._reset()
+        self.last_active_time = now
+
+    def reset(self) -> None:
+        """履歴をリセットする。"""
+        with self.lock:
+            self._reset()
+
+    def build(self, system_message: dict, user_message: Optional[dict] = None) -> List[dict]:
+        """APIに渡すメッセージのリストを作成する。
+
+        Args:
+            system_message (dict): 先頭に置くシステムメッセージ
+            user_message (dict, optional): 履歴には追加せず、末尾にのみ追加するメッセージ
+
+        Returns:
+            List[dict]: メッセージのリスト。リスト自体は新しく作成するため、要素の置き換えは履歴に影響しない。
+        """
+        with self.lock:
+            self._check_session()
+            messages = [system_message]
+            if self.summary != "":
+                messages.append(
+                    self.create_message(
+                        f"これまでの会話の要約: {self.summary}", role="system"
+                    )
+                )
+            messages.extend(self.messages)
+        if user_message is not None:
+            messages.append(user_message)
+        return messages
+
+    def append(self, message: dict) -> None:
+        """履歴にメッセージを追加し、上限を超えた古いターンを削除する。
+
+        Args:
+            message (dict): 追加するメッセージ。追加後は変更しないこと。
+
+        """
+        tokens = self.count_tokens(str(message["content"])) + MESSAGE_OVERHEAD_TOKENS
+        with self.lock:
+            self._check_session()
+            self.messages.append(message)
+            self.message_tokens.append(tokens)
+            self.total_tokens += tokens
+            removed = []
+            # 最新のメッセージは残し、古い方から削除する
+            while self.total_tokens > self.max_tokens and len(self.messages) > 1:
+                removed.append(self.messages.pop(0))
+                self.total_tokens -= self.message_tokens.pop(0)
+            # assistantのメッセージから始まらないように揃える
+            while len(self.messages) > 1 and self.messages[0]["role"] == "assistant":
+                removed.append(self.messages.pop(0))
+                self.total_tokens -= self.message_tokens.pop(0)
+            session_id = self.session_id
+            summary = self.summary
+        if len(removed) > 0 and self.summarizer is not None:
+            threading.Thread(
+                target=self._summarize,
+                args=(session_id, summary, removed),
+                daemon=True,
+            ).start()
+
+    def _summarize(self, session_id: int, summary: str, messages: List[dict]) -> None:
+        try:
+            new_summary = self.summarizer(summary, messages)
+        except BaseException as e:
+            print(f"Summarize error: {e}")
+            return
+        with self.lock:
+            # 要約中にセッションがリセットされた場合は破棄する
+            if self.session_id == session_id:
+                self.summary = new_summary
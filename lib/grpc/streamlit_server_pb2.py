@@ -1,12 +1,22 @@
 # -*- coding: utf-8 -*-
 # Generated by the protocol buffer compiler.  DO NOT EDIT!
+# NO CHECKED-IN PROTOBUF GENCODE
 # source: streamlit_server.proto
-# Protobuf Python Version: 4.25.0
+# Protobuf Python Version: 7.35.1
 """Generated protocol buffer code."""
 from google.protobuf import descriptor as _descriptor
 from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import runtime_version as _runtime_version
 from google.protobuf import symbol_database as _symbol_database
 from google.protobuf.internal import builder as _builder
+_runtime_version.ValidateProtobufRuntimeVersion(
+    _runtime_version.Domain.PUBLIC,
+    7,
+    35,
+    1,
+    '',
+    'streamlit_server.proto'
+)
 # @@protoc_insertion_point(imports)
 
 _sym_db = _symbol_database.Default()
@@ -14,17 +24,37 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x16streamlit_server.proto\x12\x10streamlit_server\"\x1d\n\x0eSendUrlRequest\x12\x0b\n\x03url\x18\x01 \x01(\t\"\x1f\n\x0cSendUrlReply\x12\x0f\n\x07success\x18\x01 \x01(\x08\x32g\n\x16StreamlitServerService\x12M\n\x07SendUrl\x12 .streamlit_server.SendUrlRequest\x1a\x1e.streamlit_server.SendUrlReply\"\x00\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x16streamlit_server.proto\x12\x10streamlit_server\"\x1d\n\x0eSendUrlRequest\x12\x0b\n\x03url\x18\x01 \x01(\t\"\x1f\n\x0cSendUrlReply\x12\x0f\n\x07success\x18\x01 \x01(\x08\"\x8c\x01\n\x0e\x44isplayCommand\x12\x0b\n\x03url\x18\x01 \x01(\t\x12\x33\n\x0c\x63ontent_type\x18\x02 \x01(\x0e\x32\x1d.streamlit_server.ContentType\x12\x12\n\nstart_time\x18\x03 \x01(\x01\x12\x10\n\x08priority\x18\x04 \x01(\x05\x12\x12\n\ncommand_id\x18\x05 \x01(\t\"C\n\x0e\x44isplayRequest\x12\x31\n\x07\x63ommand\x18\x01 \x01(\x0b\x32 .streamlit_server.DisplayCommand\"3\n\x0c\x44isplayReply\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x12\n\ncommand_id\x18\x02 \x01(\t\"c\n\x10PreloadCandidate\x12\x0b\n\x03url\x18\x01 \x01(\t\x12\x33\n\x0c\x63ontent_type\x18\x02 \x01(\x0e\x32\x1d.streamlit_server.ContentType\x12\r\n\x05score\x18\x03 \x01(\x02\"H\n\x0ePreloadRequest\x12\x36\n\ncandidates\x18\x01 \x03(\x0b\x32\".streamlit_server.PreloadCandidate\" \n\x0cPreloadReply\x12\x10\n\x08\x61\x63\x63\x65pted\x18\x01 \x01(\x05\"\x15\n\x13WatchDisplayRequest\"\xcf\x02\n\x0c\x44isplayEvent\x12\x36\n\x04type\x18\x01 \x01(\x0e\x32(.streamlit_server.DisplayEvent.EventType\x12\x12\n\ncommand_id\x18\x02 \x01(\t\x12\x0b\n\x03url\x18\x03 \x01(\t\x12\x33\n\x0c\x63ontent_type\x18\x04 \x01(\x0e\x32\x1d.streamlit_server.ContentType\x12\x15\n\rreceived_time\x18\x05 \x01(\x01\x12\x12\n\nevent_time\x18\x06 \x01(\x01\x12\x11\n\tpreloaded\x18\x07 \x01(\x08\"s\n\tEventType\x12\x1a\n\x16\x45VENT_TYPE_UNSPECIFIED\x10\x00\x12\x17\n\x13\x45VENT_TYPE_RECEIVED\x10\x01\x12\x17\n\x13\x45VENT_TYPE_RENDERED\x10\x02\x12\x18\n\x14\x45VENT_TYPE_PRELOADED\x10\x03*t\n\x0b\x43ontentType\x12\x1c\n\x18\x43ONTENT_TYPE_UNSPECIFIED\x10\x00\x12\x18\n\x14\x43ONTENT_TYPE_YOUTUBE\x10\x01\x12\x15\n\x11\x43ONTENT_TYPE_PAGE\x10\x02\x12\x16\n\x12\x43ONTENT_TYPE_IMAGE\x10\x03\x32\xe0\x02\n\x16StreamlitServerService\x12M\n\x07SendUrl\x12 .streamlit_server.SendUrlRequest\x1a\x1e.streamlit_server.SendUrlReply\"\x00\x12M\n\x07\x44isplay\x12 .streamlit_server.DisplayRequest\x1a\x1e.streamlit_server.DisplayReply\"\x00\x12M\n\x07Preload\x12 .streamlit_server.PreloadRequest\x1a\x1e.streamlit_server.PreloadReply\"\x00\x12Y\n\x0cWatchDisplay\x12%.streamlit_server.WatchDisplayRequest\x1a\x1e.streamlit_server.DisplayEvent\"\x00\x30\x01\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'streamlit_server_pb2', _globals)
-if _descriptor._USE_C_DESCRIPTORS == False:
-  DESCRIPTOR._options = None
+if not _descriptor._USE_C_DESCRIPTORS:
+  DESCRIPTOR._loaded_options = None
+  _globals['_CONTENTTYPE']._serialized_start=943
+  _globals['_CONTENTTYPE']._serialized_end=1059
   _globals['_SENDURLREQUEST']._serialized_start=44
   _globals['_SENDURLREQUEST']._serialized_end=73
   _globals['_SENDURLREPLY']._serialized_start=75
   _globals['_SENDURLREPLY']._serialized_end=106
-  _globals['_STREAMLITSERVERSERVICE']._serialized_start=108
-  _globals['_STREAMLITSERVERSERVICE']._serialized_end=211
+  _globals['_DISPLAYCOMMAND']._serialized_start=109
+  _globals['_DISPLAYCOMMAND']._serialized_end=249
+  _globals['_DISPLAYREQUEST']._serialized_start=251
+  _globals['_DISPLAYREQUEST']._serialized_end=318
+  _globals['_DISPLAYREPLY']._serialized_start=320
+  _globals['_DISPLAYREPLY']._serialized_end=371
+  _globals['_PRELOADCANDIDATE']._serialized_start=373
+  _globals['_PRELOADCANDIDATE']._serialized_end=472
+  _globals['_PRELOADREQUEST']._serialized_start=474
+  _globals['_PRELOADREQUEST']._serialized_end=546
+  _globals['_PRELOADREPLY']._serialized_start=548
+  _globals['_PRELOADREPLY']._serialized_end=580
+  _globals['_WATCHDISPLAYREQUEST']._serialized_start=582
+  _globals['_WATCHDISPLAYREQUEST']._serialized_end=603
+  _globals['_DISPLAYEVENT']._serialized_start=606
+  _globals['_DISPLAYEVENT']._serialized_end=941
+  _globals['_DISPLAYEVENT_EVENTTYPE']._serialized_start=826
+  _globals['_DISPLAYEVENT_EVENTTYPE']._serialized_end=941
+  _globals['_STREAMLITSERVERSERVICE']._serialized_start=1062
+  _globals['_STREAMLITSERVERSERVICE']._serialized_end=1414
 # @@protoc_insertion_point(module_scope)
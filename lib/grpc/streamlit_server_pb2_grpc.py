@@ -1,11 +1,31 @@
 # Generated by the gRPC Python protocol compiler plugin. DO NOT EDIT!
 """Client and server classes corresponding to protobuf-defined services."""
 import grpc
+import warnings
 
 import streamlit_server_pb2 as streamlit__server__pb2
 
+GRPC_GENERATED_VERSION = '1.84.0'
+GRPC_VERSION = grpc.__version__
+_version_not_supported = False
 
-class StreamlitServerServiceStub(object):
+try:
+    from grpc._utilities import first_version_is_lower
+    _version_not_supported = first_version_is_lower(GRPC_VERSION, GRPC_GENERATED_VERSION)
+except ImportError:
+    _version_not_supported = True
+
+if _version_not_supported:
+    raise RuntimeError(
+        f'The grpc package installed is at version {GRPC_VERSION},'
+        + ' but the generated code in streamlit_server_pb2_grpc.py depends on'
+        + f' grpcio>={GRPC_GENERATED_VERSION}.'
+        + f' Please upgrade your grpc module to grpcio>={GRPC_GENERATED_VERSION}'
+        + f' or downgrade your generated code using grpcio-tools<={GRPC_VERSION}.'
+    )
+
+
+class StreamlitServerServiceStub:
     """Missing associated documentation comment in .proto file."""
 
     def __init__(self, channel):
@@ -18,10 +38,25 @@ class StreamlitServerServiceStub(object):
                 '/streamlit_server.StreamlitServerService/SendUrl',
                 request_serializer=streamlit__server__pb2.SendUrlRequest.SerializeToString,
                 response_deserializer=streamlit__server__pb2.SendUrlReply.FromString,
-                )
+                _registered_method=True)
+        self.Display = channel.unary_unary(
+                '/streamlit_server.StreamlitServerService/Display',
+                request_serializer=streamlit__server__pb2.DisplayRequest.SerializeToString,
+                response_deserializer=streamlit__server__pb2.DisplayReply.FromString,
+                _registered_method=True)
+        self.Preload = channel.unary_unary(
+                '/streamlit_server.StreamlitServerService/Preload',
+                request_serializer=streamlit__server__pb2.PreloadRequest.SerializeToString,
+                response_deserializer=streamlit__server__pb2.PreloadReply.FromString,
+                _registered_method=True)
+        self.WatchDisplay = channel.unary_stream(
+                '/streamlit_server.StreamlitServerService/WatchDisplay',
+                request_serializer=streamlit__server__pb2.WatchDisplayRequest.SerializeToString,
+                response_deserializer=streamlit__server__pb2.DisplayEvent.FromString,
+                _registered_method=True)
 
 
-class StreamlitServerServiceServicer(object):
+class StreamlitServerServiceServicer:
     """Missing associated documentation comment in .proto file."""
 
     def SendUrl(self, request, context):
@@ -31,6 +66,27 @@ class StreamlitServerServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def Display(self, request, context):
+        """種類や優先度を指定して表示
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def Preload(self, request, context):
+        """表示される可能性がある候補をまとめて先読み
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def WatchDisplay(self, request, context):
+        """表示のイベントを受け取る
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_StreamlitServerServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -39,14 +95,30 @@ def add_StreamlitServerServiceServicer_to_server(servicer, server):
                     request_deserializer=streamlit__server__pb2.SendUrlRequest.FromString,
                     response_serializer=streamlit__server__pb2.SendUrlReply.SerializeToString,
             ),
+            'Display': grpc.unary_unary_rpc_method_handler(
+                    servicer.Display,
+                    request_deserializer=streamlit__server__pb2.DisplayRequest.FromString,
+                    response_serializer=streamlit__server__pb2.DisplayReply.SerializeToString,
+            ),
+            'Preload': grpc.unary_unary_rpc_method_handler(
+                    servicer.Preload,
+                    request_deserializer=streamlit__server__pb2.PreloadRequest.FromString,
+                    response_serializer=streamlit__server__pb2.PreloadReply.SerializeToString,
+            ),
+            'WatchDisplay': grpc.unary_stream_rpc_method_handler(
+                    servicer.WatchDisplay,
+                    request_deserializer=streamlit__server__pb2.WatchDisplayRequest.FromString,
+                    response_serializer=streamlit__server__pb2.DisplayEvent.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'streamlit_server.StreamlitServerService', rpc_method_handlers)
     server.add_generic_rpc_handlers((generic_handler,))
+    server.add_registered_method_handlers('streamlit_server.StreamlitServerService', rpc_method_handlers)
 
 
  # This class is part of an EXPERIMENTAL API.
-class StreamlitServerService(object):
+class StreamlitServerService:
     """Missing associated documentation comment in .proto file."""
 
     @staticmethod
@@ -60,8 +132,99 @@ class StreamlitServerService(object):
             wait_for_ready=None,
             timeout=None,
             metadata=None):
-        return grpc.experimental.unary_unary(request, target, '/streamlit_server.StreamlitServerService/SendUrl',
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/streamlit_server.StreamlitServerService/SendUrl',
             streamlit__server__pb2.SendUrlRequest.SerializeToString,
             streamlit__server__pb2.SendUrlReply.FromString,
-            options, channel_credentials,
-            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def Display(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/streamlit_server.StreamlitServerService/Display',
+            streamlit__server__pb2.DisplayRequest.SerializeToString,
+            streamlit__server__pb2.DisplayReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def Preload(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/streamlit_server.StreamlitServerService/Preload',
+            streamlit__server__pb2.PreloadRequest.SerializeToString,
+            streamlit__server__pb2.PreloadReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def WatchDisplay(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/streamlit_server.StreamlitServerService/WatchDisplay',
+            streamlit__server__pb2.WatchDisplayRequest.SerializeToString,
+            streamlit__server__pb2.DisplayEvent.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# NO CHECKED-IN PROTOBUF GENCODE
+# source: voice_stream_server.proto
+# Protobuf Python Version: 7.35.1
+"""Generated protocol buffer code."""
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import runtime_version as _runtime_version
+from google.protobuf import symbol_database as _symbol_database
+from google.protobuf.internal import builder as _builder
+_runtime_version.ValidateProtobufRuntimeVersion(
+    _runtime_version.Domain.PUBLIC,
+    7,
+    35,
+    1,
+    '',
+    'voice_stream_server.proto'
+)
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x19voice_stream_server.proto\x12\x13voice_stream_server\"\x8d\x01\n\nVoiceEvent\x12\x0b\n\x03seq\x18\x01 \x01(\x04\x12\x0e\n\x04text\x18\x02 \x01(\tH\x00\x12\x1c\n\x12start_head_control\x18\x03 \x01(\x08H\x00\x12\x16\n\x0csentence_end\x18\x04 \x01(\x08H\x00\x12\x0e\n\x04link\x18\x05 \x01(\tH\x00\x12\x13\n\tinterrupt\x18\x06 \x01(\x08H\x00\x42\x07\n\x05\x65vent\"/\n\x0fVoiceEventReply\x12\x0b\n\x03seq\x18\x01 \x01(\x04\x12\x0f\n\x07success\x18\x02 \x01(\x08\x32v\n\x18VoiceStreamServerService\x12Z\n\x0bStreamVoice\x12\x1f.voice_stream_server.VoiceEvent\x1a$.voice_stream_server.VoiceEventReply\"\x00(\x01\x30\x01\x62\x06proto3')
+
+_globals = globals()
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'voice_stream_server_pb2', _globals)
+if not _descriptor._USE_C_DESCRIPTORS:
+  DESCRIPTOR._loaded_options = None
+  _globals['_VOICEEVENT']._serialized_start=51
+  _globals['_VOICEEVENT']._serialized_end=192
+  _globals['_VOICEEVENTREPLY']._serialized_start=194
+  _globals['_VOICEEVENTREPLY']._serialized_end=241
+  _globals['_VOICESTREAMSERVERSERVICE']._serialized_start=243
+  _globals['_VOICESTREAMSERVERSERVICE']._serialized_end=361
+# @@protoc_insertion_point(module_scope)
@@ -0,0 +1,191 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+_local = threading.local()
+
+
+class LatencyTracer(object):
+    """リクエスト毎の処理区間(span)をJSONLファイルに書き出すクラス。
+
+    1行が1spanで、OpenTelemetryのspanに合わせてtrace_id、span_id、parent_span_id、
+    start_time_unix_nano、end_time_unix_nano、attributesを持つ。
+    pathがNoneの場合は何も書き出さない。
+    """
+
+    def __init__(self, path: Optional[str] = None, service: str = "") -> None:
+        """コンストラクタ
+
+        Args:
+            path (str, optional): 書き出すJSONLファイルのパス。Noneの場合は書き出さない。
+            service (str, optional): spanに記録するサービス名。
+
+        """
+        self.path = path
+        self.service = service
+        self.lock = threading.Lock()
+        self.file = None
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.file = open(path, "a", encoding="utf-8", buffering=1)
+
+    @property
+    def enabled(self) -> bool:
+        return self.file is not None
+
+    def start_trace(
+        self, name: str, start_time: Optional[float] = None, **attributes: Any
+    ) -> "Trace":
+        """新しいtraceを開始し、現在のスレッドのtraceに設定する。
+
+        Args:
+            name (str): ルートspanの名前
+            start_time (float, optional): 開始時刻(time.time())。Noneの場合は現在時刻。
+            **attributes: ルートspanに記録する属性
+
+        Returns:
+            Trace: 開始したtrace
+        """
+        trace = Trace(self, name, attributes, start_time)
+        _local.trace = trace
+        return trace
+
+    def write(self, record: dict) -> None:
+        if self.file is None:
+            return
+        line = json.dumps(record, ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + "\n")
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class Trace(object):
+    """1リクエスト分のspanをまとめるクラス。"""
+
+    def __init__(
+        self,
+        tracer: Optional[LatencyTracer],
+        name: str,
+        attributes: dict,
+        start_time: Optional[float] = None,
+    ) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.trace_id = os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.start_time = start_time if start_time is not None else time.time()
+        self.ended = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.tracer is not None and self.tracer.enabled
+
+    def record(
+        self, name: str, start_time: float, end_time: float, **attributes: Any
+    ) -> None:
+        """開始時刻と終了時刻を指定してspanを記録する。
+
+        Args:
+            name (str): spanの名前
+            start_time (float): 開始時刻(time.time())
+            end_time (float): 終了時刻(time.time())
+            **attributes: spanに記録する属性
+
+        """
+        if not self.enabled:
+            return
+        self._write(
+            os.urandom(8).hex(), self.span_id, name, start_time, end_time, attributes
+        )
+
+    def event(self, name: str, **attributes: Any) -> None:
+        """現在時刻で長さ0のspanを記録する。初回トークンなどの時点の記録に使う。
+
+        Args:
+            name (str): spanの名前
+            **attributes: spanに記録する属性
+
+        """
+        now = time.time()
+        self.record(name, now, now, **attributes)
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[None]:
+        """with文の区間をspanとして記録する。
+
+        Args:
+            name (str): spanの名前
+            **attributes: spanに記録する属性
+
+        """
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, start_time, time.time(), **attributes)
+
+    def end(self, **attributes: Any) -> None:
+        """ルートspanを記録してtraceを終了する。
+
+        Args:
+            **attributes: ルートspanに追加で記録する属性
+
+        """
+        if self.ended:
+            return
+        self.ended = True
+        if getattr(_local, "trace", None) is self:
+            _local.trace = None
+        if not self.enabled:
+            return
+        self.attributes.update(attributes)
+        self._write(
+            self.span_id, None, self.name, self.start_time, time.time(), self.attributes
+        )
+
+    def _write(
+        self,
+        span_id: str,
+        parent_span_id: Optional[str],
+        name: str,
+        start_time: float,
+        end_time: float,
+        attributes: dict,
+    ) -> None:
+        self.tracer.write(
+            {
+                "trace_id": self.trace_id,
+                "span_id": span_id,
+                "parent_span_id": parent_span_id,
+                "name": name,
+                "service": self.tracer.service,
+                "start_time_unix_nano": int(start_time * 1e9),
+                "end_time_unix_nano": int(end_time * 1e9),
+                "duration_ms": (end_time - start_time) * 1000,
+                # リクエスト受信からspan終了までの時間
+                "offset_ms": (end_time - self.start_time) * 1000,
+                "attributes": attributes,
+            }
+        )
+
+
+NULL_TRACE = Trace(None, "", {})
+
+
+def current_trace() -> Trace:
+    """現在のスレッドで実行中のtraceを返す。なければ何も記録しないtraceを返す。
+
+    Returns:
+        Trace: 現在のtrace
+    """
+    trace = getattr(_local, "trace", None)
+    return trace if trace is not None else NULL_TRACE
@@ -0,0 +1,284 @@
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import grpc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "grpc"))
+import streamlit_server_pb2
+import streamlit_server_pb2_grpc
+
+RETRY_STATUS_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED)
+# 日本語の文中のURLの直後の文字を含めないよう、URLに使える文字のみに一致させる
+URL_PATTERN = re.compile(r"https?://[A-Za-z0-9\-._~:/?#@!$&'*+,;=%]+")
+
+
+def find_urls(text: str) -> List[str]:
+    """テキストに含まれるURLを出現順に抽出する。文末の句読点は含めない。
+
+    Args:
+        text (str): テキスト
+
+    Returns:
+        List[str]: URLのリスト
+    """
+    return [url.rstrip(".,") for url in URL_PATTERN.findall(text)]
+
+
+def extract_link_candidates(
+    contexts: Sequence[Tuple[str, float]], limit: int = 3
+) -> List[Tuple[str, float]]:
+    """検索結果に含まれるURLを、LLMがリンクとして選ぶ可能性が高い順に抽出する。
+
+    スコアの高い検索結果の、先頭に近いURLほど優先する。
+
+    Args:
+        contexts (Sequence[Tuple[str, float]]): (本文, スコア)の検索結果のリスト
+        limit (int, optional): 抽出するURLの最大数。デフォルトは3。
+
+    Returns:
+        List[Tuple[str, float]]: (URL, スコア)のリスト
+    """
+    candidates: "OrderedDict[str, float]" = OrderedDict()
+    ranked = sorted(enumerate(contexts), key=lambda c: (-c[1][1], c[0]))
+    for rank, (_, (content, _)) in enumerate(ranked):
+        for position, url in enumerate(find_urls(content)):
+            if url not in candidates:
+                # 検索順位を優先し、同じ検索結果の中では先頭に近いほど高くする
+                candidates[url] = len(ranked) - rank - position / (position + 1)
+    return sorted(candidates.items(), key=lambda c: -c[1])[:limit]
+
+
+class LinkSender(threading.Thread):
+    """streamlit_serverへのリンク送信をバックグラウンドで行うスレッド。
+
+    トークン生成のループからは送信待ちに積むだけで戻るため、表示側やモーションサーバの
+    応答が遅くても発話の送信は待たされない。表示するリンクは最新の1つのみを保持し、先読みの依頼より先に送信する。
+    先読みの依頼はキューが一杯の場合に古いものから捨てる。
+    streamlit_serverがDisplayに対応していればIDを付けて送信し、WatchDisplayで描画完了までの時間を計測する。
+    対応していない場合はSendUrlで送信する。
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: str = "10010",
+        timeout: float = 2.0,
+        retries: int = 2,
+        retry_interval: float = 0.2,
+        max_queue_size: int = 4,
+        channel: Optional[grpc.Channel] = None,
+        watch: bool = True,
+        on_rendered: Optional[Callable[[str, float, bool], None]] = None,
+    ) -> None:
+        """コンストラクタ
+
+        Args:
+            host (str, optional): streamlit_serverのホスト名。デフォルトは"localhost"。
+            port (str, optional): streamlit_serverのポート番号。デフォルトは"10010"。
+            timeout (float, optional): 1回の送信のタイムアウト[s]。デフォルトは2.0。
+            retries (int, optional): 送信失敗時のリトライ回数。デフォルトは2。
+            retry_interval (float, optional): リトライ間隔[s]。リトライ毎に倍にする。デフォルトは0.2。
+            max_queue_size (int, optional): 送信待ちの先読みの依頼の最大数。デフォルトは4。
+            channel (grpc.Channel, optional): 使用するチャンネル。複数の送信先で共有する場合に指定する。
+                Noneの場合はhostとportに接続するチャンネルを作成する。
+            watch (bool, optional): WatchDisplayで描画完了を受け取り、送信から描画完了までの時間を計測するか。デフォルトはTrue。
+            on_rendered (Callable[[str, float, bool], None], optional): 送信したリンクの描画が完了した時に、
+                (リンク, 送信から描画完了までの時間[s], 先読み済みだったか)を引数に呼ぶ関数。
+
+        """
+        super().__init__(daemon=True)
+        # チャンネルは使い回し、送信毎に接続し直さない
+        self.channel = (
+            channel if channel is not None else grpc.insecure_channel(f"{host}:{port}")
+        )
+        self.stub = streamlit_server_pb2_grpc.StreamlitServerServiceStub(self.channel)
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_interval = retry_interval
+        # 表示するリンクは先読みの依頼で押し出されないよう、別に最新の1つを保持する
+        self.condition = threading.Condition()
+        self.pending_display: Optional[str] = None
+        self.max_queue_size = max_queue_size
+        self.preload_queue: "deque[List[Tuple[str, float]]]" = deque()
+        self.on_rendered = on_rendered
+        # Falseになった場合は、streamlit_serverが対応していないため以降は使わない
+        self.display_api = True
+        self.preload_api = True
+        # 同じstreamlit_serverに複数のLinkSenderから送信しても重ならないID
+        self.command_prefix = uuid.uuid4().hex[:8]
+        self.command_count = 0
+        # コマンドID -> (リンク, 送信時刻)
+        self.sent_lock = threading.Lock()
+        self.sent_times: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self.stopped = threading.Event()
+        self.watch_call = None
+        self.start()
+        if watch:
+            threading.Thread(target=self._watch, daemon=True).start()
+
+    def send(self, url: str) -> None:
+        """リンクを送信待ちにする。送信前のリンクがあれば捨てて置き換える。
+
+        Args:
+            url (str): 送信するリンク
+
+        """
+        with self.condition:
+            if self.pending_display is not None:
+                print(f"Link dropped: {self.pending_display}")
+            self.pending_display = url
+            self.condition.notify()
+
+    def preload(self, urls: Sequence[str], scores: Optional[Sequence[float]] = None) -> None:
+        """表示される可能性があるリンクの先読みを依頼する。
+
+        Args:
+            urls (Sequence[str]): 候補のリンク
+            scores (Sequence[float], optional): 候補毎の表示される可能性の高さ。Noneの場合は先頭ほど高いとみなす。
+
+        """
+        if not self.preload_api or len(urls) == 0:
+            return
+        if scores is None:
+            scores = [float(len(urls) - i) for i in range(len(urls))]
+        with self.condition:
+            while len(self.preload_queue) >= self.max_queue_size:
+                dropped = self.preload_queue.popleft()
+                print(f"Preload dropped: {[url for url, _ in dropped]}")
+            self.preload_queue.append(list(zip(urls, scores)))
+            self.condition.notify()
+
+    def stop(self) -> None:
+        """送信スレッドを終了する。"""
+        self.stopped.set()
+        if self.watch_call is not None:
+            self.watch_call.cancel()
+        with self.condition:
+            self.condition.notify_all()
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                while (
+                    self.pending_display is None
+                    and len(self.preload_queue) == 0
+                    and not self.stopped.is_set()
+                ):
+                    self.condition.wait()
+                if self.stopped.is_set():
+                    break
+                url = self.pending_display
+                self.pending_display = None
+                candidates = self.preload_queue.popleft() if url is None else None
+            if url is not None:
+                self._send_with_retry(url)
+            else:
+                self._preload(candidates)
+
+    def _send_with_retry(self, url: str) -> bool:
+        interval = self.retry_interval
+        for attempt in range(self.retries + 1):
+            try:
+                self._send(url)
+                return True
+            except grpc.RpcError as e:
+                print(f"Error: {e}")
+                # 新しい表示リンクが届いている場合や、リトライしても回復しないエラーは諦める
+                if (
+                    attempt >= self.retries
+                    or self.stopped.is_set()
+                    or self._has_pending_display()
+                    or e.code() not in RETRY_STATUS_CODES
+                ):
+                    return False
+            time.sleep(interval)
+            interval *= 2
+        return False
+
+    def _has_pending_display(self) -> bool:
+        # 先読みの依頼は表示のリトライを止める理由にならないため、表示リンクのみを確認する
+        with self.condition:
+            return self.pending_display is not None
+
+    def _send(self, url: str) -> None:
+        if self.display_api:
+            self.command_count += 1
+            command_id = f"{self.command_prefix}-{self.command_count}"
+            with self.sent_lock:
+                self.sent_times[command_id] = (url, time.time())
+                while len(self.sent_times) > 32:
+                    self.sent_times.popitem(last=False)
+            try:
+                self.stub.Display(
+                    streamlit_server_pb2.DisplayRequest(
+                        command=streamlit_server_pb2.DisplayCommand(
+                            url=url, command_id=command_id
+                        )
+                    ),
+                    timeout=self.timeout,
+                )
+                return
+            except grpc.RpcError as e:
+                if e.code() != grpc.StatusCode.UNIMPLEMENTED:
+                    raise
+                print("streamlit_server does not support Display. Use SendUrl.")
+                self.display_api = False
+        self.stub.SendUrl(
+            streamlit_server_pb2.SendUrlRequest(url=url),
+            timeout=self.timeout,
+        )
+
+    def _preload(self, candidates: List[Tuple[str, float]]) -> None:
+        try:
+            self.stub.Preload(
+                streamlit_server_pb2.PreloadRequest(
+                    candidates=[
+                        streamlit_server_pb2.PreloadCandidate(url=url, score=score)
+                        for url, score in candidates
+                    ]
+                ),
+                timeout=self.timeout,
+            )
+        except grpc.RpcError as e:
+            if e.code() == grpc.StatusCode.UNIMPLEMENTED:
+                print("streamlit_server does not support Preload.")
+                self.preload_api = False
+            else:
+                print(f"Preload error: {e.code()}")
+
+    def _watch(self) -> None:
+        """描画完了のイベントを受け取り、送信から描画完了までの時間を求める。切断された場合は再接続する。"""
+        interval = 1.0
+        while not self.stopped.is_set():
+            try:
+                self.watch_call = self.stub.WatchDisplay(
+                    streamlit_server_pb2.WatchDisplayRequest()
+                )
+                for event in self.watch_call:
+                    interval = 1.0
+                    if event.type != streamlit_server_pb2.DisplayEvent.EVENT_TYPE_RENDERED:
+                        continue
+                    with self.sent_lock:
+                        sent = self.sent_times.pop(event.command_id, None)
+                    if sent is None:
+                        continue
+                    # streamlit_serverとは時計が異なる場合があるため、受信した時刻で計測する
+                    url, sent_time = sent
+                    latency = time.time() - sent_time
+                    print(
+                        f"Link to render latency: {latency:.3f} [s] (preloaded: {event.preloaded})"
+                    )
+                    if self.on_rendered is not None:
+                        self.on_rendered(url, latency, event.preloaded)
+            except grpc.RpcError as e:
+                if e.code() == grpc.StatusCode.UNIMPLEMENTED:
+                    print("streamlit_server does not support WatchDisplay.")
+                    return
+            self.stopped.wait(interval)
+            interval = min(interval * 2, 30.0)
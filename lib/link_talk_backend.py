@@ -0,0 +1,308 @@
+import time
+from typing import Iterator, List, Optional, Sequence
+
+import openai
+
+from lib.latency_tracer import current_trace
+
+LINK_TALK_FUNCTION_NAME = "reply_with_link_"
+LINK_TALK_DESCRIPTION = (
+    "ユーザのメッセージに対する回答と、回答に関連するリンクがある場合は一つ選択します。"
+)
+LINK_FIRST = ("link", "talk")
+TALK_FIRST = ("talk", "link")
+_FIELD_DESCRIPTIONS = {
+    "link": "関連するリンク",
+    "talk": "回答",
+}
+
+
+def link_talk_schema(
+    field_order: Sequence[str] = LINK_FIRST, strict: bool = False
+) -> dict:
+    """linkとtalkを持つjsonのスキーマを作成する。
+    モデルはプロパティの順に生成するため、talkを先にすると回答の読み上げをリンクの生成を待たずに始められる。
+
+    Args:
+        field_order (Sequence[str], optional): プロパティの順序。デフォルトはLINK_FIRST。
+        strict (bool, optional): Structured Outputsのstrictモード用に追加のプロパティを禁止するか。デフォルトはFalse。
+
+    Returns:
+        dict: JSON Schema
+    """
+    schema = {
+        "type": "object",
+        "properties": {
+            key: {"type": "string", "description": _FIELD_DESCRIPTIONS[key]}
+            for key in field_order
+        },
+        "required": list(field_order),
+    }
+    if strict:
+        schema["additionalProperties"] = False
+    return schema
+
+
+LINK_TALK_SCHEMA = link_talk_schema()
+
+
+class LinkTalkBackend(object):
+    """linkとtalkを持つjsonを生成するLLMのバックエンドの基底クラス。
+
+    stream()はjsonの文字列を届いた順に断片で返すジェネレータで、
+    ジェネレータを閉じると下位のストリームも閉じて生成を中断する。
+    """
+
+    def supports(self, model: str) -> bool:
+        """モデルをこのバックエンドで使えるかを返す。
+
+        Args:
+            model (str): モデル名
+
+        Returns:
+            bool: 使える場合はTrue
+        """
+        raise NotImplementedError
+
+    def stream(
+        self, messages: list, model: str, temperature: float
+    ) -> Iterator[str]:
+        """linkとtalkを持つjsonを生成する。
+
+        Args:
+            messages (list): OpenAI形式のチャットメッセージのリスト
+            model (str): モデル名
+            temperature (float): サンプリング温度
+
+        Yields:
+            str: jsonの文字列の断片
+        """
+        raise NotImplementedError
+
+
+class OpenAIFunctionBackend(LinkTalkBackend):
+    """OpenAIのfunction callingでlinkとtalkを生成するバックエンド。"""
+
+    def __init__(self, models: List[str], client=None) -> None:
+        """コンストラクタ
+
+        Args:
+            models (List[str]): 使用できるモデル名のリスト
+            client (optional): OpenAIのクライアント。Noneの場合はopenaiモジュールの既定のクライアントを使う。
+
+        """
+        self.models = models
+        self.client = client
+
+    def supports(self, model: str) -> bool:
+        return model in self.models
+
+    def stream(
+        self, messages: list, model: str, temperature: float
+    ) -> Iterator[str]:
+        client = self.client if self.client is not None else openai
+        request_start = time.time()
+        result = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            n=1,
+            temperature=temperature,
+            functions=[
+                {
+                    "name": LINK_TALK_FUNCTION_NAME,
+                    "description": LINK_TALK_DESCRIPTION,
+                    "parameters": LINK_TALK_SCHEMA,
+                }
+            ],
+            function_call={"name": LINK_TALK_FUNCTION_NAME},
+            stream=True,
+            stop=None,
+        )
+        current_trace().record("llm_request", request_start, time.time(), model=model)
+        try:
+            for chunk in result:
+                delta = chunk.choices[0].delta
+                if delta.function_call is None or delta.function_call.arguments is None:
+                    continue
+                yield delta.function_call.arguments
+        finally:
+            result.close()
+
+
+class OpenAIToolBackend(LinkTalkBackend):
+    """OpenAIのtools APIとStructured Outputsでlinkとtalkを生成するバックエンド。"""
+
+    def __init__(
+        self,
+        models: List[str],
+        field_order: Sequence[str] = LINK_FIRST,
+        client=None,
+    ) -> None:
+        """コンストラクタ
+
+        Args:
+            models (List[str]): 使用できるモデル名のリスト
+            field_order (Sequence[str], optional): 生成するプロパティの順序。TALK_FIRSTにすると回答を先に生成する。
+            client (optional): OpenAIのクライアント。Noneの場合はopenaiモジュールの既定のクライアントを使う。
+
+        """
+        self.models = models
+        self.client = client
+        self.tools = [
+            {
+                "type": "function",
+                "function": {
+                    "name": LINK_TALK_FUNCTION_NAME,
+                    "description": LINK_TALK_DESCRIPTION,
+                    "parameters": link_talk_schema(field_order, strict=True),
+                    "strict": True,
+                },
+            }
+        ]
+
+    def supports(self, model: str) -> bool:
+        return model in self.models
+
+    def stream(
+        self, messages: list, model: str, temperature: float
+    ) -> Iterator[str]:
+        client = self.client if self.client is not None else openai
+        request_start = time.time()
+        result = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            n=1,
+            temperature=temperature,
+            tools=self.tools,
+            tool_choice={
+                "type": "function",
+                "function": {"name": LINK_TALK_FUNCTION_NAME},
+            },
+            parallel_tool_calls=False,
+            stream=True,
+        )
+        current_trace().record("llm_request", request_start, time.time(), model=model)
+        try:
+            for chunk in result:
+                if len(chunk.choices) == 0:
+                    continue
+                tool_calls = chunk.choices[0].delta.tool_calls
+                if not tool_calls or tool_calls[0].function is None:
+                    continue
+                if tool_calls[0].function.arguments:
+                    yield tool_calls[0].function.arguments
+        finally:
+            result.close()
+
+
+class OpenAICompatibleBackend(LinkTalkBackend):
+    """llama.cppのサーバなど、OpenAI互換のHTTPエンドポイントでlinkとtalkを生成するバックエンド。
+
+    function callingに対応していないサーバもあるため、json_schemaのresponse_formatで出力を制約し、
+    本文をそのままjsonとして読む。
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        models: List[str],
+        api_key: Optional[str] = None,
+        field_order: Sequence[str] = LINK_FIRST,
+    ) -> None:
+        """コンストラクタ
+
+        Args:
+            base_url (str): エンドポイントのURL。例: "http://192.168.0.10:8080/v1"
+            models (List[str]): このエンドポイントで使うモデル名のリスト
+            api_key (str, optional): APIキー。不要なサーバではNoneでよい。
+            field_order (Sequence[str], optional): 生成するプロパティの順序。デフォルトはLINK_FIRST。
+
+        """
+        self.models = models
+        self.schema = link_talk_schema(field_order)
+        self.client = openai.OpenAI(base_url=base_url, api_key=api_key or "none")
+
+    def supports(self, model: str) -> bool:
+        return model in self.models
+
+    def stream(
+        self, messages: list, model: str, temperature: float
+    ) -> Iterator[str]:
+        request_start = time.time()
+        result = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            n=1,
+            temperature=temperature,
+            response_format={
+                "type": "json_schema",
+                "json_schema": {
+                    "name": LINK_TALK_FUNCTION_NAME,
+                    "description": LINK_TALK_DESCRIPTION,
+                    "schema": self.schema,
+                },
+            },
+            stream=True,
+        )
+        current_trace().record("llm_request", request_start, time.time(), model=model)
+        try:
+            for chunk in result:
+                if len(chunk.choices) == 0 or chunk.choices[0].delta.content is None:
+                    continue
+                yield chunk.choices[0].delta.content
+        finally:
+            result.close()
+
+
+class AnthropicToolBackend(LinkTalkBackend):
+    """Claudeのtool useでlinkとtalkを生成するバックエンド。"""
+
+    def __init__(
+        self, max_tokens: int = 1024, field_order: Sequence[str] = LINK_FIRST
+    ) -> None:
+        """コンストラクタ
+
+        Args:
+            max_tokens (int, optional): 生成する最大トークン数。デフォルトは1024。
+            field_order (Sequence[str], optional): 生成するプロパティの順序。デフォルトはLINK_FIRST。
+
+        """
+        import anthropic
+
+        self.client = anthropic.Anthropic()
+        self.max_tokens = max_tokens
+        self.schema = link_talk_schema(field_order)
+
+    def supports(self, model: str) -> bool:
+        return model.startswith("claude")
+
+    def stream(
+        self, messages: list, model: str, temperature: float
+    ) -> Iterator[str]:
+        # Claudeではsystemメッセージを別の引数で渡す
+        system = "\n".join(m["content"] for m in messages if m["role"] == "system")
+        request_start = time.time()
+        with self.client.messages.stream(
+            model=model,
+            system=system,
+            messages=[m for m in messages if m["role"] != "system"],
+            max_tokens=self.max_tokens,
+            temperature=temperature,
+            tools=[
+                {
+                    "name": LINK_TALK_FUNCTION_NAME,
+                    "description": LINK_TALK_DESCRIPTION,
+                    "input_schema": self.schema,
+                }
+            ],
+            tool_choice={"type": "tool", "name": LINK_TALK_FUNCTION_NAME},
+        ) as result:
+            current_trace().record(
+                "llm_request", request_start, time.time(), model=model
+            )
+            for event in result:
+                if (
+                    event.type == "content_block_delta"
+                    and event.delta.type == "input_json_delta"
+                ):
+                    yield event.delta.partial_json
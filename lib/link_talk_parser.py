@@ -0,0 +1,194 @@
+from typing import Iterable, List, Optional, Tuple
+
+# (キー名, 値, 値が確定したか)
+ParseEvent = Tuple[str, str, bool]
+
+_ESCAPE_CHARS = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+
+# パーサの状態
+_EXPECT_OBJECT = 0
+_EXPECT_KEY = 1
+_IN_KEY = 2
+_EXPECT_COLON = 3
+_EXPECT_VALUE = 4
+_IN_STRING_VALUE = 5
+_IN_OTHER_VALUE = 6
+_AFTER_VALUE = 7
+_DONE = 8
+
+
+class LinkTalkStreamParser(object):
+    """function_callの引数として分割して届くJSON文字列を逐次解析するクラス。
+
+    受信済みのバッファ全体を毎回json.loadsし直すのではなく、状態を保持したまま
+    新しく届いた文字だけを走査する。stream_keysに指定したキーの文字列値は
+    届いた文字を都度イベントとして返し、それ以外のキーは値が閉じた時点で返す。
+    """
+
+    def __init__(self, stream_keys: Iterable[str] = ("talk",)) -> None:
+        """コンストラクタ
+
+        Args:
+            stream_keys (Iterable[str], optional): 値を逐次返すキー名。デフォルトは("talk",)。
+
+        """
+        self.stream_keys = set(stream_keys)
+        self.values: dict = {}
+        self._state = _EXPECT_OBJECT
+        self._key = ""
+        self._value: List[str] = []
+        self._escape = False
+        self._unicode = ""
+        self._high_surrogate: Optional[int] = None
+        self._depth = 0
+        self._in_other_string = False
+
+    @property
+    def done(self) -> bool:
+        """トップレベルのオブジェクトが閉じたかどうか。"""
+        return self._state == _DONE
+
+    def _decode_unicode(self, code: int) -> str:
+        if 0xD800 <= code <= 0xDBFF:
+            self._high_surrogate = code
+            return ""
+        if 0xDC00 <= code <= 0xDFFF and self._high_surrogate is not None:
+            code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+        self._high_surrogate = None
+        return chr(code)
+
+    def _close_value(self, value: str, events: List[ParseEvent]) -> None:
+        self.values[self._key] = value
+        events.append((self._key, "" if self._key in self.stream_keys else value, True))
+        self._value = []
+        self._state = _AFTER_VALUE
+
+    def feed(self, text: str) -> List[ParseEvent]:
+        """新しく届いた文字列を解析する。
+
+        Args:
+            text (str): 新しく届いたJSON文字列の断片。
+
+        Returns:
+            List[ParseEvent]: (キー名, 値, 確定したか)のリスト。
+                stream_keysのキーは新規文字が都度(key, 差分, False)で返り、
+                値が閉じると(key, "", True)が返る。それ以外のキーは(key, 値, True)のみ返る。
+
+        """
+        events: List[ParseEvent] = []
+        i = 0
+        length = len(text)
+        while i < length:
+            state = self._state
+            if state == _IN_STRING_VALUE:
+                streaming = self._key in self.stream_keys
+                if self._escape or self._unicode:
+                    c = text[i]
+                    i += 1
+                    if self._unicode:
+                        self._unicode += c
+                        if len(self._unicode) == 5:
+                            try:
+                                decoded = self._decode_unicode(int(self._unicode[1:], 16))
+                            except ValueError:
+                                decoded = ""
+                            self._unicode = ""
+                            if decoded:
+                                self._emit_char(decoded, streaming, events)
+                        continue
+                    self._escape = False
+                    if c == "u":
+                        self._unicode = "u"
+                        continue
+                    self._emit_char(_ESCAPE_CHARS.get(c, c), streaming, events)
+                    continue
+                # エスケープや終端までの通常文字はまとめてスライスで処理する
+                chunk_start = i
+                while i < length and text[i] != '"' and text[i] != "\\":
+                    i += 1
+                if i > chunk_start:
+                    self._emit_char(text[chunk_start:i], streaming, events)
+                if i >= length:
+                    break
+                c = text[i]
+                i += 1
+                if c == "\\":
+                    self._escape = True
+                    continue
+                self._close_value("".join(self._value), events)
+                continue
+            c = text[i]
+            i += 1
+            if state == _EXPECT_OBJECT:
+                if c == "{":
+                    self._state = _EXPECT_KEY
+            elif state == _EXPECT_KEY:
+                if c == '"':
+                    self._key = ""
+                    self._state = _IN_KEY
+                elif c == "}":
+                    self._state = _DONE
+            elif state == _IN_KEY:
+                if self._escape:
+                    self._key += _ESCAPE_CHARS.get(c, c)
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._state = _EXPECT_COLON
+                else:
+                    self._key += c
+            elif state == _EXPECT_COLON:
+                if c == ":":
+                    self._state = _EXPECT_VALUE
+            elif state == _EXPECT_VALUE:
+                if c == '"':
+                    self._value = []
+                    self._state = _IN_STRING_VALUE
+                elif not c.isspace():
+                    self._value = [c]
+                    self._depth = 1 if c in "[{" else 0
+                    self._in_other_string = False
+                    self._state = _IN_OTHER_VALUE
+            elif state == _IN_OTHER_VALUE:
+                # 文字列以外の値(数値、配列など)は閉じるまで読み飛ばす
+                if self._in_other_string:
+                    if self._escape:
+                        self._escape = False
+                    elif c == "\\":
+                        self._escape = True
+                    elif c == '"':
+                        self._in_other_string = False
+                    self._value.append(c)
+                    continue
+                if c == '"':
+                    self._in_other_string = True
+                elif c in "[{":
+                    self._depth += 1
+                elif c in "]}" and self._depth > 0:
+                    self._depth -= 1
+                elif self._depth == 0 and c in ",}":
+                    self._close_value("".join(self._value).strip(), events)
+                    self._state = _DONE if c == "}" else _EXPECT_KEY
+                    continue
+                self._value.append(c)
+            elif state == _AFTER_VALUE:
+                if c == ",":
+                    self._state = _EXPECT_KEY
+                elif c == "}":
+                    self._state = _DONE
+        return events
+
+    def _emit_char(self, chars: str, streaming: bool, events: List[ParseEvent]) -> None:
+        self._value.append(chars)
+        if streaming:
+            events.append((self._key, chars, False))
@@ -0,0 +1,333 @@
+import hashlib
+import json
+import math
+import os
+import re
+import unicodedata
+import zipfile
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import openai
+
+WORD_PATTERN = re.compile(r"[a-z0-9_]+|[^\sa-z0-9_!-/:-@\[-`{-~、。，．・「」『』（）！？]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """BM25用にテキストをトークンに分割する。英数字は単語単位、日本語などは文字bigramに分割する。
+
+    Args:
+        text (str): 分割するテキスト
+
+    Returns:
+        List[str]: トークンのリスト
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for word in WORD_PATTERN.findall(text):
+        if word.isascii() or len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i : i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+def load_rag_chunks(path: str, chunk_size: int = 500) -> List[dict]:
+    """rag_data内のtxtファイル(zip内を含む)を段落単位でまとめたチャンクに分割する。
+    manual_converter.pyの--format chunksで作成した.chunks.jsonlファイルは、分割せずにそのままチャンクとして読み込む。
+
+    Args:
+        path (str): rag_dataのディレクトリ
+        chunk_size (int, optional): 1チャンクの目安の文字数。デフォルトは500。
+
+    Returns:
+        List[dict]: {"source": ファイル名, "content": 本文}のリスト。.chunks.jsonlのチャンクは"title"と"url"も持つ。
+    """
+    documents = []
+    chunks = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            if file.endswith(".txt"):
+                with open(file_path, "r", encoding="utf-8") as f:
+                    documents.append((os.path.relpath(file_path, path), f.read()))
+            elif file.endswith(".chunks.jsonl"):
+                with open(file_path, "r", encoding="utf-8") as f:
+                    chunks.extend(json.loads(line) for line in f if line.strip())
+            elif file.endswith(".zip"):
+                with zipfile.ZipFile(file_path) as z:
+                    for name in sorted(z.namelist()):
+                        if name.endswith(".txt"):
+                            documents.append((name, z.read(name).decode("utf-8")))
+    for source, text in documents:
+        content = ""
+        for paragraph in text.split("\n\n"):
+            content += paragraph + "\n\n"
+            if len(content) >= chunk_size:
+                chunks.append({"source": source, "content": content})
+                content = ""
+        if content.strip():
+            chunks.append({"source": source, "content": content})
+    return chunks
+
+
+class LocalRetriever(object):
+    """rag_dataから起動時に作成するプロセス内の検索エンジン。
+
+    BM25による語彙検索と、embed_funcを指定した場合はNumPyの密ベクトルによる検索を組み合わせ、
+    WeaviateRagController.hybrid_searchと同じ形の結果を返す。
+    vector_cacheを指定した場合は、チャンクの埋め込みベクトルをファイルに保存し、
+    次回の起動時は本文が変わったチャンクのみを埋め込む。
+    """
+
+    def __init__(
+        self,
+        chunks: List[dict],
+        embed_func: Optional[Callable[[List[str]], List[List[float]]]] = None,
+        k1: float = 1.2,
+        b: float = 0.75,
+        vector_cache: Optional[str] = None,
+    ) -> None:
+        """コンストラクタ
+
+        Args:
+            chunks (List[dict]): {"source", "content"}を持つチャンクのリスト
+            embed_func (Callable[[List[str]], List[List[float]]], optional): テキストのリストを埋め込みベクトルに変換する関数。
+                Noneの場合は密ベクトル検索を行わない。
+            k1 (float, optional): BM25のパラメータk1。デフォルトは1.2。
+            b (float, optional): BM25のパラメータb。デフォルトは0.75。
+            vector_cache (str, optional): チャンクの埋め込みベクトルを保存する.npzファイルのパス。
+                embed_funcのモデル毎に別のファイルを指定する。Noneの場合は保存しない。
+
+        """
+        self.chunks = chunks
+        self.embed_func = embed_func
+        self.k1 = k1
+        self.b = b
+        # トークン -> [(チャンク番号, 出現回数)]
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.doc_lengths = np.zeros(len(chunks), dtype=np.float32)
+        for index, chunk in enumerate(chunks):
+            tokens = tokenize(chunk["content"])
+            self.doc_lengths[index] = len(tokens)
+            for token, count in Counter(tokens).items():
+                self.postings[token].append((index, count))
+        self.average_length = float(self.doc_lengths.mean()) if len(chunks) > 0 else 0.0
+        num_docs = len(chunks)
+        self.idf = {
+            token: math.log(1 + (num_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+            for token, posting in self.postings.items()
+        }
+        # どのチャンクにも含まれないトークンのidf
+        self.max_idf = math.log(1 + (num_docs + 0.5) / 0.5)
+        self.vector_cache = vector_cache
+        self.vectors = None
+        if embed_func is not None and len(chunks) > 0:
+            self.vectors = self._normalize(
+                self._embed_chunks([c["content"] for c in chunks])
+            )
+
+    @classmethod
+    def from_path(
+        cls,
+        path: str,
+        embed_func: Optional[Callable[[List[str]], List[List[float]]]] = None,
+        vector_cache: Optional[str] = None,
+    ) -> "LocalRetriever":
+        """rag_dataのディレクトリから検索エンジンを作成する。
+
+        Args:
+            path (str): rag_dataのディレクトリ
+            embed_func (Callable[[List[str]], List[List[float]]], optional): 埋め込みベクトルに変換する関数
+            vector_cache (str, optional): チャンクの埋め込みベクトルを保存する.npzファイルのパス
+
+        Returns:
+            LocalRetriever: 作成した検索エンジン
+        """
+        return cls(load_rag_chunks(path), embed_func=embed_func, vector_cache=vector_cache)
+
+    def _embed_chunks(self, texts: List[str]) -> np.ndarray:
+        """チャンクの本文を埋め込む。vector_cacheに保存済みの本文は再利用する。"""
+        keys = [hashlib.sha1(text.encode("utf-8")).hexdigest() for text in texts]
+        cached: Dict[str, np.ndarray] = {}
+        if self.vector_cache is not None and os.path.exists(self.vector_cache):
+            try:
+                with np.load(self.vector_cache) as data:
+                    cached = dict(zip(data["keys"].tolist(), data["vectors"]))
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Embedding cache load error: {e}")
+        missing = sorted({i for i, key in enumerate(keys) if key not in cached})
+        if len(missing) > 0:
+            vectors = self.embed_func([texts[i] for i in missing])
+            for i, vector in zip(missing, vectors):
+                cached[keys[i]] = np.asarray(vector, dtype=np.float32)
+        print(f"Chunk embeddings: {len(texts) - len(missing)} cached, {len(missing)} embedded")
+        vectors = np.stack([cached[key] for key in keys]).astype(np.float32)
+        if self.vector_cache is not None and len(missing) > 0:
+            # 削除されたチャンクのベクトルは保存しない
+            self._save_vectors(keys, vectors)
+        return vectors
+
+    def _save_vectors(self, keys: List[str], vectors: np.ndarray) -> None:
+        tmp_path = self.vector_cache + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.vector_cache)), exist_ok=True)
+            with open(tmp_path, "wb") as file:
+                np.savez(file, keys=np.asarray(keys), vectors=vectors)
+            os.replace(tmp_path, self.vector_cache)
+        except OSError as e:
+            print(f"Embedding cache save error: {e}")
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def bm25_scores(self, text: str) -> np.ndarray:
+        """全チャンクのBM25スコアを計算する。
+
+        Args:
+            text (str): 検索テキスト
+
+        Returns:
+            np.ndarray: チャンク毎のスコア
+        """
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        length_norm = self.k1 * (
+            1 - self.b + self.b * self.doc_lengths / max(self.average_length, 1.0)
+        )
+        for token in set(tokenize(text)):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            indices = np.fromiter(
+                (p[0] for p in posting), dtype=np.int64, count=len(posting)
+            )
+            counts = np.fromiter(
+                (p[1] for p in posting), dtype=np.float32, count=len(posting)
+            )
+            scores[indices] += (
+                self.idf[token]
+                * counts
+                * (self.k1 + 1)
+                / (counts + length_norm[indices])
+            )
+        return scores
+
+    def match_ratio(self, text: str, scores: np.ndarray) -> float:
+        """最もスコアの高いチャンクが、検索テキストのトークンにどの程度一致したかを求める。
+
+        検索テキストの各トークンのBM25スコアの上限(idf * (k1 + 1))の合計に対する割合で、
+        BM25スコアの正規化と異なり、質問の内容がrag_dataにない場合は小さくなる。
+
+        Args:
+            text (str): 検索テキスト
+            scores (np.ndarray): bm25_scoresで求めた正規化前のスコア
+
+        Returns:
+            float: 0から1の値
+        """
+        upper = sum(
+            self.idf.get(token, self.max_idf) * (self.k1 + 1)
+            for token in set(tokenize(text))
+        )
+        if upper <= 0 or len(scores) == 0:
+            return 0.0
+        return float(scores.max()) / upper
+
+    def hybrid_search(
+        self,
+        text: str,
+        limit: int = 3,
+        alpha: float = 0.75,
+        collection_name: Optional[str] = None,
+        rerank: bool = False,
+    ) -> SimpleNamespace:
+        """BM25と密ベクトルのスコアを組み合わせて検索する。引数と戻り値はWeaviateRagController.hybrid_searchに合わせている。
+
+        Args:
+            text (str): 検索テキスト
+            limit (int, optional): 返す件数。デフォルトは3。
+            alpha (float, optional): 密ベクトル検索の重み。0でBM25のみ、1で密ベクトルのみ。デフォルトは0.75。
+            collection_name (str, optional): 互換性のための引数。使用しない。
+            rerank (bool, optional): 互換性のための引数。使用しない。
+
+        Returns:
+            SimpleNamespace: objectsに、propertiesとmetadata.scoreを持つ結果のリストを、
+                match_ratioに検索テキストとの一致度を格納したもの
+        """
+        if len(self.chunks) == 0:
+            return SimpleNamespace(objects=[], match_ratio=0.0)
+        scores = self.bm25_scores(text)
+        match_ratio = self.match_ratio(text, scores)
+        if scores.max() > 0:
+            scores = scores / scores.max()
+        if self.vectors is not None and alpha > 0:
+            query = self._normalize(
+                np.asarray(self.embed_func([text])[0], dtype=np.float32)
+            )
+            vector_scores = self.vectors @ query
+            scores = (1 - alpha) * scores + alpha * vector_scores
+        limit = min(limit, len(self.chunks))
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        return SimpleNamespace(
+            objects=[
+                SimpleNamespace(
+                    properties=self.chunks[i],
+                    metadata=SimpleNamespace(score=float(scores[i])),
+                )
+                for i in top
+                if scores[i] > 0
+            ],
+            match_ratio=match_ratio,
+        )
+
+
+def openai_embedder(
+    model: str = "text-embedding-3-small",
+) -> Callable[[List[str]], List[List[float]]]:
+    """OpenAIの埋め込みモデルでテキストをベクトルに変換する関数を作成する。
+
+    Args:
+        model (str, optional): 埋め込みモデル名。デフォルトは"text-embedding-3-small"。
+
+    Returns:
+        Callable[[List[str]], List[List[float]]]: テキストのリストをベクトルのリストに変換する関数
+    """
+
+    def embed(texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for i in range(0, len(texts), 256):
+            result = openai.embeddings.create(model=model, input=texts[i : i + 256])
+            vectors.extend(d.embedding for d in result.data)
+        return vectors
+
+    return embed
+
+
+def sentence_transformer_embedder(
+    model: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+) -> Callable[[List[str]], List[List[float]]]:
+    """sentence-transformersのモデルでテキストをローカルでベクトルに変換する関数を作成する。
+
+    検索毎のAPI呼び出しがないため、openai_embedderより低遅延で検索できる。
+    使用する場合は別途sentence-transformersをインストールする。
+
+    Args:
+        model (str, optional): モデル名。デフォルトは多言語対応の"paraphrase-multilingual-MiniLM-L12-v2"。
+
+    Returns:
+        Callable[[List[str]], List[List[float]]]: テキストのリストをベクトルのリストに変換する関数
+    """
+    from sentence_transformers import SentenceTransformer
+
+    encoder = SentenceTransformer(model)
+
+    def embed(texts: List[str]) -> List[List[float]]:
+        return encoder.encode(texts, batch_size=64).tolist()
+
+    return embed
@@ -0,0 +1,162 @@
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent import futures
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from lib.speculation import edit_distance_ratio
+
+# 正規化時に除去する記号
+STRIP_CHARS = set(" \t\n\r　、。，．,.！!？?・「」『』（）()")
+
+
+def normalize_text(text: str) -> str:
+    """検索キャッシュのキーとして使うためにテキストを正規化する。
+
+    Args:
+        text (str): 正規化するテキスト
+
+    Returns:
+        str: NFKC正規化、小文字化し、空白と句読点を除いたテキスト
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(c for c in text if c not in STRIP_CHARS)
+
+
+class RagPrefetcher(object):
+    """音声認識の途中結果を受け取った時点でRAG検索を開始し、結果をキャッシュするクラス。
+
+    最終結果が届いた時点で、同じ正規化テキストか、正規化した編集距離がしきい値以下の
+    同じセッションの検索が実行中または完了済みであればその結果を再利用し、
+    検索の待ち時間を応答開始までの時間から除く。
+    セッション毎に最新の途中結果の検索のみを残し、開始前の古い検索は取り消す。
+    """
+
+    def __init__(
+        self,
+        search_func: Callable[[str], Any],
+        max_workers: int = 2,
+        max_entries: int = 16,
+        match_threshold: float = 0.2,
+    ) -> None:
+        """コンストラクタ
+
+        Args:
+            search_func (Callable[[str], Any]): 検索を行う関数。引数は検索テキスト。
+            max_workers (int, optional): 検索を並列実行するスレッド数。デフォルトは2。
+            max_entries (int, optional): キャッシュする検索結果の最大数。デフォルトは16。
+            match_threshold (float, optional): 最終結果と一致しない場合に、途中結果の検索を再利用する
+                正規化した編集距離の上限。デフォルトは0.2。
+
+        """
+        self.search_func = search_func
+        self.max_entries = max_entries
+        self.match_threshold = match_threshold
+        self.executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        # 正規化テキスト -> (Future, 検索開始時刻, セッションID)
+        self.entries: "OrderedDict[str, Tuple[futures.Future, float, str]]" = OrderedDict()
+        # セッションID -> 最後に先行検索した正規化テキスト
+        self.latest: Dict[str, str] = {}
+        self.hit_count = 0
+        self.miss_count = 0
+        self.total_saved_time = 0.0
+
+    def _timed_search(self, text: str) -> Tuple[Any, float]:
+        start = time.time()
+        result = self.search_func(text)
+        return result, time.time() - start
+
+    def prefetch(self, text: str, session_id: str = "") -> None:
+        """検索をバックグラウンドで開始する。同じ正規化テキストの検索が既にあれば何もしない。
+
+        同じセッションの前回の途中結果の検索がまだ開始されていなければ取り消す。
+
+        Args:
+            text (str): 検索テキスト
+            session_id (str, optional): 途中結果を送ったセッションのID
+
+        """
+        key = normalize_text(text)
+        if key == "":
+            return
+        with self.lock:
+            previous_key = self.latest.get(session_id)
+            self.latest[session_id] = key
+            if previous_key is not None and previous_key != key:
+                previous = self.entries.get(previous_key)
+                # 実行中の検索は止められないため、開始前のもののみ取り消す
+                if previous is not None and previous[0].cancel():
+                    del self.entries[previous_key]
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return
+            future = self.executor.submit(self._timed_search, text)
+            self.entries[key] = (future, time.time(), session_id)
+            while len(self.entries) > self.max_entries:
+                _, (old_future, _, _) = self.entries.popitem(last=False)
+                old_future.cancel()
+
+    def _find(self, key: str, session_id: str) -> Optional[str]:
+        if key in self.entries:
+            return key
+        best_key = None
+        best_distance = self.match_threshold
+        for cached_key, (future, _, cached_session_id) in self.entries.items():
+            if cached_session_id != session_id or future.cancelled():
+                continue
+            distance = edit_distance_ratio(cached_key, key)
+            # 同じ距離であれば新しい途中結果を優先する
+            if distance <= best_distance:
+                best_distance = distance
+                best_key = cached_key
+        return best_key
+
+    def get(self, text: str, session_id: str = "") -> Any:
+        """検索結果を取得する。先行検索があればその結果を待って返し、なければ検索を実行する。
+
+        Args:
+            text (str): 検索テキスト
+            session_id (str, optional): 最終結果を送ったセッションのID
+
+        Returns:
+            Any: search_funcの戻り値
+        """
+        key = normalize_text(text)
+        request_time = time.time()
+        with self.lock:
+            found_key = self._find(key, session_id) if key else None
+            entry = self.entries.get(found_key) if found_key is not None else None
+        if entry is None:
+            self.miss_count += 1
+            result, search_time = self._timed_search(text)
+            print(f"RAG search: {search_time:.3f} [s] (prefetch miss)")
+            return result
+        future, start_time, _ = entry
+        try:
+            result, search_time = future.result()
+        except BaseException:
+            # 失敗した検索結果は再利用しない
+            with self.lock:
+                self.entries.pop(found_key, None)
+            raise
+        wait_time = time.time() - request_time
+        saved_time = max(search_time - wait_time, 0.0)
+        self.hit_count += 1
+        self.total_saved_time += saved_time
+        print(
+            f"RAG search: {search_time:.3f} [s] wait: {wait_time:.3f} [s] "
+            f"saved: {saved_time:.3f} [s] (prefetch hit, started "
+            f"{request_time - start_time:.3f} [s] before final"
+            f"{'' if found_key == key else ', near match'})"
+        )
+        print(
+            f"RAG prefetch hit: {self.hit_count} miss: {self.miss_count} "
+            f"total saved: {self.total_saved_time:.3f} [s]"
+        )
+        return result
+
+    def shutdown(self) -> None:
+        """検索用スレッドを終了する。"""
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,170 @@
+from typing import Iterable, List, Optional
+
+HARD_DELIMITERS = "。！？!?\n"
+SOFT_DELIMITERS = "、，,"
+OPEN_BRACKETS = "「『（(【［[〈《"
+CLOSE_BRACKETS = "」』）)】］]〉》"
+QUOTE_CHARS = "\"“”"
+# 「！！」「！？」のように続けて使われることがあり、次の文字を見てから区切る文字
+REPEATED_DELIMITERS = "！？!?"
+# 最初の文に区切り文字がない場合に、直後で区切る助詞
+PARTICLES = "はがをにでとものへ"
+
+
+def is_hiragana(char: str) -> bool:
+    return "\u3041" <= char <= "\u309f"
+
+
+class SentenceSegmenter(object):
+    """ストリームで届く回答文を、音声合成に送る文に逐次分割するクラス。
+
+    新しく届いた文字だけを1回走査して区切りを探す。句点などの強い区切りでは常に分割し、
+    読点などの弱い区切りでは、最初の文はfirst_min_chars文字以上、以降はmin_chars文字以上の場合に分割する。
+    最初の文を短くすると、音声合成を早く開始できる。
+    最初の文がfirst_max_chars文字以上になっても区切り文字がない場合は、漢字やカタカナなどに続く助詞の後で分割する。
+    括弧や引用符の中とURLの中では分割せず、！や？の直後に続く区切り文字や閉じ括弧は同じ文に含める。
+    """
+
+    def __init__(
+        self,
+        first_min_chars: Optional[int] = 4,
+        first_max_chars: Optional[int] = 8,
+        min_chars: Optional[int] = 40,
+        max_chars: int = 100,
+        hard_delimiters: Iterable[str] = HARD_DELIMITERS,
+        soft_delimiters: Iterable[str] = SOFT_DELIMITERS,
+    ) -> None:
+        """コンストラクタ
+
+        Args:
+            first_min_chars (int, optional): 最初の文を弱い区切りで分割する最小文字数。Noneの場合は分割しない。デフォルトは4。
+            first_max_chars (int, optional): 最初の文を区切り文字がなくても助詞の後で分割する最小文字数。Noneの場合は分割しない。デフォルトは8。
+            min_chars (int, optional): 2文目以降を弱い区切りで分割する最小文字数。Noneの場合は分割しない。デフォルトは40。
+            max_chars (int, optional): 括弧が閉じられないままこの文字数を超えた場合は、括弧内でも分割する。デフォルトは100。
+            hard_delimiters (Iterable[str], optional): 常に分割する区切り文字
+            soft_delimiters (Iterable[str], optional): 文字数に応じて分割する区切り文字
+
+        """
+        self.first_min_chars = first_min_chars
+        self.first_max_chars = first_max_chars
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.hard_delimiters = set(hard_delimiters)
+        self.soft_delimiters = set(soft_delimiters)
+        self.count = 0
+        self._reset()
+
+    def _reset(self) -> None:
+        self._chars: List[str] = []
+        self._depth = 0
+        self._in_quote = False
+        self._in_url = False
+        # 区切り文字を見つけ、後続の区切り文字や閉じ括弧を待っている状態
+        self._pending = False
+        # 助詞を見つけ、次の文字がひらがなでなければ区切る状態
+        self._particle_end = False
+
+    def _soft_min_chars(self) -> Optional[int]:
+        return self.first_min_chars if self.count == 0 else self.min_chars
+
+    def _emit(self, segments: List[str]) -> None:
+        self._pending = False
+        segment = "".join(self._chars)
+        # 空白のみの場合は次の文の先頭に含める
+        if segment.strip():
+            segments.append(segment)
+            self.count += 1
+            self._chars = []
+            # max_charsを超えて括弧や引用符の中で分割した場合も、次の文は括弧の外として扱う
+            self._depth = 0
+            self._in_quote = False
+
+    def feed(self, text: str) -> List[str]:
+        """新しく届いた文字列を追加し、確定した文を返す。
+
+        Args:
+            text (str): 新しく届いた文字列
+
+        Returns:
+            List[str]: 確定した文のリスト
+        """
+        segments: List[str] = []
+        chars = self._chars
+        for char in text:
+            if self._pending:
+                if char in self.hard_delimiters or char in CLOSE_BRACKETS:
+                    chars.append(char)
+                    continue
+                self._emit(segments)
+                chars = self._chars
+            if self._particle_end:
+                self._particle_end = False
+                # 「カメラのような」のように助詞に見えて語が続く場合は区切らない
+                if not is_hiragana(char) and not self._is_delimiter(char):
+                    self._emit(segments)
+                    chars = self._chars
+            chars.append(char)
+            if self._in_url:
+                if not char.isspace() and char.isascii():
+                    continue
+                self._in_url = False
+            if char == "/" and len(chars) >= 3 and chars[-2] == "/" and chars[-3] == ":":
+                self._in_url = True
+                continue
+            if char in OPEN_BRACKETS:
+                self._depth += 1
+                continue
+            if char in CLOSE_BRACKETS:
+                self._depth = max(self._depth - 1, 0)
+                continue
+            if char in QUOTE_CHARS:
+                self._in_quote = not self._in_quote
+                continue
+            if (self._depth > 0 or self._in_quote) and len(chars) < self.max_chars:
+                continue
+            if char in self.hard_delimiters:
+                if char in REPEATED_DELIMITERS:
+                    self._pending = True
+                else:
+                    self._emit(segments)
+                    chars = self._chars
+            elif char in self.soft_delimiters:
+                soft_min_chars = self._soft_min_chars()
+                if soft_min_chars is not None and len(chars) >= soft_min_chars:
+                    self._emit(segments)
+                    chars = self._chars
+            elif (
+                self.count == 0
+                and self.first_max_chars is not None
+                and len(chars) >= max(self.first_max_chars, 2)
+                and char in PARTICLES
+                and not is_hiragana(chars[-2])
+            ):
+                self._particle_end = True
+        return segments
+
+    def _is_delimiter(self, char: str) -> bool:
+        return (
+            char in self.hard_delimiters
+            or char in self.soft_delimiters
+            or char in CLOSE_BRACKETS
+            or char.isspace()
+        )
+
+    def flush(self) -> Optional[str]:
+        """残りの文字列を最後の文として返し、状態をリセットする。
+
+        区切り文字で終わっていない場合は句点を付ける。
+
+        Returns:
+            str: 最後の文。残りがない場合はNone。
+        """
+        segment = "".join(self._chars)
+        pending = self._pending
+        self._reset()
+        if not segment.strip():
+            return None
+        self.count += 1
+        if pending or segment.rstrip()[-1] in self.hard_delimiters:
+            return segment
+        return segment + "。"
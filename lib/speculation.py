@@ -0,0 +1,186 @@
+import threading
+import time
+from typing import Callable, Iterator, List, Optional
+
+# 最終応答のキャンセルを確認する間隔[s]
+CANCEL_POLL_INTERVAL = 0.05
+
+
+def edit_distance(a: str, b: str) -> int:
+    """2つの文字列のレーベンシュタイン距離を求める。
+
+    Args:
+        a (str): 文字列
+        b (str): 文字列
+
+    Returns:
+        int: 編集距離
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (char_a != char_b),
+                )
+            )
+        previous = current
+    return previous[-1]
+
+
+def edit_distance_ratio(a: str, b: str) -> float:
+    """長い方の文字数で正規化した編集距離を求める。
+
+    Args:
+        a (str): 文字列
+        b (str): 文字列
+
+    Returns:
+        float: 0(一致)から1の値
+    """
+    return edit_distance(a, b) / max(len(a), len(b), 1)
+
+
+class Speculation(object):
+    """音声認識の途中結果から最終応答を先行して生成するクラス。
+
+    生成した文とリンクはpromote()されるまで送信せずに保持する。
+    最終結果が途中結果と十分近ければpromote()で保持した文から再生し、そうでなければcancel()で破棄する。
+    生成はstateが"running"から、"finished"、"failed"(例外)、"cancelled"のいずれかになって終わる。
+    """
+
+    def __init__(
+        self,
+        text: str,
+        generate: Callable[
+            [str, threading.Event, Callable[[str], None]], Iterator[str]
+        ],
+    ) -> None:
+        """コンストラクタ。バックグラウンドで生成を開始する。
+
+        Args:
+            text (str): 音声認識の途中結果
+            generate (Callable[[str, threading.Event, Callable[[str], None]], Iterator[str]]):
+                (テキスト, キャンセル用イベント, リンクを受け取る関数)を引数に、応答を文ごとに返す関数
+
+        """
+        self.text = text
+        self.generate = generate
+        self.start_time = time.time()
+        self.first_sentence_time: Optional[float] = None
+        self.promote_time: Optional[float] = None
+        self.cancel_event = threading.Event()
+        self.condition = threading.Condition()
+        self.sentences: List[str] = []
+        self.finished = False
+        self.state = "running"
+        self.link: Optional[str] = None
+        self.send_link: Optional[Callable[[str], None]] = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _on_link(self, url: str) -> None:
+        with self.condition:
+            self.link = url
+            send_link = self.send_link
+        if send_link is not None:
+            send_link(url)
+
+    def _run(self) -> None:
+        state = "finished"
+        try:
+            for sentence in self.generate(self.text, self.cancel_event, self._on_link):
+                with self.condition:
+                    if self.first_sentence_time is None:
+                        self.first_sentence_time = time.time()
+                    self.sentences.append(sentence)
+                    self.condition.notify_all()
+        except Exception as e:
+            print(f"Speculation error: {e}")
+            state = "failed"
+        finally:
+            if state == "finished" and self.cancel_event.is_set():
+                state = "cancelled"
+            with self.condition:
+                self.state = state
+                self.finished = True
+                self.condition.notify_all()
+
+    def cancel(self) -> None:
+        """生成を中断する。"""
+        self.cancel_event.set()
+
+    def wait_first_sentence(self, cancel_event: threading.Event) -> bool:
+        """最初の文が生成されるまで待つ。
+
+        Args:
+            cancel_event (threading.Event): セットされると待つのをやめるイベント
+
+        Returns:
+            bool: 最初の文が生成された場合はTrue。文を生成せずに終わった場合やcancel_eventがセットされた場合はFalse。
+        """
+        with self.condition:
+            while len(self.sentences) == 0 and not self.finished:
+                if cancel_event.is_set():
+                    return False
+                self.condition.wait(timeout=CANCEL_POLL_INTERVAL)
+            return len(self.sentences) > 0
+
+    def promote(
+        self, send_link: Callable[[str], None], cancel_event: threading.Event
+    ) -> Iterator[str]:
+        """先行生成した応答を最終応答として採用する。
+
+        Args:
+            send_link (Callable[[str], None]): リンクを送信する関数。確定済みのリンクはすぐに送信する。
+            cancel_event (threading.Event): 最終応答のキャンセル用イベント。セットされると生成を中断し、イテレータを終える。
+
+        Returns:
+            Iterator[str]: 生成済みの文から順に返し、以降は生成を待って返すイテレータ
+        """
+        self.promote_time = time.time()
+        with self.condition:
+            self.send_link = send_link
+            link = self.link
+        if link is not None:
+            send_link(link)
+        return self._iter_sentences(cancel_event)
+
+    def _iter_sentences(self, cancel_event: threading.Event) -> Iterator[str]:
+        index = 0
+        while True:
+            with self.condition:
+                while index >= len(self.sentences) and not self.finished:
+                    if cancel_event.is_set():
+                        break
+                    # 最終応答のキャンセルはこのConditionに通知されないため、一定間隔で確認する
+                    self.condition.wait(timeout=CANCEL_POLL_INTERVAL)
+                if cancel_event.is_set():
+                    self.cancel()
+                    return
+                if index >= len(self.sentences):
+                    return
+                sentence = self.sentences[index]
+            index += 1
+            yield sentence
+
+    def saved_time(self) -> Optional[float]:
+        """先行生成で短縮できた最初の文までの時間[s]を返す。
+
+        promote後に最初の文が生成されていない場合はNoneを返す。
+        先行生成しなかった場合、最初の文はpromote時刻から同じ生成時間後に届くとみなす。
+
+        Returns:
+            float: 短縮できた時間[s]
+        """
+        if self.promote_time is None or self.first_sentence_time is None:
+            return None
+        return min(
+            self.first_sentence_time - self.start_time,
+            self.promote_time - self.start_time,
+        )
@@ -0,0 +1,241 @@
+import os
+import queue
+import sys
+import threading
+from typing import Callable, Optional
+
+import grpc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "grpc"))
+sys.path.append(os.path.join(os.path.dirname(__file__), "akari_chatgpt_bot/lib/grpc"))
+import voice_server_pb2
+import voice_server_pb2_grpc
+import voice_stream_server_pb2
+import voice_stream_server_pb2_grpc
+
+VOICE_APIS = ("stream", "unary")
+
+
+class VoiceSender(object):
+    """voice_serverに応答を送信するクラス。
+
+    既存のvoice_serverのunary RPCを、イベント毎に1回ずつ呼び出す。
+    """
+
+    def __init__(self, channel: grpc.Channel) -> None:
+        """コンストラクタ
+
+        Args:
+            channel (grpc.Channel): voice_serverに接続するチャンネル
+
+        """
+        self.stub = voice_server_pb2_grpc.VoiceServerServiceStub(channel)
+
+    def start_head_control(self) -> None:
+        """ヘッドの制御を開始する。"""
+        self.stub.StartHeadControl(voice_server_pb2.StartHeadControlRequest())
+
+    def set_text(self, text: str) -> None:
+        """読み上げる文を送信する。
+
+        Args:
+            text (str): 読み上げる文
+
+        """
+        self.stub.SetText(voice_server_pb2.SetTextRequest(text=text))
+
+    def send_link(self, url: str) -> None:
+        """応答に合わせて表示するリンクを送信する。既存のvoice_serverにはリンクを受け取るRPCがないため、何もしない。
+
+        Args:
+            url (str): リンク
+
+        """
+        pass
+
+    def sentence_end(self) -> None:
+        """応答の終了を通知する。"""
+        self.stub.SentenceEnd(voice_server_pb2.SentenceEndRequest())
+
+    def interrupt(self) -> None:
+        """再生待ちの音声を破棄する。"""
+        self.stub.InterruptVoice(voice_server_pb2.InterruptVoiceRequest())
+
+    def close(self) -> None:
+        """送信を終了する。"""
+        pass
+
+
+class _VoiceStream(object):
+    """StreamVoiceの呼び出し1本分の状態"""
+
+    def __init__(
+        self,
+        stub: voice_stream_server_pb2_grpc.VoiceStreamServerServiceStub,
+        window: int,
+    ) -> None:
+        self.window = window
+        self.requests: "queue.Queue[Optional[voice_stream_server_pb2.VoiceEvent]]" = (
+            queue.Queue()
+        )
+        # 処理待ちにできるイベントの残り数。voice_serverが処理を通知する毎に戻る
+        self.credits = threading.Semaphore(window)
+        self.ready = threading.Event()
+        self.closed = threading.Event()
+        self.code: Optional[grpc.StatusCode] = None
+        self.call = stub.StreamVoice(iter(self.requests.get, None))
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self) -> None:
+        try:
+            for reply in self.call:
+                if reply.seq == 0:
+                    self.ready.set()
+                    continue
+                if not reply.success:
+                    print(f"Voice event {reply.seq} failed.")
+                self.credits.release()
+        except grpc.RpcError as e:
+            self.code = e.code()
+            if self.code != grpc.StatusCode.CANCELLED:
+                print(f"StreamVoice error: {self.code}")
+        finally:
+            self.closed.set()
+            self.ready.set()
+            # 処理を待っている送信を解放する
+            for _ in range(self.window):
+                self.credits.release()
+
+    def close(self) -> None:
+        self.requests.put(None)
+
+    def cancel(self) -> None:
+        self.call.cancel()
+
+
+class StreamVoiceSender(VoiceSender):
+    """voice_serverに1本の双方向ストリームで応答を送信するクラス。
+
+    文、リンク、応答の終了などのイベントを送信順に1本のStreamVoiceに流し、voice_serverの処理を待たずに戻る。
+    voice_serverが処理を通知していないイベントがwindow個に達した場合は、通知が届くまで待つ。
+    voice_serverがStreamVoiceを実装していない場合は、以降は既存のunary RPCで送信する。
+    """
+
+    def __init__(
+        self, channel: grpc.Channel, window: int = 16, timeout: float = 2.0
+    ) -> None:
+        """コンストラクタ
+
+        Args:
+            channel (grpc.Channel): voice_serverに接続するチャンネル
+            window (int, optional): voice_serverの処理を待たずに送信できるイベントの最大数。デフォルトは16。
+            timeout (float, optional): ストリームの開始や、voice_serverの処理を待つ最大時間[s]。デフォルトは2.0。
+
+        """
+        super().__init__(channel)
+        self.stream_stub = voice_stream_server_pb2_grpc.VoiceStreamServerServiceStub(
+            channel
+        )
+        self.window = window
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        # Falseになった場合は、以降はunary RPCで送信する
+        self.streaming = True
+        self.stream: Optional[_VoiceStream] = None
+        # ストリームを開始中の場合にセットされるイベント
+        self.opening: Optional[threading.Event] = None
+        self.seq = 0
+
+    def _get_stream(self) -> Optional[_VoiceStream]:
+        """開いているストリームを返す。閉じている場合は開き直す。
+
+        ストリームの開始はロックの外で待つ。他のスレッドが開始中の場合は、その完了を待つ。
+
+        Returns:
+            _VoiceStream: ストリーム。unary RPCで送信する場合はNone。
+        """
+        with self.lock:
+            if not self.streaming:
+                return None
+            if self.stream is not None and not self.stream.closed.is_set():
+                return self.stream
+            opening = self.opening
+            if opening is None:
+                self.opening = threading.Event()
+        if opening is not None:
+            opening.wait(self.timeout)
+            with self.lock:
+                if self.stream is not None and not self.stream.closed.is_set():
+                    return self.stream
+            return None
+        stream = self._open_stream()
+        with self.lock:
+            if stream is not None:
+                self.stream = stream
+            opening, self.opening = self.opening, None
+        opening.set()
+        return stream
+
+    def _open_stream(self) -> Optional[_VoiceStream]:
+        stream = _VoiceStream(self.stream_stub, self.window)
+        stream.ready.wait(self.timeout)
+        if stream.code == grpc.StatusCode.UNIMPLEMENTED:
+            print("voice_server does not support StreamVoice. Use unary RPCs.")
+            with self.lock:
+                self.streaming = False
+            return None
+        if not stream.ready.is_set() or stream.closed.is_set():
+            print("Failed to open voice stream. Use unary RPC for this event.")
+            stream.cancel()
+            return None
+        return stream
+
+    def _send(self, fallback: Callable[[], None], **event) -> None:
+        """イベントをストリームに送信する。ストリームを使えない場合はfallbackを呼ぶ。
+
+        Args:
+            fallback (Callable[[], None]): 同じイベントをunary RPCで送信する関数
+            **event: VoiceEventのフィールド
+
+        """
+        stream = self._get_stream()
+        if stream is None:
+            fallback()
+            return
+        if not stream.credits.acquire(timeout=self.timeout):
+            print("Voice stream is not responding. Reconnect.")
+            stream.cancel()
+            fallback()
+            return
+        with self.lock:
+            if stream.closed.is_set():
+                stream = None
+            else:
+                self.seq += 1
+                stream.requests.put(
+                    voice_stream_server_pb2.VoiceEvent(seq=self.seq, **event)
+                )
+        if stream is None:
+            fallback()
+
+    def start_head_control(self) -> None:
+        self._send(super().start_head_control, start_head_control=True)
+
+    def set_text(self, text: str) -> None:
+        self._send(lambda: super(StreamVoiceSender, self).set_text(text), text=text)
+
+    def send_link(self, url: str) -> None:
+        self._send(lambda: None, link=url)
+
+    def sentence_end(self) -> None:
+        self._send(super().sentence_end, sentence_end=True)
+
+    def interrupt(self) -> None:
+        # 送信済みの文より後に処理されるよう、割り込みも同じストリームで送る
+        self._send(super().interrupt, interrupt=True)
+
+    def close(self) -> None:
+        with self.lock:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
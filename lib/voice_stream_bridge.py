@@ -0,0 +1,156 @@
+import os
+import sys
+from typing import Callable, Iterator, Union
+
+import grpc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "grpc"))
+sys.path.append(os.path.join(os.path.dirname(__file__), "akari_chatgpt_bot/lib/grpc"))
+import voice_server_pb2
+import voice_server_pb2_grpc
+import voice_stream_server_pb2
+import voice_stream_server_pb2_grpc
+
+
+class VoiceStreamBridge(voice_stream_server_pb2_grpc.VoiceStreamServerServiceServicer):
+    """StreamVoiceで受け取ったイベントを、既存のvoice_serverのRPCに順に変換するサーバ。
+
+    既存のvoice_serverのServicerを渡すと同じプロセス内で直接呼び出し、スタブを渡すとunary RPCで転送する。
+    """
+
+    def __init__(
+        self,
+        voice: Union[
+            voice_server_pb2_grpc.VoiceServerServiceServicer,
+            voice_server_pb2_grpc.VoiceServerServiceStub,
+        ],
+    ) -> None:
+        """コンストラクタ
+
+        Args:
+            voice (Union[voice_server_pb2_grpc.VoiceServerServiceServicer, voice_server_pb2_grpc.VoiceServerServiceStub]):
+                イベントを渡す先のvoice_serverのServicerまたはスタブ
+
+        """
+        self.voice = voice
+        self.in_process = isinstance(
+            voice, voice_server_pb2_grpc.VoiceServerServiceServicer
+        )
+
+    def call(self, name: str, request, context: grpc.ServicerContext) -> bool:
+        method = getattr(self.voice, name)
+        try:
+            if self.in_process:
+                reply = method(request, context)
+            else:
+                reply = method(request)
+        except grpc.RpcError as e:
+            print(f"{name} error: {e}")
+            return False
+        return reply.success
+
+    def StreamVoice(
+        self,
+        request_iterator: Iterator[voice_stream_server_pb2.VoiceEvent],
+        context: grpc.ServicerContext,
+    ) -> Iterator[voice_stream_server_pb2.VoiceEventReply]:
+        # 受付開始を通知する
+        yield voice_stream_server_pb2.VoiceEventReply(seq=0, success=True)
+        for event in request_iterator:
+            kind = event.WhichOneof("event")
+            if kind == "text":
+                success = self.call(
+                    "SetText", voice_server_pb2.SetTextRequest(text=event.text), context
+                )
+            elif kind == "start_head_control":
+                success = self.call(
+                    "StartHeadControl",
+                    voice_server_pb2.StartHeadControlRequest(),
+                    context,
+                )
+            elif kind == "sentence_end":
+                success = self.call(
+                    "SentenceEnd", voice_server_pb2.SentenceEndRequest(), context
+                )
+            elif kind == "interrupt":
+                success = self.call(
+                    "InterruptVoice", voice_server_pb2.InterruptVoiceRequest(), context
+                )
+            else:
+                # 既存のvoice_serverにはリンクを受け取るRPCがないため、受け取ったことだけを通知する
+                success = kind == "link"
+            yield voice_stream_server_pb2.VoiceEventReply(seq=event.seq, success=success)
+
+
+class VoiceServerProxy(voice_server_pb2_grpc.VoiceServerServiceServicer):
+    """既存のvoice_serverのunary RPCをそのまま転送するサーバ。
+
+    StreamVoiceSenderはストリームを使えない場合に同じアドレスへunary RPCで送信するため、
+    別のポートで起動したブリッジでもunary RPCを受け付ける。
+    """
+
+    def __init__(self, stub: voice_server_pb2_grpc.VoiceServerServiceStub) -> None:
+        """コンストラクタ
+
+        Args:
+            stub (voice_server_pb2_grpc.VoiceServerServiceStub): 転送先のvoice_serverのスタブ
+
+        """
+        # VoiceServerServiceの全てのRPCを、同じ名前のスタブのメソッドに転送する
+        for name in dir(voice_server_pb2_grpc.VoiceServerServiceServicer):
+            if not name.startswith("_") and hasattr(stub, name):
+                setattr(self, name, self._forward(name, getattr(stub, name)))
+
+    @staticmethod
+    def _forward(name: str, method: Callable) -> Callable:
+        def forward(request, context: grpc.ServicerContext):
+            try:
+                return method(request)
+            except grpc.RpcError as e:
+                print(f"{name} error: {e.code()}")
+                context.abort(e.code(), e.details() or "")
+
+        return forward
+
+
+def add_voice_stream_bridge(
+    server: grpc.Server,
+    voice: Union[
+        voice_server_pb2_grpc.VoiceServerServiceServicer,
+        voice_server_pb2_grpc.VoiceServerServiceStub,
+    ],
+) -> VoiceStreamBridge:
+    """gRPCサーバにStreamVoiceを追加する。
+
+    既存のvoice_serverと同じサーバに追加すると、同じポートでunary RPCとStreamVoiceの両方を受け付ける。
+
+    Args:
+        server (grpc.Server): 追加するgRPCサーバ
+        voice (Union[voice_server_pb2_grpc.VoiceServerServiceServicer, voice_server_pb2_grpc.VoiceServerServiceStub]):
+            イベントを渡す先のvoice_serverのServicerまたはスタブ
+
+    Returns:
+        VoiceStreamBridge: 追加したサーバ
+    """
+    bridge = VoiceStreamBridge(voice)
+    voice_stream_server_pb2_grpc.add_VoiceStreamServerServiceServicer_to_server(
+        bridge, server
+    )
+    return bridge
+
+
+def add_voice_server_proxy(
+    server: grpc.Server, stub: voice_server_pb2_grpc.VoiceServerServiceStub
+) -> VoiceServerProxy:
+    """gRPCサーバに、既存のvoice_serverへunary RPCを転送するVoiceServerServiceを追加する。
+
+    Args:
+        server (grpc.Server): 追加するgRPCサーバ
+        stub (voice_server_pb2_grpc.VoiceServerServiceStub): 転送先のvoice_serverのスタブ
+
+    Returns:
+        VoiceServerProxy: 追加したサーバ
+    """
+    proxy = VoiceServerProxy(stub)
+    voice_server_pb2_grpc.add_VoiceServerServiceServicer_to_server(proxy, server)
+    return proxy
@@ -1,6 +1,11 @@
 import argparse
+import hashlib
+import json
 import os
+import re
 import urllib.parse
+from concurrent import futures
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
 
 AKARI_DOC_URL = "https://akarigroup.github.io/docs/"
 
@@ -23,98 +28,357 @@ def convert_path_to_public_url(file_path):
 
 
 def convert_parmlink(title: str) -> str:
-    print(f"Title: {title}")
     new_title = title.lower()
     new_title = urllib.parse.quote(new_title)
     return new_title
 
 
-def replace_decorative_lines_for_local_html(path: str, text: str):
-    lines = text.splitlines()
-    result = []
-    for i, line in enumerate(lines):
-        # 特定の装飾記号のみの行を検出
-        if (
-            line.strip()
-            in {
-                "=" * len(line.strip()),
-                "*" * len(line.strip()),
-                "-" * len(line.strip()),
-                "^" * len(line.strip()),
-            }
-            and len(line.strip()) > 0
-        ):
-            # 一つ前の行が存在し、かつ空行でない場合のみ置き換える
-            if i > 0 and lines[i - 1].strip():
-                result.append(
-                    f"file://{convert_path_to_public_url(path)}#{convert_parmlink(lines[i - 1])}"
-                )
-            else:
-                result.append(line)  # 置き換え条件を満たさない場合はそのまま追加
+# 見出しの下線とみなす装飾記号のみの行
+HEADING_LINE_PATTERN = re.compile(r"([=*\-^])\1*")
+
+
+class Section(NamedTuple):
+    """見出しで区切られた節"""
+
+    title: str
+    url: str
+    body: str
+    source: str
+
+
+def iter_lines(path: str, text: str, base_url: str) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    テキストを1行ずつ走査し、見出しの装飾行を表題へのリンクに置き換えた行を返す
+    Args:
+        path (str): テキストファイルのパス
+        text (str): テキスト
+        base_url (str): リンクの先頭に付けるURL
+
+    Yields:
+        Tuple[str, Optional[str]]: (出力する行, 見出しの装飾行だった場合はその表題)
+    """
+    page_url = f"{base_url}{convert_path_to_public_url(path)}"
+    prev_line = ""
+    prev_stripped = ""
+    for line in text.splitlines():
+        stripped = line.strip()
+        # 一つ前の行が空行でない場合のみ、装飾記号のみの行を見出しとみなす
+        if prev_stripped and stripped and HEADING_LINE_PATTERN.fullmatch(stripped):
+            yield f"{page_url}#{convert_parmlink(prev_line)}", prev_line
         else:
-            result.append(line)
-    return "\n".join(result)
+            yield line, None
+        prev_line = line
+        prev_stripped = stripped
+
+
+def iter_sections(path: str, text: str, base_url: str = AKARI_DOC_URL) -> Iterator[Section]:
+    """
+    テキストを見出し毎の節に分割する
+    Args:
+        path (str): テキストファイルのパス
+        text (str): テキスト
+        base_url (str, optional): リンクの先頭に付けるURL。デフォルトはAKARI_DOC_URL。
+
+    Yields:
+        Section: 節。最初の見出しより前の部分は表題が空文字列で、URLはページのURLになる。
+    """
+    title = ""
+    url = f"{base_url}{convert_path_to_public_url(path)}"
+    body: List[str] = []
+    for line, heading in iter_lines(path, text, base_url):
+        if heading is None:
+            body.append(line)
+            continue
+        if not body:
+            # 見出しの下線の直後に続く装飾行は表題ではないため、節を区切らない
+            continue
+        # 表題の行と上線は直前の節の本文に入っているので取り除く
+        body.pop()
+        if body and HEADING_LINE_PATTERN.fullmatch(body[-1].strip()):
+            body.pop()
+        if title or "\n".join(body).strip():
+            yield Section(title, url, "\n".join(body).strip(), path)
+        title = heading.strip()
+        url = line
+        body = []
+    if title or "\n".join(body).strip():
+        yield Section(title, url, "\n".join(body).strip(), path)
+
+
+def replace_decorative_lines_for_local_html(path: str, text: str):
+    return "\n".join(line for line, _ in iter_lines(path, text, "file://"))
 
 
 def replace_decorative_lines_for_public_url(path: str, text: str):
-    lines = text.splitlines()
-    result = []
-    for i, line in enumerate(lines):
-        # 特定の装飾記号のみの行を検出
-        if (
-            line.strip()
-            in {
-                "=" * len(line.strip()),
-                "*" * len(line.strip()),
-                "-" * len(line.strip()),
-                "^" * len(line.strip()),
-            }
-            and len(line.strip()) > 0
-        ):
-            # 一つ前の行が存在し、かつ空行でない場合のみ置き換える
-            if i > 0 and lines[i - 1].strip():
-                result.append(
-                    f"{AKARI_DOC_URL}{convert_path_to_public_url(path)}#{convert_parmlink(lines[i - 1])}"
-                )
-            else:
-                result.append(line)  # 置き換え条件を満たさない場合はそのまま追加
-        else:
-            result.append(line)
-    return "\n".join(result)
+    return "\n".join(line for line, _ in iter_lines(path, text, AKARI_DOC_URL))
+
+
+def render_text(path: str, text: str) -> str:
+    return replace_decorative_lines_for_public_url(path=path, text=text)
+
+
+def render_jsonl(path: str, text: str, source: str) -> str:
+    return "".join(
+        json.dumps(section._replace(source=source)._asdict(), ensure_ascii=False) + "\n"
+        for section in iter_sections(path, text)
+    )
+
+
+def iter_chunks(sections: Iterable[Section], chunk_size: int = 500) -> Iterator[dict]:
+    """
+    節を、節の境界をまたがない一定の文字数以下のチャンクに分割する
+    Args:
+        sections (Iterable[Section]): 節
+        chunk_size (int, optional): 1チャンクの本文の最大文字数。デフォルトは500。
+
+    Yields:
+        dict: {"source", "title", "url", "content"}を持つチャンク。
+            contentの先頭には表題とURLを付け、検索結果だけで回答とリンクが対応するようにする。
+    """
+    for section in sections:
+        header = f"{section.title}\n{section.url}\n" if section.title else f"{section.url}\n"
+        pieces: List[str] = []
+        for paragraph in section.body.split("\n\n"):
+            paragraph = paragraph.strip()
+            # 1段落がchunk_sizeを超える場合は文字数で区切る
+            while len(paragraph) > chunk_size:
+                pieces.append(paragraph[:chunk_size])
+                paragraph = paragraph[chunk_size:]
+            if paragraph:
+                pieces.append(paragraph)
+        if len(pieces) == 0:
+            pieces.append("")
+        body = ""
+        for piece in pieces:
+            if body and len(body) + len(piece) + 2 > chunk_size:
+                yield {
+                    "source": section.source,
+                    "title": section.title,
+                    "url": section.url,
+                    "content": header + body,
+                }
+                body = ""
+            body = f"{body}\n\n{piece}" if body else piece
+        yield {
+            "source": section.source,
+            "title": section.title,
+            "url": section.url,
+            "content": header + body,
+        }
+
+
+def render_chunks(path: str, text: str, source: str, chunk_size: int) -> str:
+    sections = (s._replace(source=source) for s in iter_sections(path, text))
+    return "".join(
+        json.dumps(chunk, ensure_ascii=False) + "\n"
+        for chunk in iter_chunks(sections, chunk_size)
+    )
+
+
+OUTPUT_FORMATS = ["text", "jsonl", "chunks"]
+
+
+def output_path(rel_path: str, output_format: str) -> str:
+    """
+    出力形式に応じた保存先での相対パスを返す
+    Args:
+        rel_path (str): 読み込み元のディレクトリからの相対パス
+        output_format (str): 出力形式
+
+    Returns:
+        str: 保存先での相対パス
+    """
+    if output_format == "jsonl":
+        return os.path.splitext(rel_path)[0] + ".jsonl"
+    if output_format == "chunks":
+        return os.path.splitext(rel_path)[0] + ".chunks.jsonl"
+    return rel_path
+
+
+def convert_file(
+    file_path: str,
+    base_path: str,
+    save_path: Optional[str],
+    output_format: str = "text",
+    chunk_size: int = 500,
+) -> str:
+    """
+    テキストファイルを変換して保存する
+    Args:
+        file_path (str): 変換するファイルのパス
+        base_path (str): 読み込み元のディレクトリ
+        save_path (str, optional): 保存先のディレクトリ。Noneの場合は保存しない。
+        output_format (str, optional): 出力形式。"text"は見出しをリンクに置き換えたテキスト、
+            "jsonl"は1行1節のjson、"chunks"は1行1チャンクのjson。デフォルトは"text"。
+        chunk_size (int, optional): "chunks"の場合の1チャンクの最大文字数。デフォルトは500。
+
+    Returns:
+        str: 読み込み元のディレクトリからの相対パス
+    """
+    with open(file_path, "r", encoding="utf-8") as file:
+        text = file.read()
+    rel_path = os.path.relpath(file_path, base_path)
+    if output_format == "jsonl":
+        output_text = render_jsonl(file_path, text, rel_path)
+    elif output_format == "chunks":
+        output_text = render_chunks(file_path, text, rel_path, chunk_size)
+    else:
+        output_text = render_text(file_path, text)
+    if save_path:
+        path = os.path.join(save_path, output_path(rel_path, output_format))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as save_file:
+            save_file.write(output_text)
+    return rel_path
+
+
+def file_hash(file_path: str) -> str:
+    """
+    ファイル内容のハッシュ値を計算する
+    Args:
+        file_path (str): ファイルのパス
+
+    Returns:
+        str: sha256のハッシュ値
+    """
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(65536), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def load_manifest(path: str) -> dict:
+    """
+    変換済みのソースのハッシュ値と、変換時のオプションを読み込む
+    Args:
+        path (str): マニフェストファイルのパス
+
+    Returns:
+        dict: {"options": 変換時のオプション, "files": {ソースの相対パス: ハッシュ値}}
+    """
+    if not os.path.exists(path):
+        return {"options": None, "files": {}}
+    with open(path, "r", encoding="utf-8") as file:
+        manifest = json.load(file)
+    return {"options": manifest.get("options"), "files": manifest.get("files", {})}
+
+
+def save_json(path: str, data: dict) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(data, file, ensure_ascii=False, indent=2, sort_keys=True)
 
 
 def main() -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument("-p", "--path", type=str, help="path to load text files")
     parser.add_argument("-s", "--save_path", type=str, help="path to save text files")
+    parser.add_argument(
+        "-m",
+        "--manifest",
+        type=str,
+        help="manifest file of source hashes and options. If set, only changed files are converted",
+    )
+    parser.add_argument(
+        "-c", "--changes", type=str, help="path to save change list (json)"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count(), help="number of processes"
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        type=str,
+        default="text",
+        choices=OUTPUT_FORMATS,
+        help="output format",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=500,
+        help="max characters of a chunk body (for --format chunks)",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="print file names")
     args = parser.parse_args()
     file_paths = []
     if args.path is None:
         print("Path is not available")
         return
     if os.path.isdir(args.path):
+        base_path = args.path
         file_paths = [
             os.path.abspath(os.path.join(root, file))
             for root, dirs, files in os.walk(args.path)
             for file in files
         ]
     else:
+        base_path = os.path.dirname(os.path.abspath(args.path))
         file_paths.append(args.path)
-    for file_path in file_paths:
-        print(f"Processing {file_path}")
-        with open(file_path, "r", encoding="utf-8") as file:
-            text = file.read()
-            # 関数を呼び出して結果を出力
-            output_text = replace_decorative_lines_for_public_url(
-                path=file_path, text=text
+    hashes = {
+        os.path.relpath(file_path, base_path): file_hash(file_path)
+        for file_path in file_paths
+    }
+    # 出力形式や保存先が前回と異なる場合は、前回の出力を使えないため全て変換し直す
+    options = {
+        "format": args.format,
+        "chunk_size": args.chunk_size if args.format == "chunks" else None,
+        "save_path": os.path.abspath(args.save_path) if args.save_path else None,
+    }
+    manifest = {"options": options, "files": {}}
+    if args.manifest is not None:
+        manifest = load_manifest(args.manifest)
+        if manifest["files"] and manifest["options"] != options:
+            print("Options differ from the manifest. Convert all files.")
+    converted = manifest["files"]
+    added = sorted(p for p in hashes if p not in converted)
+    modified = sorted(
+        p
+        for p in hashes
+        if p in converted
+        and (converted[p] != hashes[p] or manifest["options"] != options)
+    )
+    deleted = sorted(p for p in converted if p not in hashes)
+    if args.manifest is None:
+        targets = sorted(hashes)
+    else:
+        targets = added + modified
+    with futures.ProcessPoolExecutor(max_workers=max(args.jobs or 1, 1)) as executor:
+        tasks = [
+            executor.submit(
+                convert_file,
+                os.path.join(base_path, rel_path),
+                base_path,
+                args.save_path,
+                args.format,
+                args.chunk_size,
             )
-            if args.save_path:
-                path = os.path.join(
-                    args.save_path, os.path.relpath(file_path, args.path)
-                )
-                os.makedirs(os.path.dirname(path), exist_ok=True)
-                with open(path, "w", encoding="utf-8") as save_file:
-                    save_file.write(output_text)
+            for rel_path in targets
+        ]
+        for task in futures.as_completed(tasks):
+            rel_path = task.result()
+            if args.verbose:
+                print(f"Processed {rel_path}")
+    if args.save_path:
+        for rel_path in deleted:
+            path = os.path.join(args.save_path, output_path(rel_path, args.format))
+            if os.path.exists(path):
+                os.remove(path)
+    print(
+        f"Converted {len(targets)} files "
+        f"(added: {len(added)}, modified: {len(modified)}, deleted: {len(deleted)})"
+    )
+    if args.manifest is not None:
+        # 出力を保存していない場合は、変換済みとして記録しない
+        if args.save_path:
+            save_json(args.manifest, {"options": options, "files": hashes})
+        else:
+            print("Manifest is not saved because --save_path is not set.")
+    if args.changes is not None:
+        save_json(
+            args.changes, {"added": added, "modified": modified, "deleted": deleted}
+        )
 
 
 if __name__ == "__main__":
@@ -1,11 +1,12 @@
 from grpc.tools import protoc
 
-protoc.main(
-    (
-        "",
-        "-I.",
-        "--python_out=../lib/grpc",
-        "--grpc_python_out=../lib/grpc",
-        "streamlit_server.proto",
+for proto in ("streamlit_server.proto", "voice_stream_server.proto"):
+    protoc.main(
+        (
+            "",
+            "-I.",
+            "--python_out=../lib/grpc",
+            "--grpc_python_out=../lib/grpc",
+            proto,
+        )
     )
-)
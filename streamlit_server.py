@@ -1,12 +1,15 @@
 import argparse
-import copy
+import io
 import streamlit as st
 import grpc
 import qrcode
 import os
+import queue
 import sys
 import time
-from typing import Optional
+import zipfile
+from collections import Counter, OrderedDict
+from typing import Iterable, Iterator, List, Optional, Tuple
 from concurrent import futures
 from PIL import Image
 import threading
@@ -24,8 +27,12 @@ sys.path.append(
 import motion_server_pb2
 import motion_server_pb2_grpc
 
+from lib.latency_tracer import LatencyTracer
+from lib.link_sender import find_urls
+
 
 DEFAULT_IMAGE = Image.open("image/talk.jpg")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp", ".svg")
 
 
 def create_qr_code(url: str) -> Image:
@@ -50,6 +57,118 @@ def create_qr_code(url: str) -> Image:
     return qr_image
 
 
+def extract_urls(path: str) -> List[str]:
+    """
+    RAG用データに含まれるURLを抽出する
+    Args:
+        path (str): RAG用データのディレクトリ。txtファイルとzipファイル内のtxtファイルを読み込む。
+
+    Returns:
+        List[str]: 重複を除いたURLのリスト。多くのファイルで参照されているURLほど先に並べる。
+    """
+    urls: "Counter[str]" = Counter()
+    if not os.path.isdir(path):
+        return []
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            file_path = os.path.join(root, file)
+            if file.endswith(".txt"):
+                with open(file_path, "r", encoding="utf-8") as f:
+                    texts = [f.read()]
+            elif file.endswith(".zip"):
+                with zipfile.ZipFile(file_path) as z:
+                    texts = [
+                        z.read(name).decode("utf-8")
+                        for name in z.namelist()
+                        if name.endswith(".txt")
+                    ]
+            else:
+                continue
+            for text in texts:
+                urls.update(set(find_urls(text)))
+    return [url for url, _ in urls.most_common()]
+
+
+class OverlayImageCache(object):
+    """
+    QRコードを合成した画像をURL毎にエンコード済みのバイト列でキャッシュするLRUキャッシュ。
+    ロボット上のメモリを圧迫しないよう、画像の合計サイズで上限を設ける。
+    """
+
+    def __init__(self, base_image: Image, max_bytes: int = 16 * 1024 * 1024) -> None:
+        """コンストラクタ
+        Args:
+            base_image (Image): QRコードを合成する元画像
+            max_bytes (int, optional): キャッシュする画像の合計サイズの上限[byte]。デフォルトは16MB。
+
+        """
+        self.base_image = base_image.convert("RGB")
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _render(self, url: str) -> bytes:
+        qr_image = create_qr_code(url)
+        qr_resized = qr_image.resize((500, 500))
+        overlay_image = self.base_image.copy()
+        overlay_image.paste(qr_resized, (170, 1125))
+        buffer = io.BytesIO()
+        overlay_image.save(buffer, format="JPEG", quality=90)
+        return buffer.getvalue()
+
+    def get(self, url: str) -> bytes:
+        """
+        URLのQRコードを合成した画像を取得する。キャッシュになければ生成する。
+        Args:
+            url (str): QRコードに埋め込むURL
+
+        Returns:
+            bytes: JPEGでエンコードされた画像
+        """
+        with self.lock:
+            image = self.entries.get(url)
+            if image is not None:
+                self.entries.move_to_end(url)
+                return image
+        image = self._render(url)
+        with self.lock:
+            previous = self.entries.pop(url, None)
+            if previous is not None:
+                self.total_bytes -= len(previous)
+            self.entries[url] = image
+            self.total_bytes += len(image)
+            # 最新の画像は上限を超えても残す
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+        return image
+
+    def warm(self, urls: Iterable[str], limit: int) -> None:
+        """
+        URLのリストの先頭から、上限の数かキャッシュのサイズの上限まで画像を事前に生成しておく
+        Args:
+            urls (Iterable[str]): 事前に生成するURLのリスト。表示される可能性が高い順に並べる。
+            limit (int): 事前に生成する最大数
+        """
+        start = time.time()
+        count = 0
+        for url in urls:
+            if count >= limit:
+                break
+            self.get(url)
+            count += 1
+            # 上限に達した後に生成すると、先に生成した候補を追い出してしまうため、
+            # 平均的なサイズの画像がもう1枚入らなければ終える
+            with self.lock:
+                if self.total_bytes * (len(self.entries) + 1) > self.max_bytes * len(self.entries):
+                    break
+        print(
+            f"Overlay image cache warmed: {count} images "
+            f"{self.total_bytes / 1024 / 1024:.1f} [MB] {time.time() - start:.2f} [s]"
+        )
+
+
 def extract_video_id(url: str) -> str:
     """
     YouTubeのURLからビデオIDを抽出する
@@ -68,6 +187,473 @@ def extract_video_id(url: str) -> str:
     return video_id
 
 
+def guess_content_type(url: str) -> int:
+    """
+    URLから表示するコンテンツの種類を判定する
+    Args:
+        url (str): URL
+
+    Returns:
+        int: streamlit_server_pb2.ContentType
+    """
+    if "youtube.com" in url or "youtu.be" in url:
+        return streamlit_server_pb2.CONTENT_TYPE_YOUTUBE
+    if url.split("?")[0].lower().endswith(IMAGE_EXTENSIONS):
+        return streamlit_server_pb2.CONTENT_TYPE_IMAGE
+    return streamlit_server_pb2.CONTENT_TYPE_PAGE
+
+
+class UrlChannel(object):
+    """
+    gRPCサーバのスレッドから描画ループへ表示コマンドを通知し、描画ループからWatchDisplayの購読者へイベントを配信するチャンネル
+    """
+
+    def __init__(self, priority_hold: float = 10.0, max_queued_events: int = 100) -> None:
+        """コンストラクタ
+        Args:
+            priority_hold (float, optional): 優先度の高いコマンドを受信してからこの時間[s]は、優先度の低いコマンドで表示を切り替えない。デフォルトは10.0。
+            max_queued_events (int, optional): 購読者毎に保持するイベントの最大数。超えた場合は古いイベントを捨てる。デフォルトは100。
+
+        """
+        self.condition = threading.Condition()
+        self.url = ""
+        self.command = streamlit_server_pb2.DisplayCommand()
+        self.version = 0
+        self.received_time = 0.0
+        self.candidates: List[streamlit_server_pb2.PreloadCandidate] = []
+        self.preload_version = 0
+        self.preload_time = 0.0
+        self.priority_hold = priority_hold
+        self.max_queued_events = max_queued_events
+        self.watchers_lock = threading.Lock()
+        self.watchers: "List[queue.Queue[Optional[streamlit_server_pb2.DisplayEvent]]]" = []
+
+    def put(
+        self, url: str, command: Optional[streamlit_server_pb2.DisplayCommand] = None
+    ) -> Optional[streamlit_server_pb2.DisplayCommand]:
+        """
+        表示するURLを更新し、待機中の描画ループを起こす。
+        表示中のコマンドより優先度が低く、表示中のコマンドの受信からpriority_hold秒以内の場合は更新しない。
+        Args:
+            url (str): 表示するURL
+            command (streamlit_server_pb2.DisplayCommand, optional): 表示コマンド。Noneの場合はurlのみを指定したコマンドとする。
+
+        Returns:
+            streamlit_server_pb2.DisplayCommand: 受け付けたコマンド。command_idとcontent_typeは補完済み。更新しなかった場合はNone。
+        """
+        accepted = streamlit_server_pb2.DisplayCommand()
+        if command is not None:
+            accepted.CopyFrom(command)
+        accepted.url = url
+        if accepted.content_type == streamlit_server_pb2.CONTENT_TYPE_UNSPECIFIED:
+            accepted.content_type = guess_content_type(url)
+        with self.condition:
+            now = time.time()
+            if (
+                accepted.priority < self.command.priority
+                and now - self.received_time < self.priority_hold
+            ):
+                return None
+            self.version += 1
+            if accepted.command_id == "":
+                accepted.command_id = str(self.version)
+            self.url = url
+            self.command = accepted
+            self.received_time = now
+            self.condition.notify_all()
+        return accepted
+
+    def wait(self, version: int, timeout: Optional[float] = None) -> Tuple[int, str, float]:
+        """
+        URLが更新されるか、タイムアウトするまで待機する
+        Args:
+            version (int): 描画済みのURLのバージョン
+            timeout (float, optional): タイムアウト時間[s]。Noneの場合は更新されるまで待機する。
+
+        Returns:
+            Tuple[int, str, float]: (バージョン, URL, 受信時刻)。タイムアウト時は引数のバージョンがそのまま返る。
+        """
+        version, command, received_time = self.wait_command(version, timeout)
+        return version, command.url, received_time
+
+    def wait_command(
+        self, version: int, timeout: Optional[float] = None
+    ) -> Tuple[int, streamlit_server_pb2.DisplayCommand, float]:
+        """
+        表示コマンドが更新されるか、タイムアウトするまで待機する
+        Args:
+            version (int): 描画済みのコマンドのバージョン
+            timeout (float, optional): タイムアウト時間[s]。Noneの場合は更新されるまで待機する。
+
+        Returns:
+            Tuple[int, streamlit_server_pb2.DisplayCommand, float]: (バージョン, 表示コマンド, 受信時刻)。
+                タイムアウト時は引数のバージョンがそのまま返る。
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout=timeout)
+            return self.version, self.command, self.received_time
+
+    def preload(self, candidates: List[streamlit_server_pb2.PreloadCandidate]) -> None:
+        """
+        先読みする候補を更新し、待機中の描画ループを起こす
+        Args:
+            candidates (List[streamlit_server_pb2.PreloadCandidate]): 先読みする候補
+        """
+        with self.condition:
+            self.candidates = list(candidates)
+            self.preload_version += 1
+            self.preload_time = time.time()
+            self.condition.notify_all()
+
+    def wait_update(
+        self, version: int, preload_version: int, timeout: Optional[float] = None
+    ) -> Tuple[
+        int,
+        streamlit_server_pb2.DisplayCommand,
+        float,
+        int,
+        List[streamlit_server_pb2.PreloadCandidate],
+        float,
+    ]:
+        """
+        表示コマンドか先読みする候補が更新されるか、タイムアウトするまで待機する
+        Args:
+            version (int): 描画済みのコマンドのバージョン
+            preload_version (int): 先読み済みの候補のバージョン
+            timeout (float, optional): タイムアウト時間[s]。Noneの場合は更新されるまで待機する。
+
+        Returns:
+            Tuple[int, streamlit_server_pb2.DisplayCommand, float, int, List[streamlit_server_pb2.PreloadCandidate], float]:
+                (バージョン, 表示コマンド, 受信時刻, 候補のバージョン, 候補, 候補の受信時刻)。
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.version != version
+                or self.preload_version != preload_version,
+                timeout=timeout,
+            )
+            return (
+                self.version,
+                self.command,
+                self.received_time,
+                self.preload_version,
+                self.candidates,
+                self.preload_time,
+            )
+
+    def publish(
+        self,
+        event_type: int,
+        command: streamlit_server_pb2.DisplayCommand,
+        received_time: float,
+        preloaded: bool = False,
+    ) -> None:
+        """
+        全ての購読者にイベントを配信する
+        Args:
+            event_type (int): streamlit_server_pb2.DisplayEvent.EventType
+            command (streamlit_server_pb2.DisplayCommand): イベントの対象の表示コマンド
+            received_time (float): コマンドを受信した時刻
+            preloaded (bool, optional): 先読み済みのiframeを表示したか。デフォルトはFalse。
+        """
+        event = streamlit_server_pb2.DisplayEvent(
+            type=event_type,
+            command_id=command.command_id,
+            url=command.url,
+            content_type=command.content_type,
+            received_time=received_time,
+            event_time=time.time(),
+            preloaded=preloaded,
+        )
+        with self.watchers_lock:
+            watchers = list(self.watchers)
+        for watcher in watchers:
+            self._offer(watcher, event)
+
+    @staticmethod
+    def _offer(
+        watcher: "queue.Queue[Optional[streamlit_server_pb2.DisplayEvent]]",
+        event: Optional[streamlit_server_pb2.DisplayEvent],
+    ) -> None:
+        # キューが一杯の場合は古いイベントを捨てる
+        while True:
+            try:
+                watcher.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    watcher.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def subscribe(self) -> "queue.Queue[Optional[streamlit_server_pb2.DisplayEvent]]":
+        """
+        イベントの購読を開始する
+        Returns:
+            queue.Queue[Optional[streamlit_server_pb2.DisplayEvent]]: イベントが届くキュー
+        """
+        watcher: "queue.Queue[Optional[streamlit_server_pb2.DisplayEvent]]" = queue.Queue(
+            maxsize=self.max_queued_events
+        )
+        with self.watchers_lock:
+            self.watchers.append(watcher)
+        return watcher
+
+    def unsubscribe(
+        self, watcher: "queue.Queue[Optional[streamlit_server_pb2.DisplayEvent]]"
+    ) -> None:
+        """
+        イベントの購読を終了し、キューを待っている購読者を起こす
+        Args:
+            watcher (queue.Queue[Optional[streamlit_server_pb2.DisplayEvent]]): subscribeで取得したキュー
+        """
+        with self.watchers_lock:
+            if watcher in self.watchers:
+                self.watchers.remove(watcher)
+        self._offer(watcher, None)
+
+
+# 1枠のiframeが使うブラウザのメモリの目安[MB]
+FRAME_MEMORY_MB = {
+    streamlit_server_pb2.CONTENT_TYPE_YOUTUBE: 150.0,
+    streamlit_server_pb2.CONTENT_TYPE_PAGE: 100.0,
+    streamlit_server_pb2.CONTENT_TYPE_IMAGE: 20.0,
+}
+FRAME_WIDTH = 1520
+FRAME_HEIGHT = 855
+
+
+class FrameEntry(object):
+    """
+    iframeプールの1枠に読み込んだコンテンツ
+    """
+
+    def __init__(self, url: str, content_type: int, start_time: float = 0.0) -> None:
+        self.url = url
+        self.content_type = content_type
+        self.start_time = start_time
+        self.visible = False
+        self.last_used = 0.0
+
+    @property
+    def memory_mb(self) -> float:
+        return FRAME_MEMORY_MB.get(
+            self.content_type, FRAME_MEMORY_MB[streamlit_server_pb2.CONTENT_TYPE_PAGE]
+        )
+
+    def src(self) -> str:
+        """
+        iframeに読み込むURLを返す。YouTube動画は表示中のみ自動再生する。
+        Returns:
+            str: URL
+        """
+        if self.content_type != streamlit_server_pb2.CONTENT_TYPE_YOUTUBE:
+            return self.url
+        try:
+            video_id = extract_video_id(self.url)
+        except ValueError:
+            return self.url
+        src = f"https://www.youtube.com/embed/{video_id}?mute=1"
+        if self.visible:
+            src += "&autoplay=1"
+        if self.start_time > 0:
+            src += f"&start={int(self.start_time)}"
+        return src
+
+
+def frame_html(index: int, entry: FrameEntry) -> str:
+    """
+    iframeプールの1枠のHTMLを生成する
+    Args:
+        index (int): 枠の番号
+        entry (FrameEntry): 枠に読み込むコンテンツ
+
+    Returns:
+        str: HTML
+    """
+    if entry.content_type == streamlit_server_pb2.CONTENT_TYPE_IMAGE:
+        content = (
+            f'<img src="{entry.src()}" '
+            f'style="max-width: {FRAME_WIDTH}px; max-height: {FRAME_HEIGHT}px;">'
+        )
+    else:
+        content = (
+            f'<iframe src="{entry.src()}" loading="eager" allow="autoplay; encrypted-media" '
+            f'style="width: {FRAME_WIDTH}px; height: {FRAME_HEIGHT}px; overflow: auto; display: block; border: none;"></iframe>'
+        )
+    return f'<div class="akari-frame akari-frame-{index}">{content}</div>'
+
+
+def visibility_html(index: Optional[int]) -> str:
+    """
+    指定した枠のみを表示し、他の枠を画面外に置くスタイルを生成する。
+    display: noneにすると読み込みやレイアウトが遅れるページがあるため、画面外に同じ大きさで配置する。
+    Args:
+        index (int, optional): 表示する枠の番号。Noneの場合は全て画面外に置く。
+
+    Returns:
+        str: HTML
+    """
+    style = ".akari-frame { position: absolute; left: -10000px; top: 0; }"
+    if index is not None:
+        style += f" .akari-frame-{index} {{ position: static; }}"
+    return f"<style>{style}</style>"
+
+
+class IframePool(object):
+    """
+    表示される可能性がある候補を画面外のiframeに先読みしておき、表示するURLの枠を切り替えるプール。
+
+    枠の数とブラウザのメモリの目安の合計で上限を設け、超える場合は表示中の枠以外を最後に使った時刻が古い順に追い出す。
+    表示を切り替えた時は、読み込み直しが必要な枠のみを返す。先読み済みのページや画像は読み込み直さずに表示できる。
+    YouTube動画は非表示の間は自動再生しないため、表示時に自動再生のURLで読み込み直す。
+    """
+
+    def __init__(self, size: int = 4, memory_limit_mb: float = 512.0) -> None:
+        """コンストラクタ
+        Args:
+            size (int, optional): 表示中の枠を含む枠の数。1の場合は先読みしない。デフォルトは4。
+            memory_limit_mb (float, optional): 枠に読み込むコンテンツのメモリの目安の合計の上限[MB]。
+                表示するコンテンツは上限を超えても読み込む。デフォルトは512.0。
+
+        """
+        self.slots: List[Optional[FrameEntry]] = [None] * max(size, 1)
+        self.memory_limit_mb = memory_limit_mb
+        self.visible_slot: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def memory_mb(self) -> float:
+        return sum(entry.memory_mb for entry in self.slots if entry is not None)
+
+    def find(self, url: str) -> Optional[int]:
+        """
+        URLを読み込んだ枠を探す
+        Args:
+            url (str): URL
+
+        Returns:
+            int: 枠の番号。見つからない場合はNone。
+        """
+        for index, entry in enumerate(self.slots):
+            if entry is not None and entry.url == url:
+                return index
+        return None
+
+    def _allocate(self, memory_mb: float, required: bool) -> Optional[int]:
+        """
+        新しいコンテンツを読み込む枠を返す。空きがない場合やメモリの上限を超える場合は、表示中以外の枠を古い順に追い出す。
+        Args:
+            memory_mb (float): 読み込むコンテンツのメモリの目安[MB]
+            required (bool): 表示するコンテンツか。Trueの場合は全て追い出しても上限を超える場合も枠を返す。
+
+        Returns:
+            int: 枠の番号。先読みで上限を超える場合はNone。
+        """
+        while True:
+            free = [i for i, entry in enumerate(self.slots) if entry is None]
+            if len(free) > 0 and self.memory_mb + memory_mb <= self.memory_limit_mb:
+                return free[0]
+            victims = [
+                i
+                for i, entry in enumerate(self.slots)
+                if entry is not None and i != self.visible_slot
+            ]
+            if len(victims) == 0:
+                return free[0] if required and len(free) > 0 else None
+            victim = min(victims, key=lambda i: self.slots[i].last_used)
+            self.slots[victim] = None
+            self.evictions += 1
+
+    def preload(
+        self, candidates: Iterable[streamlit_server_pb2.PreloadCandidate]
+    ) -> List[int]:
+        """
+        候補を画面外の枠に読み込む。
+        表示中の枠を除いた枠の数とメモリの上限に収まるだけ、スコアの高い順に候補を選ぶ。
+        選んだ候補は読み込み済みのものも含めて最後に使ったことにし、選ばなかった枠から追い出す。
+        Args:
+            candidates (Iterable[streamlit_server_pb2.PreloadCandidate]): 先読みする候補
+
+        Returns:
+            List[int]: 読み込み直しが必要な枠の番号のリスト
+        """
+        budget = self.memory_limit_mb
+        if self.visible_slot is not None:
+            budget -= self.slots[self.visible_slot].memory_mb
+        selected = []
+        for candidate in sorted(candidates, key=lambda c: c.score, reverse=True):
+            if len(selected) >= len(self.slots) - 1:
+                break
+            index = self.find(candidate.url)
+            if index is not None and index == self.visible_slot:
+                continue
+            entry = FrameEntry(candidate.url, candidate.content_type)
+            if entry.memory_mb > budget:
+                continue
+            budget -= entry.memory_mb
+            selected.append((index, entry))
+        now = time.time()
+        # スコアの高い候補ほど後に使ったことにする
+        for order, (index, entry) in enumerate(reversed(selected)):
+            used_time = now + order * 1e-6
+            if index is not None:
+                self.slots[index].last_used = used_time
+            entry.last_used = used_time
+        changed = []
+        for index, entry in reversed(selected):
+            if index is not None:
+                continue
+            index = self._allocate(entry.memory_mb, required=False)
+            if index is None:
+                continue
+            self.slots[index] = entry
+            changed.append(index)
+        return changed
+
+    def show(self, command: streamlit_server_pb2.DisplayCommand) -> Tuple[int, List[int], bool]:
+        """
+        表示コマンドのURLの枠を表示する。先読みしていなければ新しい枠に読み込む。
+        Args:
+            command (streamlit_server_pb2.DisplayCommand): 表示コマンド
+
+        Returns:
+            Tuple[int, List[int], bool]: (表示する枠の番号, 読み込み直しが必要な枠の番号のリスト, 先読み済みだったか)
+        """
+        changed = []
+        previous = self.visible_slot
+        index = self.find(command.url)
+        preloaded = index is not None
+        if previous is not None and previous != index:
+            entry = self.slots[previous]
+            entry.visible = False
+            # 再生中の動画を止めるため、自動再生しないURLで読み込み直す
+            if entry.content_type == streamlit_server_pb2.CONTENT_TYPE_YOUTUBE:
+                changed.append(previous)
+        if index is None:
+            self.misses += 1
+            self.visible_slot = None
+            entry = FrameEntry(command.url, command.content_type, command.start_time)
+            index = self._allocate(entry.memory_mb, required=True)
+            self.slots[index] = entry
+            changed.append(index)
+        else:
+            self.hits += 1
+            entry = self.slots[index]
+            if (
+                entry.content_type == streamlit_server_pb2.CONTENT_TYPE_YOUTUBE
+                or entry.start_time != command.start_time
+            ):
+                entry.start_time = command.start_time
+                changed.append(index)
+        entry.visible = True
+        entry.last_used = time.time()
+        self.visible_slot = index
+        return index, sorted(set(changed)), preloaded
+
+
 class StreamlitServer(streamlit_server_pb2_grpc.StreamlitServerServiceServicer):
     """
     StreamlitにURLを送信するgRPCサーバ
@@ -75,20 +661,29 @@ class StreamlitServer(streamlit_server_pb2_grpc.StreamlitServerServiceServicer):
 
     def __init__(
         self,
-        cur_url: list,
+        url_channel: UrlChannel,
         display_pos: Optional[str] = None,
         motion_host: Optional[str] = "127.0.0.1",
         motion_port: Optional[str] = "50055",
+        tracer: Optional[LatencyTracer] = None,
+        overlay_cache: Optional[OverlayImageCache] = None,
+        max_preload: int = 8,
     ):
         """コンストラクタ
         Args:
-            cur_url (list): URLを格納するリスト
+            url_channel (UrlChannel): 受信したURLを描画ループに通知するチャンネル
             display_pos (str, optional): AKARIから見たディスプレイの左右位置。この方向を向く。有効な値は"right"もしくは"left"。デフォルトはNone。
             motion_host (str, optional): モーションサーバーのホスト名。デフォルトは"127.0.0.1"。
             motion_port (str, optional): モーションサーバーのポート番号。デフォルトは"50055"。
+            tracer (LatencyTracer, optional): 処理時間を記録するトレーサ。デフォルトはNone。
+            overlay_cache (OverlayImageCache, optional): Preloadで候補のQRコード画像を先に生成するキャッシュ。デフォルトはNone。
+            max_preload (int, optional): 1回のPreloadで先読みする候補の最大数。デフォルトは8。
 
         """
-        self.cur_url = cur_url
+        self.url_channel = url_channel
+        self.overlay_cache = overlay_cache
+        self.max_preload = max_preload
+        self.tracer = tracer if tracer is not None else LatencyTracer()
         self.display_pos = display_pos
         print(f"display_pos: {self.display_pos}")
         motion_channel = grpc.insecure_channel(motion_host + ":" + motion_port)
@@ -96,23 +691,27 @@ class StreamlitServer(streamlit_server_pb2_grpc.StreamlitServerServiceServicer):
             motion_channel
         )
 
-    def SendUrl(
-        self,
-        request: streamlit_server_pb2.SendUrlRequest,
-        context: grpc.ServicerContext,
-    ) -> streamlit_server_pb2.SendUrlReply:
+    def show(self, command: streamlit_server_pb2.DisplayCommand) -> Optional[str]:
         """
-        URLを受け取り、Streamlitに送信する
+        表示コマンドを描画ループに渡し、ディスプレイの方向を向く
         Args:
-            request (streamlit_server_pb2.SendUrlRequest): URLを格納したリクエスト
-            context (grpc.ServicerContext): コンテキスト
+            command (streamlit_server_pb2.DisplayCommand): 表示コマンド
 
         Returns:
-            streamlit_server_pb2.SendUrlReply: レスポンス
-
+            str: 受け付けたコマンドのID。優先度が低いため受け付けなかった場合やモーションの送信に失敗した場合はNone。
         """
-        self.cur_url[0] = request.url
-        print(f"URL received: {self.cur_url}")
+        trace = self.tracer.start_trace("send_url", url=command.url)
+        accepted = self.url_channel.put(command.url, command)
+        if accepted is None:
+            print(f"URL ignored by priority: {command.url}")
+            trace.end(success=False)
+            return None
+        self.url_channel.publish(
+            streamlit_server_pb2.DisplayEvent.EVENT_TYPE_RECEIVED,
+            accepted,
+            self.url_channel.received_time,
+        )
+        print(f"URL received: {command.url}")
         motion = None
         if self.display_pos == "right":
             motion = "lookright"
@@ -121,15 +720,113 @@ class StreamlitServer(streamlit_server_pb2_grpc.StreamlitServerServiceServicer):
         if motion is not None:
             try:
                 print(f"setMotion: {motion}")
-                self.motion_stub.SetMotion(
-                    motion_server_pb2.SetMotionRequest(
-                        name=motion, priority=3, repeat=False, clear=True
+                with trace.span("set_motion", motion=motion):
+                    self.motion_stub.SetMotion(
+                        motion_server_pb2.SetMotionRequest(
+                            name=motion, priority=3, repeat=False, clear=True
+                        )
                     )
-                )
             except BaseException:
                 print("setMotion error!")
-                return False
-        return streamlit_server_pb2.SendUrlReply(success=True)
+                trace.end(success=False)
+                return None
+        trace.end(success=True)
+        return accepted.command_id
+
+    def SendUrl(
+        self,
+        request: streamlit_server_pb2.SendUrlRequest,
+        context: grpc.ServicerContext,
+    ) -> streamlit_server_pb2.SendUrlReply:
+        """
+        URLを受け取り、Streamlitに送信する
+        Args:
+            request (streamlit_server_pb2.SendUrlRequest): URLを格納したリクエスト
+            context (grpc.ServicerContext): コンテキスト
+
+        Returns:
+            streamlit_server_pb2.SendUrlReply: レスポンス
+
+        """
+        command_id = self.show(streamlit_server_pb2.DisplayCommand(url=request.url))
+        return streamlit_server_pb2.SendUrlReply(success=command_id is not None)
+
+    def Display(
+        self,
+        request: streamlit_server_pb2.DisplayRequest,
+        context: grpc.ServicerContext,
+    ) -> streamlit_server_pb2.DisplayReply:
+        """
+        種類や優先度を指定した表示コマンドを受け取り、Streamlitに送信する
+        Args:
+            request (streamlit_server_pb2.DisplayRequest): 表示コマンドを格納したリクエスト
+            context (grpc.ServicerContext): コンテキスト
+
+        Returns:
+            streamlit_server_pb2.DisplayReply: 受け付けたコマンドのIDを格納したレスポンス
+
+        """
+        command_id = self.show(request.command)
+        return streamlit_server_pb2.DisplayReply(
+            success=command_id is not None, command_id=command_id or ""
+        )
+
+    def Preload(
+        self,
+        request: streamlit_server_pb2.PreloadRequest,
+        context: grpc.ServicerContext,
+    ) -> streamlit_server_pb2.PreloadReply:
+        """
+        表示される可能性がある候補を受け取り、バックグラウンドで先読みする
+        Args:
+            request (streamlit_server_pb2.PreloadRequest): 候補を格納したリクエスト
+            context (grpc.ServicerContext): コンテキスト
+
+        Returns:
+            streamlit_server_pb2.PreloadReply: 受け付けた候補の数を格納したレスポンス
+
+        """
+        candidates = sorted(request.candidates, key=lambda c: c.score, reverse=True)
+        candidates = [c for c in candidates if c.url != ""][: self.max_preload]
+        threading.Thread(target=self.preload, args=(candidates,), daemon=True).start()
+        return streamlit_server_pb2.PreloadReply(accepted=len(candidates))
+
+    def preload(self, candidates: List[streamlit_server_pb2.PreloadCandidate]) -> None:
+        """
+        候補のQRコード画像を生成し、描画ループに候補のiframeの先読みを依頼する
+        Args:
+            candidates (List[streamlit_server_pb2.PreloadCandidate]): 先読みする候補
+        """
+        for candidate in candidates:
+            if candidate.content_type == streamlit_server_pb2.CONTENT_TYPE_UNSPECIFIED:
+                candidate.content_type = guess_content_type(candidate.url)
+        self.url_channel.preload(candidates)
+        if self.overlay_cache is not None:
+            for candidate in candidates:
+                self.overlay_cache.get(candidate.url)
+
+    def WatchDisplay(
+        self,
+        request: streamlit_server_pb2.WatchDisplayRequest,
+        context: grpc.ServicerContext,
+    ) -> Iterator[streamlit_server_pb2.DisplayEvent]:
+        """
+        表示コマンドの受付、描画完了、先読み完了のイベントを、クライアントが切断するまで送信する
+        Args:
+            request (streamlit_server_pb2.WatchDisplayRequest): リクエスト
+            context (grpc.ServicerContext): コンテキスト
+
+        Yields:
+            streamlit_server_pb2.DisplayEvent: イベント
+
+        """
+        watcher = self.url_channel.subscribe()
+        context.add_callback(lambda: self.url_channel.unsubscribe(watcher))
+        while True:
+            event = watcher.get()
+            if event is None:
+                return
+            yield event
 
 
 class Worker(threading.Thread):
@@ -138,16 +835,24 @@ class Worker(threading.Thread):
         display_pos: Optional[str] = None,
         motion_host: Optional[str] = "127.0.0.1",
         motion_port: Optional[str] = "50055",
+        tracer: Optional[LatencyTracer] = None,
+        overlay_cache: Optional[OverlayImageCache] = None,
+        priority_hold: float = 10.0,
     ):
         """コンストラクタ
         Args:
             display_pos (str, optional): AKARIから見たディスプレイの左右位置。この方向を向く。有効な値は"right"もしくは"left"。デフォルトはNone。
             motion_host (str, optional): モーションサーバーのホスト名。デフォルトは"127.0.0.1"。
             motion_port (str, optional): モーションサーバーのポート番号。デフォルトは"50055"。
+            tracer (LatencyTracer, optional): 処理時間を記録するトレーサ。デフォルトはNone。
+            overlay_cache (OverlayImageCache, optional): Preloadで候補のQRコード画像を先に生成するキャッシュ。デフォルトはNone。
+            priority_hold (float, optional): 優先度の高いコマンドを受信してからこの時間[s]は、優先度の低いコマンドで表示を切り替えない。デフォルトは10.0。
 
         """
         super().__init__()
-        self.cur_url = [""]
+        self.url_channel = UrlChannel(priority_hold=priority_hold)
+        self.overlay_cache = overlay_cache
+        self.tracer = tracer if tracer is not None else LatencyTracer()
         self.display_pos = display_pos
         self.motion_host = motion_host
         self.motion_port = motion_port
@@ -159,10 +864,12 @@ class Worker(threading.Thread):
         server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
         streamlit_server_pb2_grpc.add_StreamlitServerServiceServicer_to_server(
             StreamlitServer(
-                cur_url=self.cur_url,
+                url_channel=self.url_channel,
                 display_pos=self.display_pos,
                 motion_host=self.motion_host,
                 motion_port=self.motion_port,
+                tracer=self.tracer,
+                overlay_cache=self.overlay_cache,
             ),
             server,
         )
@@ -182,6 +889,47 @@ def main():
         "--robot_port", help="Robot port number", default="50055", type=str
     )
     parser.add_argument("--display_pos", help="Display position from AKARI", type=str)
+    parser.add_argument(
+        "--rag_data",
+        help="RAG data path to collect URLs for pre-rendering QR code images",
+        default="rag_data/",
+        type=str,
+    )
+    parser.add_argument(
+        "--overlay_cache_mb",
+        help="Max total size of cached QR code images [MB]",
+        default=16.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--overlay_warm",
+        help="Number of URLs most referenced in the RAG data to pre-render QR code images for",
+        default=32,
+        type=int,
+    )
+    parser.add_argument(
+        "--trace",
+        help="JSONL file path to write latency spans. Disabled if not set",
+        type=str,
+    )
+    parser.add_argument(
+        "--priority_hold",
+        help="Seconds to keep a higher priority display command against lower priority ones",
+        default=10.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--frame_pool_size",
+        help="Number of iframes including the visible one. Candidates are preloaded into hidden ones. 1 disables preloading",
+        default=4,
+        type=int,
+    )
+    parser.add_argument(
+        "--frame_pool_memory",
+        help="Estimated browser memory limit [MB] for the iframes",
+        default=512.0,
+        type=float,
+    )
     args = parser.parse_args()
     motion_host = args.robot_ip
     motion_port = args.robot_port
@@ -189,69 +937,131 @@ def main():
     if args.display_pos == "right" or args.display_pos == "left":
         display_pos = args.display_pos
         print(f"args display_pos: {display_pos}")
+    UPDATE_INTERVAL = 100
+    DEFAULT_URL = "https://www.youtube.com/watch?v=hufXSDTFMVo&t=1s"
+    # QRコード合成画像のキャッシュを作成し、RAG用データ内で多く参照されているURLで事前に生成しておく（初回のみ）
+    if "overlay_cache" not in st.session_state:
+        st.session_state.overlay_cache = OverlayImageCache(
+            DEFAULT_IMAGE, max_bytes=int(args.overlay_cache_mb * 1024 * 1024)
+        )
+        threading.Thread(
+            target=st.session_state.overlay_cache.warm,
+            args=([DEFAULT_URL] + extract_urls(args.rag_data), args.overlay_warm),
+            daemon=True,
+        ).start()
+    overlay_cache = st.session_state.overlay_cache
     # URLレシーバースレッドの開始（初回のみ）
     if "worker" not in st.session_state:
         st.session_state.worker = Worker(
-            display_pos=display_pos, motion_host=motion_host, motion_port=motion_port
+            display_pos=display_pos,
+            motion_host=motion_host,
+            motion_port=motion_port,
+            tracer=LatencyTracer(path=args.trace, service="streamlit_server"),
+            overlay_cache=overlay_cache,
+            priority_hold=args.priority_hold,
         )
         st.session_state.worker.start()
 
     st.set_page_config(layout="wide")
     # 2列のレイアウトを作成
     left_col, right_col = st.columns([0.9, 0.1])
-    left_placeholder = left_col.empty()  # 動的更新用のプレースホルダー
+    # 表示する枠を切り替えるスタイルと、iframeプールの枠毎のプレースホルダー
+    style_placeholder = left_col.empty()
+    frame_pool = IframePool(size=args.frame_pool_size, memory_limit_mb=args.frame_pool_memory)
+    frame_placeholders = [left_col.empty() for _ in frame_pool.slots]
     right_placeholder = right_col.empty()  # 動的更新用のプレースホルダー
+
+    def render_frames(indices: Iterable[int]) -> None:
+        for index in indices:
+            entry = frame_pool.slots[index]
+            if entry is None:
+                frame_placeholders[index].empty()
+            else:
+                frame_placeholders[index].markdown(
+                    frame_html(index, entry), unsafe_allow_html=True
+                )
+
+    url_channel = st.session_state.worker.url_channel
+    url_channel.put(DEFAULT_URL)
+    version = 0
+    preload_version = 0
     prev_url = ""
     last_updated_time = time.time()
-    UPDATE_INTERVAL = 100
-    DEFAULT_URL = "https://www.youtube.com/watch?v=hufXSDTFMVo&t=1s"
-    st.session_state.worker.cur_url[0] = DEFAULT_URL
+    style_placeholder.markdown(visibility_html(None), unsafe_allow_html=True)
     with right_placeholder:
         st.image(DEFAULT_IMAGE)
     while True:
-        if st.session_state.worker.cur_url[0] == "":
-            st.session_state.worker.cur_url[0] = DEFAULT_URL
-            last_updated_time = time.time()
-        if time.time() - last_updated_time > UPDATE_INTERVAL:
-            st.session_state.worker.cur_url[0] = ""
-        if st.session_state.worker.cur_url[0] != prev_url:
-            prev_url = st.session_state.worker.cur_url[0]
+        # 新しいURLか先読みの候補を受信するまでブロックし、UPDATE_INTERVALの間更新がなければデフォルトに戻す
+        remaining_time = UPDATE_INTERVAL - (time.time() - last_updated_time)
+        (
+            new_version,
+            command,
+            received_time,
+            new_preload_version,
+            candidates,
+            preload_time,
+        ) = url_channel.wait_update(
+            version, preload_version, timeout=max(remaining_time, 0.0)
+        )
+        if new_preload_version != preload_version:
+            preload_version = new_preload_version
+            # 候補を画面外の枠に読み込む
+            changed = frame_pool.preload(candidates)
+            render_frames(changed)
+            for index in changed:
+                entry = frame_pool.slots[index]
+                url_channel.publish(
+                    streamlit_server_pb2.DisplayEvent.EVENT_TYPE_PRELOADED,
+                    streamlit_server_pb2.DisplayCommand(
+                        url=entry.url, content_type=entry.content_type
+                    ),
+                    preload_time,
+                )
+            if new_version == version:
+                continue
+        if new_version == version:
             last_updated_time = time.time()
-            with left_placeholder:
-                if "worker" in st.session_state:
-                    play_youtube = False
-                    # YouTube動画なら自動再生する。
-                    if (
-                        "youtube.com" in st.session_state.worker.cur_url[0]
-                        or "youtu.be" in st.session_state.worker.cur_url[0]
-                    ):
-                        try:
-                            video_id = extract_video_id(
-                                st.session_state.worker.cur_url[0]
-                            )  # ビデオID抽出用関数に切り出す
-                            embed_url = f"https://www.youtube.com/embed/{video_id}?autoplay=1&mute=1"
-                            st.components.v1.iframe(embed_url, width=1520, height=855)
-                            play_youtube = True
-                        except BaseException:
-                            pass
-                    # それ以外ならURLをそのまま表示
-                    if not play_youtube:
-                        st.markdown(
-                            f'<iframe src="{st.session_state.worker.cur_url[0]}" '
-                            f'style="width: 1520px; height: 855px; overflow: auto; display: block;"></iframe>',
-                            unsafe_allow_html=True,
-                        )
-            with right_placeholder:
-                # QRコードを表示（上部）
-                if "worker" in st.session_state and st.session_state.worker.cur_url[0]:
-                    qr_image = create_qr_code(st.session_state.worker.cur_url[0])
-                    qr_resized = qr_image.resize((500, 500))
-                    overlay_image = copy.deepcopy(DEFAULT_IMAGE)
-                    overlay_image.paste(qr_resized, (170, 1125))
-                    st.image(overlay_image)
-                else:
-                    st.image(DEFAULT_IMAGE)
-        time.sleep(0.1)
+            url_channel.put(DEFAULT_URL)
+            continue
+        version = new_version
+        cur_url = command.url
+        if cur_url == "":
+            url_channel.put(DEFAULT_URL)
+            continue
+        if cur_url == prev_url and command.start_time == 0.0:
+            # 表示済みのため、描画完了のみ通知する
+            url_channel.publish(
+                streamlit_server_pb2.DisplayEvent.EVENT_TYPE_RENDERED,
+                command,
+                received_time,
+                preloaded=True,
+            )
+            continue
+        prev_url = cur_url
+        last_updated_time = time.time()
+        index, changed, preloaded = frame_pool.show(command)
+        # 表示する枠を先に描画し、スタイルで切り替えてから、止める動画などの他の枠を描画する
+        render_frames([i for i in changed if i == index])
+        style_placeholder.markdown(visibility_html(index), unsafe_allow_html=True)
+        render_frames([i for i in changed if i != index])
+        with right_placeholder:
+            # QRコードを表示（上部）
+            st.image(overlay_cache.get(cur_url))
+        # ブラウザ内での読み込み完了は分からないため、Streamlitへの描画指示を終えた時点を描画完了とする
+        url_channel.publish(
+            streamlit_server_pb2.DisplayEvent.EVENT_TYPE_RENDERED,
+            command,
+            received_time,
+            preloaded=preloaded,
+        )
+        print(
+            f"URL to render latency: {time.time() - received_time:.3f} [s] "
+            f"(preloaded: {preloaded}, frame pool hit: {frame_pool.hits}/{frame_pool.hits + frame_pool.misses}, "
+            f"{frame_pool.memory_mb:.0f} [MB])"
+        )
+        st.session_state.worker.tracer.start_trace(
+            "render", start_time=received_time, url=cur_url, preloaded=preloaded
+        ).end()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,174 @@
+import os
+import sys
+from typing import List
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from lib.sentence_segmenter import SentenceSegmenter
+
+
+def split(text: str, segmenter: SentenceSegmenter = None, chunk_size: int = 1) -> List[str]:
+    """LLMのストリームのようにchunk_size文字ずつ渡し、最後にflushした結果までを返す"""
+    if segmenter is None:
+        segmenter = SentenceSegmenter()
+    sentences = []
+    for pos in range(0, len(text), chunk_size):
+        sentences.extend(segmenter.feed(text[pos : pos + chunk_size]))
+    last = segmenter.flush()
+    if last is not None:
+        sentences.append(last)
+    return sentences
+
+
+def without_particle_split() -> SentenceSegmenter:
+    return SentenceSegmenter(first_max_chars=None)
+
+
+def test_split_at_hard_delimiters():
+    assert split("こんにちは。AKARIです。") == ["こんにちは。", "AKARIです。"]
+
+
+def test_chunk_size_does_not_change_result():
+    text = "申し訳ありません、その質問にはお答えできません。他に知りたいことはありますか？"
+    expected = split(text)
+    for chunk_size in (2, 3, 7, len(text)):
+        assert split(text, chunk_size=chunk_size) == expected
+
+
+def test_first_phrase_is_split_at_comma():
+    assert split("申し訳ありません、その質問にはお答えできません。") == [
+        "申し訳ありません、",
+        "その質問にはお答えできません。",
+    ]
+
+
+def test_first_phrase_shorter_than_first_min_chars_is_not_split():
+    assert split("はい、AKARIです。") == ["はい、AKARIです。"]
+
+
+def test_later_sentences_are_split_at_comma_only_when_long():
+    text = "はい。AKARIは、カメラを搭載しています。"
+    assert split(text) == ["はい。", "AKARIは、カメラを搭載しています。"]
+    segmenter = SentenceSegmenter(min_chars=4)
+    assert split(text, segmenter) == ["はい。", "AKARIは、", "カメラを搭載しています。"]
+
+
+def test_comma_split_can_be_disabled():
+    segmenter = SentenceSegmenter(first_min_chars=None, first_max_chars=None)
+    assert split("申し訳ありません、お答えできません。", segmenter) == [
+        "申し訳ありません、お答えできません。"
+    ]
+
+
+def test_first_phrase_is_split_after_particle_without_comma():
+    assert split("ステレオAIカメラのOAK-D Liteを搭載しています。") == [
+        "ステレオAIカメラの",
+        "OAK-D Liteを搭載しています。",
+    ]
+
+
+def test_first_phrase_is_not_split_inside_word():
+    # 「の」の後にひらがなが続く場合は語の途中とみなす
+    assert split("ステレオAIカメラのような機能です。") == ["ステレオAIカメラのような機能です。"]
+    # 2文目以降は助詞の後で区切らない
+    assert split("はい。ステレオAIカメラのOAK-D Liteです。") == [
+        "はい。",
+        "ステレオAIカメラのOAK-D Liteです。",
+    ]
+
+
+def test_no_split_inside_brackets():
+    assert split("「こんにちは。AKARIです。」と話します。", without_particle_split()) == [
+        "「こんにちは。AKARIです。」と話します。"
+    ]
+    assert split("『はい！』と答えます。", without_particle_split()) == ["『はい！』と答えます。"]
+    assert split("（例えば、顔認識。）が使えます。", without_particle_split()) == [
+        "（例えば、顔認識。）が使えます。"
+    ]
+
+
+def test_particle_split_after_closing_bracket():
+    assert split("「こんにちは。AKARIです。」と話します。") == [
+        "「こんにちは。AKARIです。」と",
+        "話します。",
+    ]
+
+
+def test_no_split_inside_quotes():
+    assert split('"Hello. World!"と表示します。', without_particle_split()) == [
+        '"Hello. World!"と表示します。'
+    ]
+    assert split("“こんにちは。”と話します。", without_particle_split()) == [
+        "“こんにちは。”と話します。"
+    ]
+
+
+def feed_all(text: str, segmenter: SentenceSegmenter) -> List[str]:
+    """flushせずに、1文字ずつのfeedで確定した文のみを返す"""
+    sentences = []
+    for char in text:
+        sentences.extend(segmenter.feed(char))
+    return sentences
+
+
+def test_unclosed_bracket_is_split_after_max_chars():
+    segmenter = SentenceSegmenter(max_chars=10)
+    # 括弧の中で分割した後の文は、閉じ括弧を待たずに区切る
+    assert feed_all("「あいうえおかきくけこ。さしすせそ。たちつてと。", segmenter) == [
+        "「あいうえおかきくけこ。",
+        "さしすせそ。",
+        "たちつてと。",
+    ]
+
+
+def test_unclosed_quote_is_split_after_max_chars():
+    segmenter = SentenceSegmenter(max_chars=10)
+    assert feed_all("“あいうえおかきくけこ。さしすせそ。たちつてと。", segmenter) == [
+        "“あいうえおかきくけこ。",
+        "さしすせそ。",
+        "たちつてと。",
+    ]
+
+
+def test_particle_split_with_small_first_max_chars():
+    for first_max_chars in (0, 1):
+        assert split("はい。", SentenceSegmenter(first_max_chars=first_max_chars)) == [
+            "はい。"
+        ]
+        assert split(
+            "AIのOAK-Dです。", SentenceSegmenter(first_max_chars=first_max_chars)
+        ) == ["AIの", "OAK-Dです。"]
+
+
+def test_no_split_inside_url():
+    text = "詳しくはhttps://akarigroup.github.io/docs/index.html?a=1!を見てください。"
+    assert split(text, without_particle_split()) == [text]
+    # URLの中の「.」「!」では区切らず、URLの後の助詞で区切る
+    assert split(text) == [
+        "詳しくはhttps://akarigroup.github.io/docs/index.html?a=1!を",
+        "見てください。",
+    ]
+    assert split("URLはhttp://example.com/a.b です。次へ。") == [
+        "URLはhttp://example.com/a.b です。",
+        "次へ。",
+    ]
+
+
+def test_repeated_exclamation_and_question_marks_stay_together():
+    assert split("すごい！！本当ですか？！はい。") == ["すごい！！", "本当ですか？！", "はい。"]
+    assert split("本当？」と聞きました。") == ["本当？」", "と聞きました。"]
+
+
+def test_flush_appends_period_only_when_needed():
+    assert split("こんにちは") == ["こんにちは。"]
+    assert split("こんにちは。") == ["こんにちは。"]
+    assert split("こんにちは！") == ["こんにちは！"]
+    # 句点の後の改行のみの残りは送らない
+    assert split("こんにちは。\n") == ["こんにちは。"]
+
+
+def test_flush_returns_none_for_empty_rest():
+    segmenter = SentenceSegmenter()
+    assert segmenter.feed("こんにちは。") == ["こんにちは。"]
+    assert segmenter.flush() is None
+    segmenter.feed("  ")
+    assert segmenter.flush() is None
@@ -0,0 +1,173 @@
+import hashlib
+import os
+import sys
+from typing import List, Optional
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from youtube_info_abstractor import load_catalog, save_catalog, sync_catalog
+
+CHANNEL_ID = "UC_test"
+PLAYLIST_ID = "UU_test"
+
+
+class FakeRequest(object):
+    def __init__(self, response: dict) -> None:
+        self.response = response
+
+    def execute(self) -> dict:
+        return self.response
+
+
+class FakeYouTube(object):
+    """YouTube Data APIのchannelsとplaylistItemsのみを再現するクライアント。
+
+    動画は新しい順に保持し、playlistItemのETagは実際のAPIと同様に並び順(position)によって変わる。
+    """
+
+    def __init__(self, num_videos: int, page_size: int = 2) -> None:
+        self.page_size = page_size
+        self.videos: List[dict] = []
+        for i in range(num_videos):
+            self.upload(f"v{i}", published_at=f"2024-01-{i + 1:02d}T00:00:00Z")
+        self.channel_requests = 0
+        self.page_requests: List[Optional[str]] = []
+
+    def upload(self, video_id: str, published_at: str) -> None:
+        self.videos.insert(
+            0,
+            {
+                "videoId": video_id,
+                "publishedAt": published_at,
+                "title": f"title {video_id}",
+                "description": f"description {video_id}",
+            },
+        )
+
+    def find(self, video_id: str) -> dict:
+        return next(v for v in self.videos if v["videoId"] == video_id)
+
+    def channels(self) -> "FakeYouTube":
+        return self
+
+    def playlistItems(self) -> "FakeYouTube":
+        return self
+
+    def list(
+        self,
+        part: str,
+        id: Optional[str] = None,
+        playlistId: Optional[str] = None,
+        maxResults: int = 50,
+        pageToken: Optional[str] = None,
+    ) -> FakeRequest:
+        if id is not None:
+            self.channel_requests += 1
+            return FakeRequest(
+                {"items": [{"contentDetails": {"relatedPlaylists": {"uploads": PLAYLIST_ID}}}]}
+            )
+        assert playlistId == PLAYLIST_ID
+        self.page_requests.append(pageToken)
+        start = int(pageToken) if pageToken else 0
+        items = []
+        for position in range(start, min(start + self.page_size, len(self.videos))):
+            video = self.videos[position]
+            etag = hashlib.sha1(f"{video}{position}".encode()).hexdigest()
+            items.append(
+                {
+                    "etag": etag,
+                    "snippet": {
+                        "position": position,
+                        "publishedAt": video["publishedAt"],
+                        "title": video["title"],
+                        "description": video["description"],
+                        "resourceId": {"videoId": video["videoId"]},
+                    },
+                }
+            )
+        response = {"items": items}
+        if start + self.page_size < len(self.videos):
+            response["nextPageToken"] = str(start + self.page_size)
+        return FakeRequest(response)
+
+
+def new_catalog() -> dict:
+    return {"channel_id": None, "playlist_id": None, "videos": {}}
+
+
+def test_first_sync_fetches_all_pages():
+    youtube = FakeYouTube(num_videos=5)
+    catalog = new_catalog()
+    counts = sync_catalog(youtube, CHANNEL_ID, catalog)
+    assert counts == {"added": 5, "updated": 0, "deleted": 0}
+    assert youtube.page_requests == [None, "2", "4"]
+    assert catalog["playlist_id"] == PLAYLIST_ID
+    assert catalog["videos"]["v0"]["url"] == "https://www.youtube.com/watch?v=v0"
+
+
+def test_unchanged_sync_stops_at_first_page_and_caches_playlist_id():
+    youtube = FakeYouTube(num_videos=5)
+    catalog = new_catalog()
+    sync_catalog(youtube, CHANNEL_ID, catalog)
+    youtube.page_requests.clear()
+    counts = sync_catalog(youtube, CHANNEL_ID, catalog)
+    assert counts == {"added": 0, "updated": 0, "deleted": 0}
+    assert youtube.page_requests == [None]
+    assert youtube.channel_requests == 1
+
+
+def test_new_upload_does_not_mark_shifted_videos_as_updated():
+    youtube = FakeYouTube(num_videos=5)
+    catalog = new_catalog()
+    sync_catalog(youtube, CHANNEL_ID, catalog)
+    youtube.upload("v5", published_at="2024-02-01T00:00:00Z")
+    youtube.page_requests.clear()
+    counts = sync_catalog(youtube, CHANNEL_ID, catalog)
+    # 全ての動画のpositionがずれてETagが変わっても、内容が同じ動画は更新しない
+    assert counts == {"added": 1, "updated": 0, "deleted": 0}
+    assert youtube.page_requests == [None, "2"]
+    assert "v5" in catalog["videos"]
+
+
+def test_changed_video_is_updated():
+    youtube = FakeYouTube(num_videos=5)
+    catalog = new_catalog()
+    sync_catalog(youtube, CHANNEL_ID, catalog)
+    youtube.find("v4")["description"] = "new description"
+    counts = sync_catalog(youtube, CHANNEL_ID, catalog)
+    assert counts == {"added": 0, "updated": 1, "deleted": 0}
+    assert catalog["videos"]["v4"]["description"] == "new description"
+
+
+def test_full_sync_removes_deleted_videos():
+    youtube = FakeYouTube(num_videos=5)
+    catalog = new_catalog()
+    sync_catalog(youtube, CHANNEL_ID, catalog)
+    youtube.videos.remove(youtube.find("v0"))
+    counts = sync_catalog(youtube, CHANNEL_ID, catalog)
+    assert counts["deleted"] == 0
+    assert "v0" in catalog["videos"]
+    youtube.page_requests.clear()
+    counts = sync_catalog(youtube, CHANNEL_ID, catalog, full=True)
+    assert counts == {"added": 0, "updated": 0, "deleted": 1}
+    assert youtube.page_requests == [None, "2"]
+    assert "v0" not in catalog["videos"]
+
+
+def test_channel_change_refetches_playlist_id():
+    youtube = FakeYouTube(num_videos=2)
+    catalog = new_catalog()
+    sync_catalog(youtube, CHANNEL_ID, catalog)
+    counts = sync_catalog(youtube, "UC_other", catalog)
+    assert youtube.channel_requests == 2
+    assert counts["added"] == 2
+
+
+def test_save_catalog_replaces_file(tmp_path):
+    youtube = FakeYouTube(num_videos=3)
+    catalog = new_catalog()
+    sync_catalog(youtube, CHANNEL_ID, catalog)
+    path = tmp_path / "youtube_catalog.json"
+    path.write_text("old", encoding="utf-8")
+    save_catalog(str(path), catalog)
+    assert load_catalog(str(path)) == catalog
+    assert [p.name for p in tmp_path.iterdir()] == ["youtube_catalog.json"]
@@ -0,0 +1,80 @@
+import argparse
+import json
+import math
+from collections import defaultdict
+from typing import Dict, List
+
+
+def percentile(values: List[float], p: float) -> float:
+    """最近傍順位法でパーセンタイル値を求める。
+
+    Args:
+        values (List[float]): 昇順にソートされた値のリスト
+        p (float): パーセンタイル(0~100)
+
+    Returns:
+        float: パーセンタイル値
+    """
+    index = max(math.ceil(len(values) * p / 100) - 1, 0)
+    return values[index]
+
+
+def load_spans(paths: List[str]) -> List[dict]:
+    spans = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    spans.append(json.loads(line))
+    return spans
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="+", type=str, help="Trace JSONL files")
+    parser.add_argument("-s", "--service", type=str, help="Filter by service name")
+    parser.add_argument(
+        "--include_partial",
+        action="store_true",
+        help="Include traces of partial speech recognition results",
+    )
+    args = parser.parse_args()
+    spans = load_spans(args.paths)
+    # 途中結果(is_finish=False)のtraceは既定では除外する
+    partial_traces = set()
+    for span in spans:
+        if span["parent_span_id"] is None and not span["attributes"].get("is_finish", True):
+            partial_traces.add(span["trace_id"])
+    durations: Dict[tuple, List[float]] = defaultdict(list)
+    offsets: Dict[tuple, List[float]] = defaultdict(list)
+    seen = set()
+    for span in spans:
+        if args.service is not None and span["service"] != args.service:
+            continue
+        if not args.include_partial and span["trace_id"] in partial_traces:
+            continue
+        key = (span["service"], span["name"])
+        durations[key].append(span["duration_ms"])
+        # 同じtrace内で複数回出るspanは、受信からの時間を初回のみ集計する
+        if (span["trace_id"], key) not in seen:
+            seen.add((span["trace_id"], key))
+            offsets[key].append(span["offset_ms"])
+    print(
+        f"{'service':<24} {'span':<18} {'count':>6} "
+        f"{'dur p50':>9} {'dur p95':>9} {'dur p99':>9} "
+        f"{'at p50':>9} {'at p95':>9} {'at p99':>9}  [ms]"
+    )
+    for key in sorted(durations, key=lambda k: (k[0], percentile(sorted(offsets[k]), 50))):
+        duration = sorted(durations[key])
+        offset = sorted(offsets[key])
+        print(
+            f"{key[0]:<24} {key[1]:<18} {len(duration):>6} "
+            f"{percentile(duration, 50):>9.1f} {percentile(duration, 95):>9.1f} "
+            f"{percentile(duration, 99):>9.1f} "
+            f"{percentile(offset, 50):>9.1f} {percentile(offset, 95):>9.1f} "
+            f"{percentile(offset, 99):>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
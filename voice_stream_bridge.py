@@ -0,0 +1,44 @@
+import argparse
+import os
+import sys
+from concurrent import futures
+
+import grpc
+from lib.voice_stream_bridge import add_voice_server_proxy, add_voice_stream_bridge
+
+sys.path.append(
+    os.path.join(os.path.dirname(__file__), "lib/akari_chatgpt_bot/lib/grpc")
+)
+import voice_server_pb2_grpc
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--ip", help="Ip address", default="0.0.0.0", type=str, required=False
+    )
+    parser.add_argument(
+        "--port", help="Port number", default="10003", type=str, required=False
+    )
+    parser.add_argument(
+        "--voice_address",
+        default="localhost:10002",
+        type=str,
+        help="Existing voice server address to forward events",
+    )
+    args = parser.parse_args()
+    voice = voice_server_pb2_grpc.VoiceServerServiceStub(
+        grpc.insecure_channel(args.voice_address)
+    )
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    add_voice_stream_bridge(server, voice)
+    # ストリームを使えない場合のunary RPCも同じポートで受け付けて転送する
+    add_voice_server_proxy(server, voice)
+    server.add_insecure_port(args.ip + ":" + args.port)
+    server.start()
+    print(f"voice_stream_bridge start. port: {args.port} -> {args.voice_address}")
+    server.wait_for_termination()
+
+
+if __name__ == "__main__":
+    main()
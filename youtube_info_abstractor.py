@@ -1,38 +1,41 @@
 import argparse
+import json
 import os
+import tempfile
 from datetime import datetime
-from typing import Any, List
-from datetime import datetime, timezone
+from typing import Any, Dict, Iterator
 
 YOUTUBE_APIKEY = os.environ.get("YOUTUBE_API_KEY")
-from googleapiclient.discovery import build
 
 
-def get_channel_videos(channel_id: str) -> List[Any]:
-    """YouTubeチャンネルのアップロード済み動画のリストを取得する。
+def get_uploads_playlist_id(youtube: Any, channel_id: str) -> str:
+    """YouTubeチャンネルのアップロード済み動画のプレイリストIDを取得する。
     Args:
+        youtube (Any): YouTube Data APIのクライアント
         channel_id (str): YouTubeチャンネルID
-        date_after (datetime): この日付以降にアップロードされた動画のみ取得する
 
     Returns:
-        list: Youtube動画のURL、タイトル、投稿日時のリスト
+        str: アップロード済み動画のプレイリストID
     """
-    youtube = build("youtube", "v3", developerKey=YOUTUBE_APIKEY)
+    channel_response = (
+        youtube.channels().list(part="contentDetails", id=channel_id).execute()
+    )
+    return channel_response["items"][0]["contentDetails"]["relatedPlaylists"][
+        "uploads"
+    ]
 
-    videos = []
-    next_page_token = None
 
-    while True:
-        # チャンネルのアップロード済みビデオプレイリストを取得
-        channel_response = (
-            youtube.channels().list(part="contentDetails", id=channel_id).execute()
-        )
-
-        playlist_id = channel_response["items"][0]["contentDetails"][
-            "relatedPlaylists"
-        ]["uploads"]
+def iter_playlist_pages(youtube: Any, playlist_id: str) -> Iterator[list]:
+    """プレイリストの動画を1ページずつ取得する。
+    Args:
+        youtube (Any): YouTube Data APIのクライアント
+        playlist_id (str): プレイリストID
 
-        # プレイリストの動画を取得
+    Yields:
+        list: 1ページ分のplaylistItemのリスト
+    """
+    next_page_token = None
+    while True:
         playlist_response = (
             youtube.playlistItems()
             .list(
@@ -43,22 +46,109 @@ def get_channel_videos(channel_id: str) -> List[Any]:
             )
             .execute()
         )
-
-        for item in playlist_response["items"]:
-            video_id = item["snippet"]["resourceId"]["videoId"]
-            video_title = item["snippet"]["title"]
-            video_description = item["snippet"]["description"]
-            published_at = datetime.fromisoformat(
-                item["snippet"]["publishedAt"].replace("Z", "+00:00")
-            )
-            video_url = f"https://www.youtube.com/watch?v={video_id}"
-            videos.append((video_url, video_title, published_at, video_description))
-
+        yield playlist_response["items"]
         next_page_token = playlist_response.get("nextPageToken")
         if not next_page_token:
             break
 
-    return videos
+
+def video_record(item: dict) -> dict:
+    # playlistItemのETagは新しい動画の追加で並び順(position)がずれるだけで変わるため、
+    # 変更の判定には動画ID、公開日時、タイトル、説明文のみを使う
+    snippet = item["snippet"]
+    video_id = snippet["resourceId"]["videoId"]
+    return {
+        "url": f"https://www.youtube.com/watch?v={video_id}",
+        "title": snippet["title"],
+        "published_at": snippet["publishedAt"],
+        "description": snippet["description"],
+    }
+
+
+def load_catalog(path: str) -> dict:
+    if not os.path.exists(path):
+        return {"channel_id": None, "playlist_id": None, "videos": {}}
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_catalog(path: str, catalog: dict) -> None:
+    # 書き込み中に終了してもカタログが壊れないよう、一時ファイルに書き込んでから置き換える
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", dir=directory, suffix=".tmp", delete=False
+    ) as save_file:
+        json.dump(catalog, save_file, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(save_file.name, path)
+
+
+def sync_catalog(
+    youtube: Any, channel_id: str, catalog: dict, full: bool = False
+) -> Dict[str, int]:
+    """ローカルのカタログをYouTubeチャンネルのアップロード済み動画と同期する。
+    アップロード済み動画のプレイリストは新しい順に並んでいるため、通常は既知で変更のない動画のみのページに達した時点で取得を終える。
+    それより古い動画のタイトルや説明文の変更を反映する場合はfullを指定する。
+    Args:
+        youtube (Any): YouTube Data APIのクライアント
+        channel_id (str): YouTubeチャンネルID
+        catalog (dict): 同期するカタログ。動画IDをキーに、動画情報を保持する。
+        full (bool, optional): Trueの場合は全ページを取得し、削除された動画をカタログから除く。デフォルトはFalse。
+
+    Returns:
+        Dict[str, int]: 追加、更新、削除した動画の数
+    """
+    # プレイリストIDは変わらないため、チャンネルが同じであれば再取得しない
+    if catalog.get("channel_id") != channel_id or not catalog.get("playlist_id"):
+        catalog["channel_id"] = channel_id
+        catalog["playlist_id"] = get_uploads_playlist_id(youtube, channel_id)
+        catalog["videos"] = {}
+    videos = catalog["videos"]
+    counts = {"added": 0, "updated": 0, "deleted": 0}
+    seen = set()
+    for items in iter_playlist_pages(youtube, catalog["playlist_id"]):
+        page_changed = False
+        for item in items:
+            video_id = item["snippet"]["resourceId"]["videoId"]
+            seen.add(video_id)
+            known = videos.get(video_id)
+            record = video_record(item)
+            if known == record:
+                continue
+            videos[video_id] = record
+            counts["added" if known is None else "updated"] += 1
+            page_changed = True
+        if not full and not page_changed:
+            break
+    if full:
+        for video_id in [v for v in videos if v not in seen]:
+            del videos[video_id]
+            counts["deleted"] += 1
+    return counts
+
+
+def write_videos_text(path: str, catalog: dict) -> None:
+    """カタログの動画を新しい順にテキストファイルに書き出す。
+    一時ファイルに1件ずつ書き込み、完了後に置き換える。
+    Args:
+        path (str): 保存先のファイルパス
+        catalog (dict): 動画のカタログ
+    """
+    videos = sorted(
+        catalog["videos"].values(), key=lambda v: v["published_at"], reverse=True
+    )
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", dir=directory, suffix=".tmp", delete=False
+    ) as save_file:
+        for video in videos:
+            date = datetime.fromisoformat(video["published_at"].replace("Z", "+00:00"))
+            save_file.write(
+                f"Title: {video['title']}\nURL: {video['url']}\nDate: {date}\n"
+                f"Description: {video['description']}\n\n"
+            )
+            save_file.write("==============================\n")
+    os.replace(save_file.name, path)
 
 
 def main() -> None:
@@ -71,17 +161,30 @@ def main() -> None:
         default="UCM7QPeFX99QHm9e825Ndu3w",
     )
     parser.add_argument("-s", "--save_path", type=str, help="path to save text files")
+    parser.add_argument(
+        "--catalog",
+        type=str,
+        default="youtube_catalog.json",
+        help="local video catalog file (json)",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="fetch all pages and remove deleted videos from the catalog",
+    )
     args = parser.parse_args()
-    video_list = get_channel_videos(args.channel_id)
+    from googleapiclient.discovery import build
 
-    output_text = ""
-    for url, title, date,description in video_list:
-        output_text += f"Title: {title}\nURL: {url}\nDate: {date}\nDescription: {description}\n\n"
-        output_text += "==============================\n"
+    youtube = build("youtube", "v3", developerKey=YOUTUBE_APIKEY)
+    catalog = load_catalog(args.catalog)
+    counts = sync_catalog(youtube, args.channel_id, catalog, full=args.full)
+    save_catalog(args.catalog, catalog)
+    print(
+        f"{len(catalog['videos'])} videos (added: {counts['added']}, "
+        f"updated: {counts['updated']}, deleted: {counts['deleted']})"
+    )
     if args.save_path:
-        path = f"{args.save_path}/youtube_videos.txt"
-        with open(path, "w", encoding="utf-8") as save_file:
-            save_file.write(output_text)
+        write_videos_text(f"{args.save_path}/youtube_videos.txt", catalog)
 
 
 if __name__ == "__main__":